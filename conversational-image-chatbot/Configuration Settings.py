@@ -9,9 +9,45 @@ class Config:
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    MAX_IMAGE_PIXELS = 40 * 1000 * 1000  # width x height budget, checked from the header while streaming
+    
+    # Batch upload settings (/api/upload/batch); each image is still held to MAX_CONTENT_LENGTH
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))  # images per request
+    BATCH_MAX_TOTAL_BYTES = int(os.environ.get('BATCH_MAX_TOTAL_BYTES', 256 * 1024 * 1024))  # whole request body
+    BATCH_MAX_QUERIES_PER_ITEM = 10
+    BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 8))  # queries analyzed concurrently
+    
+    # Thumbnail settings
+    THUMBNAIL_FOLDER = os.path.join('uploads', 'thumbnails')
+    THUMBNAIL_SIZES = {'small': (150, 150), 'medium': (320, 320), 'large': (640, 640)}
+    THUMBNAIL_WORKERS = 2
+    THUMBNAIL_QUALITY = 85  # JPEG quality
+    THUMBNAIL_TIMEOUT = 10  # seconds a request waits for a thumbnail still being generated
+    THUMBNAIL_MAX_AGE = 365 * 24 * 3600  # thumbnails are content-addressed, so clients cache them for a year
     
     # Database settings
     DATABASE_PATH = 'chatbot.db'
+    DB_POOL_SIZE = 8  # idle connections kept for reuse
+    DB_JOURNAL_MODE = 'WAL'
+    DB_SYNCHRONOUS = 'NORMAL'
+    DB_CACHE_SIZE = -20000  # negative values are KiB, about 20MB of page cache per connection
+    DB_MMAP_SIZE = 256 * 1024 * 1024
+    DB_BUSY_TIMEOUT = 5000  # milliseconds
+    DB_STATEMENT_CACHE_SIZE = 128  # prepared statements cached per connection
+    
+    # Write-behind (group commit) settings for chat/query logging
+    DB_WRITE_BEHIND = os.environ.get('DB_WRITE_BEHIND', '0') == '1'
+    DB_WRITE_BEHIND_BATCH_ROWS = 200  # commit after this many queued rows
+    DB_WRITE_BEHIND_INTERVAL_MS = 20  # or after the oldest row has waited this long
+    DB_WRITE_BEHIND_QUEUE_SIZE = 10000  # submitters block when this many rows are pending
+    DB_WRITE_BEHIND_PUT_TIMEOUT = 5  # seconds to block before giving up
+    
+    # Data retention settings
+    RETENTION_ENABLED = True
+    RETENTION_DAYS = 30
+    RETENTION_BATCH_SIZE = 500  # rows deleted per transaction
+    RETENTION_PAUSE_MS = 50  # pause between batches so request writers get the lock
+    RETENTION_INTERVAL_SECONDS = 3600
     
     # Session settings
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
@@ -19,14 +55,72 @@ class Config:
     # CORS settings
     CORS_HEADERS = 'Content-Type'
     
-    # Model settings (for future implementation)
+    # Model settings
     CNN_MODEL = 'mobilenet_v2'
     NLP_MODEL = 'distilbert-base-uncased'
-    MODEL_PATH = 'models/'
+    MODEL_PATH = 'models/'  # local weights, and the download cache otherwise
+    MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'auto')  # 'torch', 'prototype' (no models) or 'auto'
+    MODEL_QUANTIZE = os.environ.get('MODEL_QUANTIZE', '0') == '1'  # int8 weights for CPU inference
+    MODEL_INTRA_OP_THREADS = int(os.environ.get('MODEL_INTRA_OP_THREADS', 0))  # threads per operator, 0 = torch default
+    MODEL_INTER_OP_THREADS = int(os.environ.get('MODEL_INTER_OP_THREADS', 0))  # parallel operators, 0 = torch default
+    NLP_MAX_TOKENS = 128  # queries are truncated to this; batches are padded only to their longest query
+    NLP_PAD_TO_MULTIPLE_OF = 8  # round padded batch widths up to this
+    NLP_TOKEN_CACHE_SIZE = 4096  # token ID lists of recent queries kept, 0 = no cache
+    
+    # Inference batching settings
+    INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+    INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))
+    INFERENCE_TIMEOUT = 30  # seconds
+    MODEL_WARMUP_BATCH_SIZES = (1, INFERENCE_MAX_BATCH_SIZE)  # synthetic batches run at boot
+    MODEL_WARMUP_ITERATIONS = 2
+    
+    # Feature store settings (CNN feature vectors kept for /api/similar and reused instead of re-running the CNN)
+    FEATURE_STORE_PATH = 'features'
+    FEATURE_STORE_DTYPE = 'float16'  # half the size; 'float32' scans faster without an index. Changing it starts a new store
+    FEATURE_SEARCH_BLOCK_ROWS = 4096  # rows scored per vectorized step
+    FEATURE_INDEX_LISTS = int(os.environ.get('FEATURE_INDEX_LISTS', 0))  # IVF lists, 0 = always scan every row
+    FEATURE_INDEX_PROBES = 8  # lists scored per search
+    FEATURE_INDEX_MIN_ROWS = 100000  # exact scans stay fast enough below this
+    SIMILAR_MAX_K = 100
+    
+    # Intent routing settings for the canned responses
+    INTENTS_FILE = os.environ.get('INTENTS_FILE')  # optional JSON {"image": [...], "chat": [...]} of extra intents
+    
+    # Serving settings for the ASGI mode (run_script.py --server asgi)
+    ASGI_MAX_THREADS = int(os.environ.get('ASGI_MAX_THREADS', 32))  # threads running request handlers
+    ASGI_MAX_PENDING = int(os.environ.get('ASGI_MAX_PENDING', 256))  # requests in flight before new ones get 503
+    OFFLOAD_WORKERS = int(os.environ.get('OFFLOAD_WORKERS', 0))  # processes for decode/preprocess/inference, 0 = inline
+    OFFLOAD_MAX_PENDING = int(os.environ.get('OFFLOAD_MAX_PENDING', 64))  # offloaded tasks queued before requests get 503
+    OFFLOAD_START_METHOD = 'spawn'  # fork is unsafe once background threads are running
+    
+    # Production (preforking) runner settings (run_script.py --server prefork)
+    PREFORK_WORKERS = int(os.environ.get('PREFORK_WORKERS', os.cpu_count() or 1))
+    PREFORK_MAX_REQUESTS = int(os.environ.get('PREFORK_MAX_REQUESTS', 1000))  # recycle a worker after this many, 0 = never
+    PREFORK_MAX_REQUESTS_JITTER = 100  # spread recycling so workers do not restart together
+    PREFORK_GRACEFUL_TIMEOUT = 30  # seconds workers get to finish in-flight requests
+    
+    # Inference result cache settings
+    RESULT_CACHE_MAX_ENTRIES = 1024
+    RESULT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+    RESULT_CACHE_TTL = 3600  # seconds, in-process tier
+    RESULT_CACHE_PERSISTENT_TTL = 7 * 24 * 3600  # seconds, SQLite tier
+    
+    # Instrumentation settings
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # stage/request histograms served at /metrics
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # X-Admin-Token for /api/admin/*, unset = admin endpoints disabled
+    PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', 10))  # stack sampling period
+    PROFILER_MAX_SECONDS = 300  # longest on-demand profile
+    SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000))  # 0 = do not record
+    SLOW_REQUEST_BUFFER_SIZE = 100  # slow requests kept, oldest dropped first
+    SLOW_REQUEST_TOP_STACKS = 10  # most frequent stack samples kept per slow request
     
     # API settings
     API_VERSION = 'v1'
     API_PREFIX = '/api'
+    HISTORY_MAX_PAGE_SIZE = 200
+    SEARCH_MAX_PAGE_SIZE = 100
+    SEARCH_SNIPPET_TOKENS = 16  # words of context around matches in search snippets
+    SEARCH_RANK_WINDOW = 20000  # newest matches per table ranked by relevance, 0 = rank every match
     
     # Debug mode
     DEBUG = True
@@ -1,22 +1,313 @@
+import logging
+import queue
+import re
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
 import json
+from concurrent.futures import Future
+from config import Config
+from metrics import timed
+from write_behind import WriteBehindQueue
+from retention import RetentionJob
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+def _migration_content_hash(cursor):
+    """Content-addressed uploads: hash column with a unique index"""
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(image_uploads)')]
+    if 'content_hash' not in columns:
+        cursor.execute('ALTER TABLE image_uploads ADD COLUMN content_hash TEXT')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_image_uploads_content_hash
+        ON image_uploads (content_hash)
+    ''')
+
+def _migration_inference_cache(cursor):
+    """Second tier of the inference result cache"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inference_cache (
+            cache_key TEXT PRIMARY KEY,
+            model_version TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_history_indexes(cursor):
+    """Indexes for keyset-paginated chat history and recent queries"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_history_session_timestamp
+        ON chat_history (session_id, timestamp, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queries_query_timestamp
+        ON queries (query_timestamp)
+    ''')
+
+# Tables whose rows are counted and rolled up, with their counter name and timestamp column
+STATISTICS_TABLES = {
+    'chat_history': ('total_messages', 'timestamp'),
+    'image_uploads': ('total_images', 'upload_timestamp'),
+    'queries': ('total_queries', 'query_timestamp'),
+}
+
+def _migration_statistics(cursor):
+    """Trigger-maintained row counters and an hourly activity rollup"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_rollup (
+            bucket TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (bucket, table_name)
+        ) WITHOUT ROWID
+    ''')
+    
+    for table, (counter, timestamp_column) in STATISTICS_TABLES.items():
+        cursor.execute('INSERT OR IGNORE INTO stats_counters (name, value) VALUES (?, 0)', (counter,))
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE stats_counters SET value = value + 1 WHERE name = '{counter}';
+                INSERT INTO activity_rollup (bucket, table_name, count)
+                VALUES (strftime('%Y-%m-%d %H:00:00', COALESCE(NEW.{timestamp_column}, CURRENT_TIMESTAMP)), '{table}', 1)
+                ON CONFLICT (bucket, table_name) DO UPDATE SET count = count + 1;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE stats_counters SET value = value - 1 WHERE name = '{counter}';
+            END
+        ''')
+    
+    # Existing rows are counted by the backfill command; empty databases are already exact
+    has_rows = any(
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table})').fetchone()[0]
+        for table in STATISTICS_TABLES
+    )
+    cursor.execute(
+        'INSERT OR IGNORE INTO stats_counters (name, value) VALUES (?, ?)',
+        ('backfilled', 0 if has_rows else 1)
+    )
+
+def _migration_retention(cursor):
+    """Indexes driving the retention job and its crash-recovery journal"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_image_uploads_upload_timestamp
+        ON image_uploads (upload_timestamp, id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp
+        ON chat_history (timestamp)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_queries_image_id
+        ON queries (image_id, query_timestamp)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS retention_journal (
+            image_id INTEGER PRIMARY KEY,
+            file_path TEXT NOT NULL
+        )
+    ''')
+
+# Full-text indexed tables: base table -> (FTS5 table, indexed columns)
+SEARCH_TABLES = {
+    'chat_history': ('chat_history_fts', ('content',)),
+    'queries': ('queries_fts', ('query_text', 'response_text')),
+}
+
+def _migration_search(cursor):
+    """FTS5 indexes over chat messages and queries, kept in sync by triggers"""
+    for table, (fts_table, columns) in SEARCH_TABLES.items():
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'NEW.{column}' for column in columns)
+        old_values = ', '.join(f'OLD.{column}' for column in columns)
+        
+        # External content: the index stores no copy of the text, snippets read it from the base table
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                {column_list},
+                content='{table}', content_rowid='id',
+                tokenize='porter unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update AFTER UPDATE OF {column_list} ON {table}
+            BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+            END
+        ''')
+        # Index rows written before this migration
+        cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+
+# Schema migrations as (version, description, function); versions are stored in PRAGMA user_version
+MIGRATIONS = [
+    (1, 'content hash column on image_uploads', _migration_content_hash),
+    (2, 'inference_cache table', _migration_inference_cache),
+    (3, 'chat history and query timestamp indexes', _migration_history_indexes),
+    (4, 'statistics counters and activity rollup', _migration_statistics),
+    (5, 'retention indexes and journal', _migration_retention),
+    (6, 'full-text search over chat history and queries', _migration_search),
+]
+
+# Words of a search, matched as quoted terms so punctuation in user input is never FTS5 syntax
+_SEARCH_TERM = re.compile(r'\w+')
+
+def fts_query(text, prefix=False):
+    """FTS5 MATCH expression requiring every word of free text (the last as a prefix with prefix=True)"""
+    terms = [f'"{term}"' for term in _SEARCH_TERM.findall(text or '')]
+    if terms and prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+class PooledConnection:
+    """sqlite3 connection wrapper whose close() hands the connection back to the pool"""
+    
+    def __init__(self, conn, database):
+        self._conn = conn
+        self._database = database
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def close(self):
+        """Return the connection to the pool"""
+        if self._conn is not None:
+            self._database._release(self._conn)
+            self._conn = None
 
 class Database:
     """Database handler for chat history and user interactions"""
     
-    def __init__(self, db_path='chatbot.db'):
+    def __init__(self, db_path='chatbot.db', pool_size=None, journal_mode=None, synchronous=None,
+                 cache_size=None, mmap_size=None, busy_timeout=None, statement_cache_size=None,
+                 write_behind=None):
         self.db_path = db_path
+        self.pool_size = Config.DB_POOL_SIZE if pool_size is None else pool_size
+        self.journal_mode = (journal_mode or Config.DB_JOURNAL_MODE).upper()
+        self.synchronous = (synchronous or Config.DB_SYNCHRONOUS).upper()
+        self.cache_size = Config.DB_CACHE_SIZE if cache_size is None else cache_size
+        self.mmap_size = Config.DB_MMAP_SIZE if mmap_size is None else mmap_size
+        self.busy_timeout = Config.DB_BUSY_TIMEOUT if busy_timeout is None else busy_timeout
+        self.statement_cache_size = (
+            Config.DB_STATEMENT_CACHE_SIZE if statement_cache_size is None else statement_cache_size
+        )
+        
+        if self.journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Unsupported journal_mode: {self.journal_mode}")
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unsupported synchronous mode: {self.synchronous}")
+        
+        # Idle connections, most recently used first
+        self._idle = queue.LifoQueue(maxsize=max(self.pool_size, 1))
+        self._stats_lock = threading.Lock()
+        self._connection_stats = {'opened': 0, 'reused': 0, 'closed': 0}
+        
         self.init_db()
+        
+        # Optional group-commit writer for add_chat_message, add_image_upload and add_query
+        if write_behind is None:
+            write_behind = Config.DB_WRITE_BEHIND
+        self.write_behind = WriteBehindQueue(
+            self,
+            batch_rows=Config.DB_WRITE_BEHIND_BATCH_ROWS,
+            interval_ms=Config.DB_WRITE_BEHIND_INTERVAL_MS,
+            max_queue=Config.DB_WRITE_BEHIND_QUEUE_SIZE,
+            put_timeout=Config.DB_WRITE_BEHIND_PUT_TIMEOUT
+        ) if write_behind else None
     
     def get_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
+        """Get a pooled database connection (close() returns it to the pool)"""
+        try:
+            conn = self._idle.get_nowait()
+            self._count('reused')
+        except queue.Empty:
+            conn = self._connect()
+        return PooledConnection(conn, self)
+    
+    def _connect(self):
+        """Open a new connection with the configured pragmas"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout / 1000.0,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
         conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        self._count('opened')
         return conn
     
+    def _release(self, conn):
+        """Put a connection back in the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        
+        if self.pool_size > 0:
+            try:
+                self._idle.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        
+        conn.close()
+        self._count('closed')
+    
+    def _count(self, name):
+        with self._stats_lock:
+            self._connection_stats[name] += 1
+    
+    def close(self):
+        """Flush queued writes and close all idle pooled connections"""
+        if self.write_behind is not None:
+            self.write_behind.close()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            self._count('closed')
+    
+    def get_connection_stats(self):
+        """Get connection pool statistics"""
+        with self._stats_lock:
+            stats = dict(self._connection_stats)
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['opened'] - stats['closed'] - stats['idle']
+        stats['pool_size'] = self.pool_size
+        return stats
+    
     def init_db(self):
-        """Initialize database tables"""
+        """Initialize database tables and apply pending schema migrations"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -58,9 +349,73 @@ class Database:
         
         conn.commit()
         conn.close()
+        
+        self.migrate()
+        
+        # Warned once at startup: get_statistics counts rows until the counters are backfilled
+        conn = self.get_connection()
+        backfilled = conn.execute("SELECT value FROM stats_counters WHERE name = 'backfilled'").fetchone()
+        conn.close()
+        if not (backfilled and backfilled['value']):
+            logger.warning("Statistics not backfilled yet, counting rows until then "
+                           "(run: python run_script.py --backfill-stats)")
+    
+    def get_schema_version(self):
+        """Get the schema version recorded in the database"""
+        conn = self.get_connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+        return version
     
-    def add_chat_message(self, session_id, message_type, content, image_path=None):
-        """Add a chat message to history"""
+    def migrate(self):
+        """Apply schema migrations newer than the recorded version, one transaction each"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            for version, description, migration in MIGRATIONS:
+                # Re-read inside the write lock so concurrent workers apply each migration once
+                cursor.execute('BEGIN IMMEDIATE')
+                if cursor.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    conn.rollback()
+                    continue
+                
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def _queue_insert(self, table, columns, values, wait, unique_column=None, update_columns=()):
+        """Queue an insert on the write-behind writer"""
+        future = self.write_behind.submit(table, columns, values, unique_column, update_columns)
+        return future.result() if wait else future
+    
+    @staticmethod
+    def _completed(row_id, wait):
+        """Return row_id directly, or as a resolved Future when the caller asked not to wait"""
+        if wait:
+            return row_id
+        future = Future()
+        future.set_result(row_id)
+        return future
+    
+    @timed('db.add_chat_message')
+    def add_chat_message(self, session_id, message_type, content, image_path=None, wait=True):
+        """Add a chat message to history
+        
+        With wait=False a Future for the row id is returned instead, and in
+        write-behind mode the insert is committed off the calling thread.
+        """
+        if self.write_behind is not None:
+            return self._queue_insert(
+                'chat_history', ('session_id', 'message_type', 'content', 'image_path'),
+                (session_id, message_type, content, image_path), wait
+            )
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -73,43 +428,124 @@ class Database:
         message_id = cursor.lastrowid
         conn.close()
         
-        return message_id
+        return self._completed(message_id, wait)
     
-    def get_chat_history(self, session_id, limit=50):
-        """Get chat history for a session"""
+    @timed('db.get_chat_history')
+    def get_chat_history(self, session_id, limit=50, before_id=None):
+        """Get chat history for a session, newest first
+        
+        Pass the id of the last message of a page as before_id to fetch the
+        next (older) page; keyset pagination keeps every page an index seek.
+        If that message has since been deleted (e.g. by retention), paging
+        continues from messages with smaller ids, which are the older ones.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT * FROM chat_history
-            WHERE session_id = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (session_id, limit))
+        cursor_row = None
+        if before_id is not None:
+            cursor_row = cursor.execute('SELECT timestamp FROM chat_history WHERE id = ?', (before_id,)).fetchone()
+        
+        if before_id is None:
+            cursor.execute('''
+                SELECT * FROM chat_history
+                WHERE session_id = ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (session_id, limit))
+        elif cursor_row is not None:
+            cursor.execute('''
+                SELECT * FROM chat_history
+                WHERE session_id = ?
+                  AND (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (session_id, cursor_row['timestamp'], before_id, limit))
+        else:
+            cursor.execute('''
+                SELECT * FROM chat_history
+                WHERE session_id = ? AND id < ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (session_id, before_id, limit))
         
         rows = cursor.fetchall()
         conn.close()
         
         return [dict(row) for row in rows]
     
-    def add_image_upload(self, filename, original_filename, file_path, file_size):
-        """Record an image upload"""
+    @timed('db.add_image_upload')
+    def add_image_upload(self, filename, original_filename, file_path, file_size, content_hash=None, wait=True):
+        """Record an image upload
+        
+        Uploads are deduplicated on content_hash: recording content that is
+        already stored keeps the existing row and its id, pointing it at the
+        newly stored file (callers only store content again when the
+        recorded file has gone missing).
+        """
+        if self.write_behind is not None:
+            return self._queue_insert(
+                'image_uploads', ('filename', 'original_filename', 'file_path', 'file_size', 'content_hash'),
+                (filename, original_filename, file_path, file_size, content_hash), wait,
+                unique_column='content_hash', update_columns=('filename', 'file_path')
+            )
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO image_uploads (filename, original_filename, file_path, file_size)
-            VALUES (?, ?, ?, ?)
-        ''', (filename, original_filename, file_path, file_size))
+            INSERT INTO image_uploads (filename, original_filename, file_path, file_size, content_hash)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(content_hash) DO UPDATE SET filename = excluded.filename, file_path = excluded.file_path
+        ''', (filename, original_filename, file_path, file_size, content_hash))
+        
+        if content_hash is None:
+            image_id = cursor.lastrowid
+        else:
+            # lastrowid is not set when the conflicting row was updated instead
+            cursor.execute('SELECT id FROM image_uploads WHERE content_hash = ?', (content_hash,))
+            image_id = cursor.fetchone()['id']
         
         conn.commit()
-        image_id = cursor.lastrowid
         conn.close()
         
-        return image_id
+        return self._completed(image_id, wait)
+    
+    @timed('db.get_image_upload')
+    def get_image_upload(self, image_id):
+        """Get a stored upload by id"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM image_uploads WHERE id = ?', (image_id,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        
+        return dict(row) if row else None
+    
+    @timed('db.get_image_by_hash')
+    def get_image_by_hash(self, content_hash):
+        """Get the stored upload with the given content hash"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM image_uploads WHERE content_hash = ?', (content_hash,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        
+        return dict(row) if row else None
     
-    def add_query(self, image_id, query_text, response_text):
+    @timed('db.add_query')
+    def add_query(self, image_id, query_text, response_text, wait=True):
         """Record a query and response"""
+        if self.write_behind is not None:
+            return self._queue_insert(
+                'queries', ('image_id', 'query_text', 'response_text'),
+                (image_id, query_text, response_text), wait
+            )
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -122,8 +558,9 @@ class Database:
         query_id = cursor.lastrowid
         conn.close()
         
-        return query_id
+        return self._completed(query_id, wait)
     
+    @timed('db.get_recent_queries')
     def get_recent_queries(self, limit=10):
         """Get recent queries"""
         conn = self.get_connection()
@@ -142,20 +579,49 @@ class Database:
         
         return [dict(row) for row in rows]
     
-    def clear_old_data(self, days=30):
-        """Clear data older than specified days"""
+    @timed('db.get_cached_result')
+    def get_cached_result(self, cache_key, now):
+        """Get an unexpired cached inference result"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            DELETE FROM chat_history
-            WHERE timestamp < datetime('now', '-' || ? || ' days')
-        ''', (days,))
+            SELECT value, expires_at FROM inference_cache
+            WHERE cache_key = ? AND expires_at > ?
+        ''', (cache_key, now))
+        
+        row = cursor.fetchone()
+        conn.close()
+        
+        return dict(row) if row else None
+    
+    @timed('db.put_cached_result')
+    def put_cached_result(self, cache_key, model_version, value, expires_at):
+        """Store an inference result in the persistent cache"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
         cursor.execute('''
-            DELETE FROM queries
-            WHERE query_timestamp < datetime('now', '-' || ? || ' days')
-        ''', (days,))
+            INSERT OR REPLACE INTO inference_cache (cache_key, model_version, value, expires_at)
+            VALUES (?, ?, ?, ?)
+        ''', (cache_key, model_version, value, expires_at))
+        
+        conn.commit()
+        conn.close()
+    
+    @timed('db.purge_cached_results')
+    def purge_cached_results(self, model_version, now):
+        """Delete cached results that are expired or belong to another model version
+        
+        With model_version=None only expired results are deleted.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            DELETE FROM inference_cache
+            WHERE (? IS NOT NULL AND model_version != ?) OR expires_at <= ?
+        ''', (model_version, model_version, now))
         
         conn.commit()
         deleted_count = cursor.rowcount
@@ -163,24 +629,49 @@ class Database:
         
         return deleted_count
     
+    def clear_old_data(self, days=30, thumbnails=None, features=None):
+        """Clear data older than specified days
+        
+        Runs one pass of a batched retention job and returns per-table
+        deletion counts (uploads and their files included). Pass the
+        ThumbnailPipeline and FeatureStore in use so an upload's thumbnails
+        and feature vector go with it; a running server should use its
+        configured retention_job instead, so passes cannot overlap.
+        """
+        return RetentionJob(self, days=days, thumbnails=thumbnails, features=features).run()
+    
+    @timed('db.get_statistics')
     def get_statistics(self):
-        """Get database statistics"""
+        """Get database statistics from the trigger-maintained counters"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        stats = {}
+        counters = {row['name']: row['value'] for row in cursor.execute('SELECT name, value FROM stats_counters')}
+        conn.close()
+        
+        if not counters.get('backfilled'):
+            # Counters cannot be trusted until backfill_statistics() has run (warned about by init_db)
+            return self._count_statistics()
         
-        # Total messages
-        cursor.execute('SELECT COUNT(*) as count FROM chat_history')
-        stats['total_messages'] = cursor.fetchone()['count']
+        stats = {name: counters[name] for name, _ in STATISTICS_TABLES.values()}
         
-        # Total images
-        cursor.execute('SELECT COUNT(*) as count FROM image_uploads')
-        stats['total_images'] = cursor.fetchone()['count']
+        # Today's activity
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        stats['today_messages'] = sum(
+            row['count'] for row in self.get_activity(today, today, granularity='day', table_name='chat_history')
+        )
         
-        # Total queries
-        cursor.execute('SELECT COUNT(*) as count FROM queries')
-        stats['total_queries'] = cursor.fetchone()['count']
+        return stats
+    
+    def _count_statistics(self):
+        """Compute statistics with full-table scans"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        stats = {}
+        for table, (counter, _) in STATISTICS_TABLES.items():
+            cursor.execute(f'SELECT COUNT(*) as count FROM {table}')
+            stats[counter] = cursor.fetchone()['count']
         
         # Today's activity
         cursor.execute('''
@@ -192,6 +683,237 @@ class Database:
         conn.close()
         
         return stats
+    
+    @timed('db.get_activity')
+    def get_activity(self, start=None, end=None, granularity='day', table_name=None):
+        """Get activity counts per day or per hour between start and end (inclusive, UTC)
+        
+        start and end are 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' strings.
+        """
+        if granularity not in ('day', 'hour'):
+            raise ValueError("granularity must be 'day' or 'hour'")
+        
+        width = 10 if granularity == 'day' else 19
+        conditions, params = [], []
+        if start:
+            conditions.append('bucket >= ?')
+            params.append(start[:width])
+        if end:
+            # Compare on the bucket prefix so an end day includes all of its hours
+            conditions.append('substr(bucket, 1, ?) <= ?')
+            params.extend([len(end[:width]), end[:width]])
+        if table_name:
+            conditions.append('table_name = ?')
+            params.append(table_name)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT substr(bucket, 1, {width}) as bucket, table_name, SUM(count) as count
+            FROM activity_rollup
+            {where}
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        ''', params)
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    @timed('db.search')
+    def search(self, text, session_id=None, start=None, end=None, sources=('chat', 'queries'),
+               order='rank', limit=20, offset=0, prefix=False, highlight=('[', ']'), snippet_tokens=None,
+               rank_window=None):
+        """Full-text search over chat messages and query/response pairs
+        
+        Every word of ``text`` must match (stemmed, ignoring case and
+        accents; with ``prefix`` the last word also matches as a prefix).
+        Results are ordered by BM25 relevance (``order='rank'``) or newest
+        first (``order='recent'``), and each carries a snippet with matched
+        words wrapped in ``highlight``. ``session_id`` limits results to that
+        session's chat messages, since queries are not tied to a session.
+        start and end are 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' strings
+        (inclusive, UTC).
+        
+        Nothing scans the tables: the time range becomes a rowid range
+        through the timestamp indexes (ids follow insertion time), and
+        ranking scores only the newest ``rank_window`` matches per source, so
+        a word found in millions of messages costs the same as a rare one.
+        """
+        if order not in ('rank', 'recent'):
+            raise ValueError("order must be 'rank' or 'recent'")
+        match = fts_query(text, prefix)
+        if session_id:
+            sources = [source for source in sources if source == 'chat']
+        if not match or not sources or limit <= 0:
+            return []
+        
+        tokens = snippet_tokens or Config.SEARCH_SNIPPET_TOKENS
+        rank_window = Config.SEARCH_RANK_WINDOW if rank_window is None else rank_window
+        if end and len(end) == 10:
+            end += ' 23:59:59'
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        arms, params = [], []
+        for source in sources:
+            if source == 'chat':
+                fts_table, table, timestamp = 'chat_history_fts', 'chat_history', 'timestamp'
+                columns = 't.session_id AS session_id, t.message_type AS message_type, NULL AS image_id'
+            elif source == 'queries':
+                fts_table, table, timestamp = 'queries_fts', 'queries', 'query_timestamp'
+                columns = 'NULL AS session_id, NULL AS message_type, t.image_id AS image_id'
+            else:
+                conn.close()
+                raise ValueError("sources must be 'chat' or 'queries'")
+            
+            bounds = self._search_bounds(cursor, fts_table, table, timestamp, match, start, end,
+                                         rank_window if order == 'rank' and not session_id else 0)
+            if bounds is None:
+                continue
+            
+            # Parameters follow the placeholders' order in the statement: snippet, WHERE, LIMIT
+            arm_params = [*highlight, tokens]
+            conditions = []
+            if session_id:
+                # CROSS JOIN keeps the session's rows as the outer loop: one rowid lookup in the index
+                # each, instead of walking every match of a common word
+                joins = f'{table} t CROSS JOIN {fts_table} f ON f.rowid = t.id'
+                conditions.append('t.session_id = ?')
+                arm_params.append(session_id)
+                arm_order = 'score DESC' if order == 'rank' else 't.id DESC'
+            else:
+                # FTS5 sorts by rank (or walks rowids backwards) itself and stops at the limit
+                joins = f'{fts_table} f JOIN {table} t ON t.id = f.rowid'
+                arm_order = 'f.rank' if order == 'rank' else 'f.rowid DESC'
+            conditions.append(f'{fts_table} MATCH ? AND f.rowid BETWEEN ? AND ?')
+            arm_params.extend([match, *bounds, offset + limit])
+            
+            # Snippets are only built for the offset + limit rows each arm keeps
+            arms.append(f'''
+                SELECT * FROM (
+                    SELECT '{source}' AS source, t.id AS id, {columns},
+                           t.{timestamp} AS timestamp,
+                           snippet({fts_table}, -1, ?, ?, '...', ?) AS snippet,
+                           -bm25({fts_table}) AS score
+                    FROM {joins}
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY {arm_order}
+                    LIMIT ?
+                )
+            ''')
+            params.extend(arm_params)
+        
+        rows = []
+        if arms:
+            order_by = 'score DESC' if order == 'rank' else 'timestamp DESC, id DESC'
+            cursor.execute(f"{' UNION ALL '.join(arms)} ORDER BY {order_by} LIMIT ? OFFSET ?",
+                           [*params, limit, offset])
+            rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    @staticmethod
+    def _search_bounds(cursor, fts_table, table, timestamp, match, start, end, rank_window):
+        """Rowid range to search in one table, or None when it is empty
+        
+        The time range becomes a rowid range through the timestamp index
+        (ids follow insertion time). With rank_window, the range starts at
+        the rank_window-th newest match, found by walking the term's doclist
+        backwards, so ranking never scores more than rank_window rows.
+        """
+        first_id, last_id = 0, 2 ** 63 - 1
+        if start:
+            row = cursor.execute(f'SELECT id FROM {table} WHERE {timestamp} >= ? ORDER BY {timestamp}, id LIMIT 1',
+                                 (start,)).fetchone()
+            if row is None:
+                return None
+            first_id = row[0]
+        if end:
+            row = cursor.execute(f'SELECT id FROM {table} WHERE {timestamp} <= ? ORDER BY {timestamp} DESC, id DESC LIMIT 1',
+                                 (end,)).fetchone()
+            if row is None:
+                return None
+            last_id = row[0]
+        if first_id > last_id:
+            return None
+        if rank_window:
+            row = cursor.execute(f'''
+                SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ? AND rowid BETWEEN ? AND ?
+                ORDER BY rowid DESC LIMIT 1 OFFSET ?
+            ''', (match, first_id, last_id, rank_window - 1)).fetchone()
+            if row is not None:
+                first_id = row[0]
+        return first_id, last_id
+    
+    @timed('db.backfill_statistics')
+    def backfill_statistics(self):
+        """Rebuild counters and the activity rollup from existing rows (one-time, for old databases)"""
+        if self.write_behind is not None:
+            self.write_behind.flush()
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            # The write lock keeps triggers from racing the rebuild
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('DELETE FROM activity_rollup')
+            for table, (counter, timestamp_column) in STATISTICS_TABLES.items():
+                cursor.execute(f'''
+                    UPDATE stats_counters SET value = (SELECT COUNT(*) FROM {table}) WHERE name = ?
+                ''', (counter,))
+                cursor.execute(f'''
+                    INSERT INTO activity_rollup (bucket, table_name, count)
+                    SELECT strftime('%Y-%m-%d %H:00:00', COALESCE({timestamp_column}, CURRENT_TIMESTAMP)), ?, COUNT(*)
+                    FROM {table}
+                    GROUP BY 1
+                ''', (table,))
+            cursor.execute("UPDATE stats_counters SET value = 1 WHERE name = 'backfilled'")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return self.get_statistics()
+
+class LazyDatabase:
+    """Stand-in for the shared Database that creates it (and runs init_db) on first use
+    
+    Importing this module therefore touches no files; the database is opened
+    by the first request, warm-up hook or script that actually uses it.
+    """
+    
+    def __init__(self, factory=Database):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+    
+    def get(self):
+        """The underlying Database, created on first call"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+    
+    def is_initialized(self):
+        return self._instance is not None
+    
+    def close(self):
+        """Close the database if it was ever opened"""
+        if self._instance is not None:
+            self._instance.close()
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
 
-# Initialize database instance
-db = Database()
+# Shared database instance, opened lazily
+db = LazyDatabase()
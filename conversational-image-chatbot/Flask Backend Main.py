@@ -1,11 +1,34 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, send_file, url_for
 from flask_cors import CORS
+import functools
+import hmac
+import html
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 import base64
 from datetime import datetime
+from config import Config
+from utils import IMAGE_FORMAT_EXTENSIONS, image_to_tensor, generate_session_id, split_tokens
+from database import db
+from feature_store import FeatureStore
+from event_stream import collect_events, drain_events, stream_events, wants_event_stream
+from inference_engine import InferenceScheduler, run_cnn_batch, warm_up_worker
+from intent_router import IntentRouter
+from metrics import registry as metrics, span, timed, timed_iter
+from model_handler import model_handler
+from offload import ProcessOffload, OffloadBusy
+from profiler import SamplingProfiler, SlowRequestLog
+from result_cache import ResultCache
+from retention import RetentionJob
+from thumbnails import ThumbnailPipeline
+from upload_stream import StreamingRequest, UploadRejected, discard_streaming_uploads
 
 app = Flask(__name__)
+app.request_class = StreamingRequest
 CORS(app)
 
 # Configuration
@@ -13,6 +36,27 @@ UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_IMAGE_PIXELS'] = Config.MAX_IMAGE_PIXELS
+# File parts sent to these endpoints are hashed, validated and spooled while the body is parsed
+app.config['STREAMING_UPLOAD_ENDPOINTS'] = {'upload_image', 'upload_batch'}
+# A rejected image fails only its own batch item
+app.config['STREAMING_UPLOAD_PER_FILE_ERRORS'] = {'upload_batch'}
+app.config['STREAMING_UPLOAD_MAX_FILES'] = Config.BATCH_MAX_ITEMS
+app.config['MAX_CONTENT_LENGTH_BY_ENDPOINT'] = {'upload_batch': Config.BATCH_MAX_TOTAL_BYTES}
+app.teardown_request(discard_streaming_uploads)
+# Requests are timed until their (possibly streamed) body is closed
+app.wsgi_app = metrics.instrument_wsgi(app.wsgi_app)
+
+# On-demand stack sampling, and stage timings plus stacks of requests over the slow threshold
+profiler = SamplingProfiler()
+slow_requests = SlowRequestLog(profiler=profiler)
+app.wsgi_app = slow_requests.instrument_wsgi(app.wsgi_app)
+
+@app.before_request
+def label_request_metrics():
+    """Name the endpoint in this request's latency series (unrouted requests stay 'unmatched')"""
+    if request.endpoint:
+        request.environ['metrics.endpoint'] = request.endpoint
 
 # Create upload folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -20,101 +64,602 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Decode, preprocessing and forward passes run here; inline unless Config.OFFLOAD_WORKERS > 0.
+# Servers start it at startup, so workers have loaded the models before the first request
+offload = ProcessOffload(initializer=warm_up_worker)
+
+# Micro-batching scheduler shared by all request threads
+inference_engine = InferenceScheduler(
+    functools.partial(offload.run, run_cnn_batch),
+    max_batch_size=Config.INFERENCE_MAX_BATCH_SIZE,
+    max_wait_ms=Config.INFERENCE_MAX_WAIT_MS
+)
+
+# Batch items are analyzed concurrently, so their forward passes share micro-batches
+batch_executor = ThreadPoolExecutor(max_workers=Config.BATCH_WORKERS, thread_name_prefix='batch-item')
+
+# Inference results keyed by (image content hash, normalized query, model version)
+result_cache = ResultCache(
+    db,
+    max_entries=Config.RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=Config.RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=Config.RESULT_CACHE_TTL,
+    persistent_ttl_seconds=Config.RESULT_CACHE_PERSISTENT_TTL,
+    model_version=model_handler.version
+)
+
+# Thumbnails are rendered on a worker pool after upload, never on the request thread
+thumbnail_pipeline = ThumbnailPipeline()
+
+# CNN feature vectors of uploads, for similarity search and to skip the CNN on repeat queries
+feature_store = FeatureStore(model_version=model_handler.version)
+
+# Batched deletion of expired uploads, queries and chat history (started by the server entry point)
+retention_job = RetentionJob(db, thumbnails=thumbnail_pipeline, features=feature_store)
+
+# Queue depths, hit rates and pool counters exported at /metrics
+metrics.add_stats('inference', inference_engine.get_stats, gauges=('queue_depth',),
+                  counters={'total_batches': 'batches', 'total_samples': 'samples', 'failed_batches': 'failed_batches'})
+metrics.add_stats('offload', offload.get_stats, counters=('submitted', 'completed', 'failed', 'rejected'),
+                  gauges=('pending', 'max_pending'))
+metrics.add_stats('result_cache', result_cache.get_stats, gauges=('hit_rate', 'entries', 'bytes'),
+                  counters=('memory_hits', 'persistent_hits', 'misses', 'size_evictions', 'ttl_evictions'))
+metrics.add_stats('tokenizer_cache', model_handler.text_pipeline.get_stats, counters=('hits', 'misses'),
+                  gauges=('hit_rate', 'entries', 'padding_efficiency'))
+metrics.add_stats('feature_store', feature_store.get_stats, counters=('hits', 'misses', 'searches', 'rows_scanned'),
+                  gauges=('live_rows', 'bytes'))
+metrics.add_stats('thumbnails', thumbnail_pipeline.get_stats, gauges=('pending',))
+metrics.add_stats('slow_requests', slow_requests.get_stats, counters=('recorded', 'stack_samples'), gauges=('buffered',))
+# The database is opened lazily, so report nothing until it is
+metrics.add_stats('db_connections', lambda: db.get_connection_stats() if db.is_initialized() else {},
+                  counters=('opened', 'reused', 'closed'), gauges=('idle', 'in_use', 'pool_size'))
+metrics.add_stats('db_write_behind',
+                  lambda: db.write_behind.get_stats() if db.is_initialized() and db.write_behind else {},
+                  counters=('rows_written', 'batches', 'failed_batches', 'failed_rows'), gauges=('queue_depth',))
+
+def warm_up():
+    """Load the image libraries and models, then run one decode and synthetic inference batches
+    
+    Importing the app loads none of this; servers call warm_up once before
+    serving so the first request pays no setup cost, and the prefork runner
+    calls it in the master so workers inherit the initialized state.
+    Returns the time taken in seconds.
+    """
+    started = time.perf_counter()
+    import cv2
+    import numpy as np
+    
+    _, encoded = cv2.imencode('.jpg', np.zeros((32, 32, 3), dtype=np.uint8))
+    image_to_tensor(encoded.tobytes())
+    model_handler.warm_up()
+    return time.perf_counter() - started
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def upload_error_status(error):
+    """HTTP status for a failure while analyzing an upload"""
+    return 503 if isinstance(error, OffloadBusy) else 500
+
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
-    """Handle image upload and return analysis"""
+    """Handle image upload and return analysis, as JSON or streamed as server-sent events"""
     try:
-        if 'image' not in request.files:
+        # Rejected uploads raise UploadRejected while the body is still being parsed
+        with span('upload.parse'):
+            files = request.files
+        if 'image' not in files:
             return jsonify({'error': 'No image provided'}), 400
         
-        file = request.files['image']
+        file = files['image']
         query = request.form.get('query', '')
+        session_id = request.form.get('session_id') or generate_session_id()
         
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            upload_info, filepath = store_upload(file, session_id)
+            events = analyze_upload({**upload_info, 'query': query}, filepath)
+            if wants_event_stream(request):
+                return stream_events(events, upload_error_status)
+            return collect_events(events)
+        
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except OffloadBusy:
+        return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@timed('upload.store')
+def store_upload(file, session_id):
+    """Store a streamed file part and record it, returning ``(upload_info, filepath)``
+    
+    ``upload_info`` holds the upload response fields except the query and
+    answer. Raises UploadRejected when the file failed validation.
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    # Hash, header and size were computed while the body streamed to a temp file
+    upload = file.stream
+    content_hash = upload.finish()
+    
+    # Content-addressed storage: repeated uploads reuse the stored blob
+    existing = db.get_image_by_hash(content_hash)
+    duplicate = existing is not None and os.path.exists(existing['file_path'])
+    if duplicate:
+        upload.discard()
+        image_id = existing['id']
+        filename = existing['filename']
+        filepath = existing['file_path']
+    else:
+        # New content, or a recorded upload whose file has gone missing (its row is repointed)
+        extension = IMAGE_FORMAT_EXTENSIONS[upload.header['format']]
+        with span('upload.save'):
+            filename, filepath, _ = upload.commit(extension)
+        image_id = db.add_image_upload(
+            filename, secure_filename(file.filename), filepath, upload.size, content_hash
+        )
+    
+    thumbnail_pipeline.submit(content_hash, filepath)
+    
+    upload_info = {
+        'success': True,
+        'session_id': session_id,
+        'image_id': image_id,
+        'content_hash': content_hash,
+        'duplicate': duplicate,
+        'filename': filename,
+        'thumbnail_url': url_for('get_thumbnail', image_id=image_id, size='medium'),
+        'timestamp': timestamp
+    }
+    return upload_info, filepath
+
+def image_features(image_id, filepath):
+    """CNN features of an upload, from the feature store or computed once and stored"""
+    features = feature_store.get(image_id)
+    if features is None:
+        # Pixels are read back from disk only on a miss, then run through the batched CNN forward pass
+        with span('image.to_tensor'):
+            tensor = offload.run(image_to_tensor, filepath, timeout=Config.INFERENCE_TIMEOUT)
+        with span('inference.cnn'):
+            features = inference_engine.predict(tensor, timeout=Config.INFERENCE_TIMEOUT)
+        feature_store.add(image_id, features)
+    return features
+
+def analyze_upload(upload_info, filepath):
+    """Answer the query about a stored upload as events: upload details first, then response tokens
+    
+    The details go out before decode and inference, so streaming clients
+    can show the thumbnail while the answer is being produced.
+    """
+    yield 'upload', upload_info
+    content_hash, query = upload_info['content_hash'], upload_info['query']
+    
+    # Content already answered for this query skips preprocessing and inference
+    with span('cache.lookup'):
+        response = result_cache.get(content_hash, query)
+    if response is not None:
+        tokens = split_tokens(response)
+    else:
+        features = image_features(upload_info['image_id'], filepath)
+        
+        if model_handler.backend == 'torch':
+            # Tokens go out as they are generated; only the generator's own time counts
+            tokens = timed_iter('inference.respond', model_handler.stream_response(features, query))
+        else:
+            # Template response when torch is not installed
+            tokens = split_tokens(generate_mock_response(upload_info['filename'], query))
+    
+    parts = []
+    for token in tokens:
+        parts.append(token)
+        yield 'token', {'text': token}
+    if response is None:
+        response = ''.join(parts)
+        result_cache.set(content_hash, query, response)
+    
+    # Log the exchange without waiting on the commit
+    session_id = upload_info['session_id']
+    db.add_chat_message(session_id, 'user', query, image_path=filepath, wait=False)
+    db.add_chat_message(session_id, 'bot', response, wait=False)
+    db.add_query(upload_info['image_id'], query, response, wait=False)
+    
+    yield 'done', {**upload_info, 'response': response}
+
+@app.route('/api/upload/batch', methods=['POST'])
+def upload_batch():
+    """Analyze many images, each with one or more queries, reporting success or failure per item
+    
+    Form fields: ``images`` (repeated file parts), ``queries`` (optional JSON
+    list with a query or list of queries per image) and ``query`` (used for
+    images without an entry in ``queries``).
+    """
+    try:
+        with span('upload.parse'):
+            files = request.files.getlist('images')
+        if not files:
+            return jsonify({'error': 'No images provided'}), 400
+        
+        session_id = request.form.get('session_id') or generate_session_id()
+        default_query = request.form.get('query', '')
+        try:
+            queries = json.loads(request.form.get('queries') or '[]')
+        except ValueError:
+            queries = None
+        if not isinstance(queries, list):
+            return jsonify({'error': 'queries must be a JSON list'}), 400
+        for entry in queries:
+            if not (isinstance(entry, str) or (isinstance(entry, list) and entry
+                                               and all(isinstance(query, str) for query in entry))):
+                return jsonify({'error': 'each queries entry must be a string or a non-empty list of strings'}), 400
+        
+        items = []
+        analyses = []
+        for index, file in enumerate(files):
+            item = {'index': index, 'original_filename': file.filename}
+            items.append(item)
+            item_queries = queries[index] if index < len(queries) else default_query
+            if isinstance(item_queries, str):
+                item_queries = [item_queries]
             
-            # Mock response for prototype (replace with actual CNN/NLP model)
-            response = generate_mock_response(filename, query)
+            try:
+                if not allowed_file(file.filename):
+                    raise UploadRejected('Invalid file type')
+                if len(item_queries) > Config.BATCH_MAX_QUERIES_PER_ITEM:
+                    raise UploadRejected(f"At most {Config.BATCH_MAX_QUERIES_PER_ITEM} queries per image")
+                upload_info, filepath = store_upload(file, session_id)
+            except UploadRejected as e:
+                item.update({'success': False, 'error': str(e), 'status': e.status_code})
+                continue
+            except Exception as e:
+                item.update({'success': False, 'error': str(e), 'status': 500})
+                continue
             
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'query': query,
-                'response': response,
-                'timestamp': timestamp
-            })
+            for key in ('image_id', 'content_hash', 'duplicate', 'filename', 'thumbnail_url'):
+                item[key] = upload_info[key]
+            item['results'] = []
+            for query in item_queries:
+                events = analyze_upload({**upload_info, 'query': query}, filepath)
+                analyses.append((item, query, batch_executor.submit(drain_events, events)))
         
-        return jsonify({'error': 'Invalid file type'}), 400
+        for item, query, future in analyses:
+            try:
+                item['results'].append({'query': query, 'response': future.result()['response']})
+            except Exception as e:
+                item['results'].append({'query': query, 'error': str(e), 'status': upload_error_status(e)})
+        for item in items:
+            if 'results' in item:
+                item['success'] = all('error' not in result for result in item['results'])
+        
+        succeeded = sum(1 for item in items if item['success'])
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'succeeded': succeeded,
+            'failed': len(items) - succeeded,
+            'items': items
+        })
     
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except HTTPException as e:
+        return jsonify({'error': e.description}), e.code
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """Handle text-only chat messages"""
+    """Handle text-only chat messages, as JSON or streamed as server-sent events"""
     try:
         data = request.get_json()
         message = data.get('message', '')
+        session_id = data.get('session_id') or generate_session_id()
         
         if not message:
             return jsonify({'error': 'No message provided'}), 400
         
-        # Mock response for prototype
-        response = generate_text_response(message)
-        
-        return jsonify({
-            'success': True,
-            'message': message,
-            'response': response
-        })
+        events = answer_chat(message, session_id)
+        if wants_event_stream(request):
+            return stream_events(events)
+        return collect_events(events)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def generate_mock_response(filename, query):
-    """Generate mock response based on image and query (prototype only)"""
-    responses = {
-        'what': f"Based on the uploaded image '{filename}', I can see various elements. {query}",
-        'how': f"The image shows certain patterns. To answer '{query}', I would analyze the visual features.",
-        'identify': f"From the image analysis, I can identify several objects related to your query: '{query}'",
-        'explain': f"Let me explain what I see in the image regarding '{query}'..."
-    }
+def answer_chat(message, session_id):
+    """Answer a text message as events: session first, then response tokens"""
+    yield 'session', {'session_id': session_id}
     
-    for keyword, response in responses.items():
-        if keyword in query.lower():
-            return response
+    # Mock response for prototype
+    with span('chat.respond'):
+        text = generate_text_response(message)
+    parts = []
+    for token in split_tokens(text):
+        parts.append(token)
+        yield 'token', {'text': token}
+    response = ''.join(parts)
     
-    return f"I've analyzed your image. Regarding '{query}', the visual content suggests relevant information that can help answer your question."
+    # Log the exchange without waiting on the commit
+    db.add_chat_message(session_id, 'user', message, wait=False)
+    db.add_chat_message(session_id, 'bot', response, wait=False)
+    
+    yield 'done', {
+        'success': True,
+        'session_id': session_id,
+        'message': message,
+        'response': response
+    }
+
+# Canned answers of the prototype, matched on whole words; earlier intents win
+image_intents = IntentRouter(
+    default="I've analyzed your image. Regarding '{query}', the visual content suggests relevant information that can help answer your question."
+)
+image_intents.add('what', ['what'], "Based on the uploaded image '{filename}', I can see various elements. {query}")
+image_intents.add('how', ['how'], "The image shows certain patterns. To answer '{query}', I would analyze the visual features.")
+image_intents.add('identify', ['identify'], "From the image analysis, I can identify several objects related to your query: '{query}'")
+image_intents.add('explain', ['explain'], "Let me explain what I see in the image regarding '{query}'...")
+
+chat_intents = IntentRouter(
+    default="I received your message: '{message}'. Please upload an image so I can provide visual analysis along with answering your questions!"
+)
+chat_intents.add('greeting', ['hello', 'hi'], "Hello! I'm your conversational image recognition assistant. You can upload an image and ask questions about it!")
+chat_intents.add('help', ['help'], "I can help you analyze images! Just upload an image and ask questions like 'What objects are in this image?' or 'Describe what you see.'")
+chat_intents.add('usage', ['how'], "To use this chatbot: 1) Upload an image, 2) Type your question about the image, 3) I'll analyze and respond with relevant information.")
+
+if Config.INTENTS_FILE:
+    with open(Config.INTENTS_FILE) as f:
+        extra_intents = json.load(f)
+    image_intents.load(extra_intents.get('image', ()))
+    chat_intents.load(extra_intents.get('chat', ()))
+
+def generate_mock_response(filename, query):
+    """Generate mock response based on image and query (prototype only)"""
+    return image_intents.respond(query, filename=filename, query=query)
 
 def generate_text_response(message):
     """Generate mock text response (prototype only)"""
-    if 'hello' in message.lower() or 'hi' in message.lower():
-        return "Hello! I'm your conversational image recognition assistant. You can upload an image and ask questions about it!"
-    elif 'help' in message.lower():
-        return "I can help you analyze images! Just upload an image and ask questions like 'What objects are in this image?' or 'Describe what you see.'"
-    elif 'how' in message.lower():
-        return "To use this chatbot: 1) Upload an image, 2) Type your question about the image, 3) I'll analyze and respond with relevant information."
-    else:
-        return f"I received your message: '{message}'. Please upload an image so I can provide visual analysis along with answering your questions!"
+    return chat_intents.respond(message, message=message)
 
-@app.route('/api/history', methods=['GET'])
-def get_history():
-    """Get chat history (mock implementation)"""
+@app.route('/api/inference/stats', methods=['GET'])
+def inference_stats():
+    """Get micro-batching, result cache, offload pool and model runtime statistics for tuning throughput against latency"""
     return jsonify({
         'success': True,
-        'history': []
+        'stats': inference_engine.get_stats(),
+        'models': model_handler.get_model_info(),
+        'cache': result_cache.get_stats(),
+        'features': feature_store.get_stats(),
+        'offload': offload.get_stats()
     })
 
+@app.route('/api/similar/<int:image_id>', methods=['GET'])
+def similar_images(image_id):
+    """Find the uploads whose CNN features are nearest to an image's (cosine similarity)"""
+    try:
+        image = db.get_image_upload(image_id)
+        if image is None:
+            return jsonify({'error': 'Image not found'}), 404
+        
+        k = min(max(request.args.get('k', 10, type=int), 1), Config.SIMILAR_MAX_K)
+        features = image_features(image_id, image['file_path'])
+        
+        results = []
+        for match_id, score in feature_store.search(features, k, exclude=image_id):
+            match = db.get_image_upload(match_id)
+            # Deleted since its vector was stored
+            if match is None:
+                continue
+            results.append({
+                'image_id': match_id,
+                'score': score,
+                'filename': match['filename'],
+                'original_filename': match['original_filename'],
+                'thumbnail_url': url_for('get_thumbnail', image_id=match_id, size='medium')
+            })
+        
+        return jsonify({'success': True, 'image_id': image_id, 'results': results})
+    
+    except OffloadBusy as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/thumbnails/<int:image_id>/<size>', methods=['GET'])
+def get_thumbnail(image_id, size):
+    """Serve a thumbnail with validators and a long-lived cache lifetime"""
+    try:
+        if size not in Config.THUMBNAIL_SIZES:
+            return jsonify({'error': f"Unknown thumbnail size '{size}'"}), 404
+        
+        image = db.get_image_upload(image_id)
+        if not image or not image['content_hash'] or not os.path.exists(image['file_path']):
+            return jsonify({'error': 'Image not found'}), 404
+        
+        # Normally generated right after upload; older uploads are rendered on first request
+        path = thumbnail_pipeline.get(image['content_hash'], image['file_path'], size,
+                                      timeout=Config.THUMBNAIL_TIMEOUT)
+        
+        # Content-addressed, so the bytes behind this URL never change
+        response = send_file(os.path.abspath(path), mimetype='image/jpeg', conditional=True,
+                             etag=f"{image['content_hash']}-{size}", max_age=Config.THUMBNAIL_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/healthz', methods=['GET'])
+def health_check():
+    """Health check for load balancers: database reachable, plus worker details under the prefork runner"""
+    try:
+        conn = db.get_connection()
+        conn.execute('SELECT 1')
+        conn.close()
+    except Exception as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 503
+    
+    health = {'status': 'ok', 'pid': os.getpid()}
+    worker = request.environ.get('prefork.worker')
+    if worker:
+        health['worker'] = {
+            'slot': worker['slot'],
+            'requests': worker['requests'],
+            'uptime_seconds': round(time.time() - worker['started_at'], 1)
+        }
+    return jsonify(health)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage and request latency histograms, queue depths, cache hit rates and DB pool counters for Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def admin_required(view):
+    """Serve a view only to requests carrying Config.ADMIN_TOKEN in X-Admin-Token (404 while no token is set)"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.ADMIN_TOKEN:
+            return jsonify({'error': 'Not found'}), 404
+        supplied = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(supplied.encode(), Config.ADMIN_TOKEN.encode()):
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/admin/profiler', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def admin_profiler():
+    """Start (POST {"seconds": N, "fraction": F}), stop (DELETE) or inspect (GET) the sampling profiler
+    
+    Without ``fraction`` every thread is sampled for N seconds; with it,
+    only the threads serving that fraction of requests started in the window.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            fraction = data.get('fraction')
+            profiler.start(float(data.get('seconds', 30)), float(fraction) if fraction is not None else None)
+        elif request.method == 'DELETE':
+            profiler.stop()
+        return jsonify({'success': True, 'profile': profiler.get_status()})
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+
+@app.route('/api/admin/profiler/collapsed', methods=['GET'])
+@admin_required
+def admin_profiler_collapsed():
+    """Download the last profile as collapsed stacks (flamegraph.pl, speedscope)"""
+    started = (profiler.get_status().get('started_at') or 'profile').replace(' ', '_').replace(':', '')
+    return Response(profiler.collapsed(), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename="profile-{started}.collapsed"'})
+
+@app.route('/api/admin/slow-requests', methods=['GET'])
+@admin_required
+def admin_slow_requests():
+    """Recent requests over Config.SLOW_REQUEST_THRESHOLD_MS, newest first, with stage timings and top stacks"""
+    limit = request.args.get('limit', type=int)
+    return jsonify({'success': True, 'stats': slow_requests.get_stats(), 'requests': slow_requests.recent(limit)})
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Get chat history for a session, newest first, one keyset page at a time"""
+    try:
+        session_id = request.args.get('session_id', '')
+        if not session_id:
+            return jsonify({'error': 'No session_id provided'}), 400
+        
+        limit = min(max(request.args.get('limit', 50, type=int), 1), Config.HISTORY_MAX_PAGE_SIZE)
+        before_id = request.args.get('before_id', type=int)
+        
+        # Fetch one extra row to know whether an older page exists
+        rows = db.get_chat_history(session_id, limit=limit + 1, before_id=before_id)
+        history = rows[:limit]
+        next_before_id = history[-1]['id'] if len(rows) > limit else None
+        
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'history': history,
+            'next_before_id': next_before_id
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Snippet highlight markers (private-use characters) swapped for <mark> tags after HTML-escaping
+SNIPPET_MARKERS = ('\ue000', '\ue001')
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Full-text search over one session's chat history and image queries, ranked, with highlighted snippets"""
+    session_id = request.args.get('session_id', '')
+    if not session_id:
+        return jsonify({'error': 'No session_id provided'}), 400
+    return search_response(session_id)
+
+@app.route('/api/admin/search', methods=['GET'])
+@admin_required
+def admin_search():
+    """Full-text search across every session (or one, with session_id), for support staff"""
+    return search_response(request.args.get('session_id') or None)
+
+def search_response(session_id):
+    """Run a search from the request arguments, restricted to session_id unless it is None"""
+    try:
+        text = request.args.get('q', '')
+        if not text.strip():
+            return jsonify({'error': 'No search query provided'}), 400
+        
+        limit = min(max(request.args.get('limit', 20, type=int), 1), Config.SEARCH_MAX_PAGE_SIZE)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        source = request.args.get('source')
+        if source not in (None, 'chat', 'queries'):
+            return jsonify({'error': "source must be 'chat' or 'queries'"}), 400
+        order = request.args.get('order', 'rank')
+        if order not in ('rank', 'recent'):
+            return jsonify({'error': "order must be 'rank' or 'recent'"}), 400
+        
+        # Fetch one extra row to know whether another page exists
+        rows = db.search(
+            text,
+            session_id=session_id,
+            start=request.args.get('start') or None,
+            end=request.args.get('end') or None,
+            sources=(source,) if source else ('chat', 'queries'),
+            order=order,
+            limit=limit + 1,
+            offset=offset,
+            prefix=request.args.get('prefix') == '1',
+            highlight=SNIPPET_MARKERS
+        )
+        results = rows[:limit]
+        start_mark, end_mark = SNIPPET_MARKERS
+        for result in results:
+            result['snippet'] = html.escape(result['snippet'] or '').replace(start_mark, '<mark>').replace(end_mark, '</mark>')
+        
+        return jsonify({
+            'success': True,
+            'query': text,
+            'results': results,
+            'next_offset': offset + limit if len(rows) > limit else None
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
+    warm_up()
+    # The debug reloader runs this module twice; only its serving child deletes data
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        offload.start()
+        if Config.RETENTION_ENABLED:
+            retention_job.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
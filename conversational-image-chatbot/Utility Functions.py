@@ -1,9 +1,39 @@
+import io
 import os
+import re
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from PIL import Image
-import cv2
-import numpy as np
+
+from metrics import span, timed
+
+# cv2, numpy and PIL are imported inside the functions that use them, so
+# importing this module (and the app) stays cheap until an image is processed
+
+# ImageNet channel statistics used by mobilenet_v2
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Reduced-resolution JPEG decode flags (cv2 attribute names), largest reduction first
+_JPEG_REDUCED_FLAGS = (
+    (8, 'IMREAD_REDUCED_COLOR_8'),
+    (4, 'IMREAD_REDUCED_COLOR_4'),
+    (2, 'IMREAD_REDUCED_COLOR_2'),
+)
+
+# A word with the whitespace around it, for streaming text token by token
+_TOKEN_PATTERN = re.compile(r'\s*\S+\s*')
+
+# Characters sanitize_input deletes, as tables for bytes.translate (ASCII text) and str.translate
+DANGEROUS_CHARS = '<>{}\\;'
+_DANGEROUS_BYTES = DANGEROUS_CHARS.encode('ascii')
+_DANGEROUS_CHARS_TABLE = str.maketrans('', '', DANGEROUS_CHARS)
+
+# Common words extract_keywords ignores
+_STOPWORDS = frozenset({'a', 'an', 'the', 'is', 'are', 'was', 'were', 'in', 'on', 'at', 'to', 'for', 'of', 'and', 'or'})
+
+_decode_pool = None
 
 def allowed_file(filename, allowed_extensions):
     """Check if file extension is allowed"""
@@ -17,12 +47,164 @@ def generate_unique_filename(original_filename):
     ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'jpg'
     return f"{timestamp}_{unique_id}.{ext}"
 
+# File extension used when storing each supported format
+IMAGE_FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'}
+
+# JPEG start-of-frame markers that carry the image dimensions
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def sniff_image_header(data):
+    """Read format and dimensions from the first bytes of a PNG, JPEG or GIF
+    
+    Returns a dict with ``format``, ``width`` and ``height``, or None when the
+    bytes are not a supported image header (or the header is incomplete).
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR' and len(data) >= 24:
+        width = int.from_bytes(data[16:20], 'big')
+        height = int.from_bytes(data[20:24], 'big')
+        fmt = 'PNG'
+    elif data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        width = int.from_bytes(data[6:8], 'little')
+        height = int.from_bytes(data[8:10], 'little')
+        fmt = 'GIF'
+    elif data[:2] == b'\xff\xd8':
+        width = height = 0
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:
+                # Fill byte before a marker
+                pos += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+                # Standalone marker without a length field
+                pos += 2
+                continue
+            length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+            if marker in _JPEG_SOF_MARKERS:
+                if pos + 9 > len(data):
+                    return None
+                height = int.from_bytes(data[pos + 5:pos + 7], 'big')
+                width = int.from_bytes(data[pos + 7:pos + 9], 'big')
+                break
+            pos += 2 + length
+        fmt = 'JPEG'
+    else:
+        return None
+    
+    if width <= 0 or height <= 0:
+        return None
+    return {'format': fmt, 'width': width, 'height': height}
+
+class ImageHandle:
+    """Single-read, single-decode view of an uploaded image
+    
+    The encoded bytes are read once. Validation and metadata come from the
+    header, and pixels are decoded lazily at most once, then shared by the
+    model tensor and thumbnails.
+    """
+    
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.file_path = None
+            self._data = bytes(source)
+        else:
+            self.file_path = source
+            self._data = None
+        self._header = None
+        self._image = None
+        self._rgb = None
+        self._lock = threading.Lock()
+        self.decode_count = 0
+    
+    @property
+    def data(self):
+        """Raw encoded bytes (read from disk on first access)"""
+        if self._data is None:
+            with open(self.file_path, 'rb') as f:
+                self._data = f.read()
+        return self._data
+    
+    @property
+    def header(self):
+        """Format and dimensions parsed from the header, without decoding"""
+        if self._header is None:
+            self._header = sniff_image_header(self.data) or {}
+        return self._header or None
+    
+    def is_valid(self):
+        """Cheap validity check based on the image header"""
+        return self.header is not None
+    
+    def info(self):
+        """Get image information without decoding pixel data"""
+        header = self.header
+        if header is None:
+            return None
+        return {
+            'width': header['width'],
+            'height': header['height'],
+            'format': header['format'],
+            'mode': self._open().mode,
+            'size': len(self.data)
+        }
+    
+    def _open(self):
+        """Open the image lazily (PIL parses the header only)"""
+        if self._image is None:
+            from PIL import Image
+            self._image = Image.open(io.BytesIO(self.data))
+        return self._image
+    
+    def decode(self):
+        """Decode pixel data into an HxWx3 uint8 RGB array, at most once per handle"""
+        import cv2
+        import numpy as np
+        with self._lock:
+            if self._rgb is None:
+                self.decode_count += 1
+                with span('image.decode'):
+                    img = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if img is not None:
+                        self._rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                    else:
+                        # OpenCV cannot read GIF, fall back to PIL
+                        self._rgb = np.asarray(self._open().convert('RGB'))
+            return self._rgb
+    
+    def to_tensor(self, target_size=(224, 224)):
+        """Model input tensor of shape (1, H, W, 3) normalized to [0, 1]"""
+        import cv2
+        import numpy as np
+        rgb = self.decode()
+        with span('image.preprocess'):
+            img = cv2.resize(rgb, target_size).astype(np.float32)
+            img *= np.float32(1.0 / 255.0)
+        return img[np.newaxis]
+    
+    def thumbnail(self, size=(150, 150)):
+        """Thumbnail as a new PIL image, keeping the aspect ratio"""
+        from PIL import Image
+        rgb = self.decode()
+        height, width = rgb.shape[:2]
+        scale = min(size[0] / width, size[1] / height, 1.0)
+        thumb_size = (max(1, int(width * scale + 0.5)), max(1, int(height * scale + 0.5)))
+        return Image.fromarray(rgb).resize(thumb_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    
+    def save_thumbnail(self, output_path, size=(150, 150)):
+        """Write a thumbnail to output_path"""
+        self.thumbnail(size).save(output_path)
+
+def image_to_tensor(source, target_size=(224, 224)):
+    """Decode a path or bytes into a model input tensor (picklable, for worker processes)"""
+    return ImageHandle(source).to_tensor(target_size)
+
 def validate_image(file_path):
     """Validate if file is a valid image"""
     try:
-        img = Image.open(file_path)
-        img.verify()
-        return True
+        return ImageHandle(file_path).is_valid()
     except Exception as e:
         print(f"Image validation error: {e}")
         return False
@@ -30,14 +212,7 @@ def validate_image(file_path):
 def get_image_info(file_path):
     """Get image information"""
     try:
-        img = Image.open(file_path)
-        return {
-            'width': img.width,
-            'height': img.height,
-            'format': img.format,
-            'mode': img.mode,
-            'size': os.path.getsize(file_path)
-        }
+        return ImageHandle(file_path).info()
     except Exception as e:
         print(f"Error getting image info: {e}")
         return None
@@ -45,34 +220,147 @@ def get_image_info(file_path):
 def preprocess_image(file_path, target_size=(224, 224)):
     """Preprocess image for CNN model input"""
     try:
-        # Read image
-        img = cv2.imread(file_path)
-        if img is None:
-            return None
-        
-        # Convert BGR to RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Resize
-        img = cv2.resize(img, target_size)
-        
-        # Normalize pixel values to [0, 1]
-        img = img.astype(np.float32) / 255.0
-        
-        # Add batch dimension
-        img = np.expand_dims(img, axis=0)
-        
-        return img
+        return ImageHandle(file_path).to_tensor(target_size)
     except Exception as e:
         print(f"Image preprocessing error: {e}")
         return None
 
+def _read_image_bytes(source):
+    """Return the raw encoded bytes of a path or in-memory buffer"""
+    import numpy as np
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return np.frombuffer(source, dtype=np.uint8)
+    if isinstance(source, np.ndarray):
+        return source.reshape(-1).view(np.uint8)
+    return np.fromfile(source, dtype=np.uint8)
+
+def _jpeg_decode_flag(data, target_size):
+    """Pick the largest DCT reduction that still covers target_size"""
+    import cv2
+    header = sniff_image_header(memoryview(data))
+    if header is None or header['format'] != 'JPEG':
+        return cv2.IMREAD_COLOR
+    
+    width, height = header['width'], header['height']
+    target_w, target_h = target_size
+    for factor, flag in _JPEG_REDUCED_FLAGS:
+        if width // factor >= target_w and height // factor >= target_h:
+            return getattr(cv2, flag)
+    return cv2.IMREAD_COLOR
+
+def _decode_into(batch, index, source, target_size, channels_first):
+    """Decode and resize one image straight into its slot of the batch array"""
+    import cv2
+    data = _read_image_bytes(source)
+    img = cv2.imdecode(data, _jpeg_decode_flag(data, target_size))
+    if img is None:
+        raise ValueError("Could not decode image")
+    
+    img = cv2.resize(img, target_size)
+    
+    # Reverse BGR to RGB while casting into the preallocated float32 slot
+    if channels_first:
+        batch[index] = img[:, :, ::-1].transpose(2, 0, 1)
+    else:
+        batch[index] = img[:, :, ::-1]
+
+def _capture_error(func, *args):
+    """Call func and return the exception it raised, or None"""
+    try:
+        func(*args)
+    except Exception as e:
+        return e
+    return None
+
+def _get_decode_pool():
+    """Get the shared decode thread pool (OpenCV releases the GIL while decoding)"""
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ThreadPoolExecutor(
+            max_workers=min(8, os.cpu_count() or 1),
+            thread_name_prefix='image-decode'
+        )
+    return _decode_pool
+
+@timed('image.preprocess_batch')
+def preprocess_images(sources, target_size=(224, 224), layout='NHWC', mean=None, std=None):
+    """Preprocess a batch of images (file paths or encoded byte buffers) for CNN model input
+    
+    Returns ``(batch, failed)`` where ``batch`` is one float32 array of shape
+    (N, H, W, 3) or (N, 3, H, W) and ``failed`` lists the indices that could
+    not be decoded (their rows are zero-filled).
+    """
+    import numpy as np
+    
+    if layout not in ('NHWC', 'NCHW'):
+        raise ValueError("layout must be 'NHWC' or 'NCHW'")
+    
+    channels_first = layout == 'NCHW'
+    width, height = target_size
+    shape = (len(sources), 3, height, width) if channels_first else (len(sources), height, width, 3)
+    batch = np.empty(shape, dtype=np.float32)
+    failed = []
+    
+    tasks = [(batch, i, source, target_size, channels_first) for i, source in enumerate(sources)]
+    if len(tasks) == 1:
+        # Not worth a thread hop for a single image
+        errors = [_capture_error(_decode_into, *tasks[0])]
+    else:
+        pool = _get_decode_pool()
+        futures = [pool.submit(_decode_into, *task) for task in tasks]
+        errors = [future.exception() for future in futures]
+    
+    for i, error in enumerate(errors):
+        if error is not None:
+            print(f"Image preprocessing error (item {i}): {error}")
+            failed.append(i)
+    
+    # Normalize in place: (x / 255 - mean) / std folded into one scale and one offset
+    channel_shape = (1, 3, 1, 1) if channels_first else (1, 1, 1, 3)
+    if mean is None and std is None:
+        batch *= np.float32(1.0 / 255.0)
+    else:
+        mean = np.asarray(mean if mean is not None else (0.0, 0.0, 0.0), dtype=np.float32)
+        std = np.asarray(std if std is not None else (1.0, 1.0, 1.0), dtype=np.float32)
+        batch *= (1.0 / (255.0 * std)).reshape(channel_shape)
+        batch -= (mean / std).reshape(channel_shape)
+    
+    # Failed rows are zeroed once, after normalization, so they stay exactly zero
+    if failed:
+        batch[failed] = 0
+    
+    return batch, failed
+
+@timed('image.thumbnails')
+def render_thumbnails(source, sizes, reducing_gap=2.0):
+    """Render one thumbnail per (width, height) box in ``sizes`` from a single decode
+    
+    JPEGs are opened in draft mode so libjpeg scales by 1/2, 1/4 or 1/8 while
+    decoding, to the smallest scale still ``reducing_gap`` times larger than
+    the biggest thumbnail. Smaller thumbnails are resized from the next larger
+    one. Returns a dict mapping each size to an RGB PIL image.
+    """
+    from PIL import Image
+    
+    img = Image.open(source)
+    if img.format == 'JPEG':
+        box = max(sizes, key=lambda size: size[0] * size[1])
+        scale = min(box[0] / img.width, box[1] / img.height, 1.0) * reducing_gap
+        img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+    img = img.convert('RGB')
+    
+    thumbs = {}
+    for size in sorted(sizes, key=lambda size: size[0] * size[1], reverse=True):
+        img = img.copy()
+        img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+        thumbs[size] = img
+    return thumbs
+
 def create_thumbnail(file_path, output_path, size=(150, 150)):
     """Create thumbnail of image"""
     try:
-        img = Image.open(file_path)
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-        img.save(output_path)
+        size = tuple(size)
+        render_thumbnails(file_path, [size])[size].save(output_path)
         return True
     except Exception as e:
         print(f"Thumbnail creation error: {e}")
@@ -86,58 +374,51 @@ def format_file_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.2f} TB"
 
-def clean_old_uploads(upload_folder, days=7):
-    """Clean old uploaded files"""
-    try:
-        current_time = datetime.now()
-        deleted_count = 0
-        
-        for filename in os.listdir(upload_folder):
-            file_path = os.path.join(upload_folder, filename)
-            
-            if os.path.isfile(file_path):
-                file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                age_days = (current_time - file_time).days
-                
-                if age_days > days:
-                    os.remove(file_path)
-                    deleted_count += 1
-        
-        return deleted_count
-    except Exception as e:
-        print(f"Error cleaning old uploads: {e}")
-        return 0
+def clean_old_uploads(upload_folder, days=7, retention_job=None):
+    """Clean old uploaded files
+    
+    Runs an uploads-only pass of a retention job, which finds uploads under
+    upload_folder older than days through the indexed upload records and
+    removes their rows and thumbnails with them; chat history and other
+    queries are left alone. Pass the server's retention_job so feature
+    vectors go too and the pass waits for a scheduled one; otherwise a
+    job over the shared database is built here. Returns the number of
+    files deleted.
+    """
+    if retention_job is None:
+        from database import db
+        from retention import RetentionJob
+        from thumbnails import ThumbnailPipeline
+        retention_job = RetentionJob(db, thumbnails=ThumbnailPipeline())
+    return retention_job.run(days=days, uploads_only=True, folder=upload_folder)['files']
 
 def sanitize_input(text, max_length=500):
     """Sanitize user input"""
     if not text:
         return ""
     
-    # Remove leading/trailing whitespace
-    text = text.strip()
-    
-    # Limit length
-    text = text[:max_length]
-    
-    # Remove potentially dangerous characters
-    dangerous_chars = ['<', '>', '{', '}', '\\', ';']
-    for char in dangerous_chars:
-        text = text.replace(char, '')
-    
-    return text
+    # Strip, limit length and drop potentially dangerous characters in one translate pass
+    text = text.strip()[:max_length]
+    return delete_chars(text, _DANGEROUS_BYTES, _DANGEROUS_CHARS_TABLE)
+
+def delete_chars(text, ascii_chars, table):
+    """Delete characters in a single pass: ``ascii_chars`` (bytes) from ASCII text, ``table`` otherwise
+
+    bytes.translate is a flat table lookup in C while str.translate looks
+    every character up in a dict, so ASCII text takes the bytes path.
+    """
+    if text.isascii():
+        return text.encode('ascii').translate(None, ascii_chars).decode('ascii')
+    return text.translate(table)
 
 def extract_keywords(text):
     """Extract keywords from text (simple implementation)"""
-    # Common words to ignore
-    stopwords = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'in', 'on', 'at', 'to', 'for', 'of', 'and', 'or'}
-    
-    # Convert to lowercase and split
-    words = text.lower().split()
-    
     # Filter out stopwords and short words
-    keywords = [word for word in words if word not in stopwords and len(word) > 2]
-    
-    return keywords
+    return [word for word in text.lower().split() if len(word) > 2 and word not in _STOPWORDS]
+
+def split_tokens(text):
+    """Split text into word tokens keeping their trailing whitespace, so joining them restores the text"""
+    return _TOKEN_PATTERN.findall(text)
 
 def generate_session_id():
     """Generate unique session ID"""
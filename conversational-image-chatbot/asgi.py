@@ -0,0 +1,210 @@
+"""
+ASGI Entry Point
+Serve the Flask app from an ASGI server, e.g. ``uvicorn asgi:application``
+(or ``python run_script.py --server asgi``)
+"""
+
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+
+class _RequestBody:
+    """wsgi.input that pulls body chunks from the ASGI receive channel as they are read
+
+    Nothing is buffered beyond the chunk being consumed, so uploads keep
+    streaming straight into the multipart parser.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more = True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._more = False
+            return
+        self._buffer += message.get('body', b'')
+        self._more = message.get('more_body', False)
+
+    def read(self, size=-1):
+        while self._more and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        while self._more and b'\n' not in self._buffer and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return data
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into a WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WsgiToAsgiAdapter:
+    """Run a WSGI app under an ASGI server with bounded concurrency
+
+    The event loop owns every connection, so slow clients and idle
+    keep-alives cost no threads. Handlers run on a pool of ``max_threads``
+    threads, which mostly wait on the process offload pool for CPU-heavy
+    stages. Once ``max_pending`` requests are in flight, new ones are
+    answered with 503 from the event loop without queueing.
+    """
+
+    def __init__(self, wsgi_app, max_threads=None, max_pending=None):
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads or Config.ASGI_MAX_THREADS
+        self.max_pending = max_pending or Config.ASGI_MAX_PENDING
+        self.executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='asgi-handler')
+        self.on_startup = []
+        self.on_shutdown = []
+
+        # Only touched from the event loop thread
+        self.pending = 0
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            await self._busy(send)
+            return
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self._run_wsgi, scope, receive, send, loop)
+        finally:
+            self.pending -= 1
+
+    def _run_wsgi(self, scope, receive, send, loop):
+        """Call the WSGI app on a handler thread, relaying the response to the event loop"""
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+        started = False
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        result = self.wsgi_app(build_environ(scope, _RequestBody(receive, loop)), start_response)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not started:
+                    send_sync({'type': 'http.response.start', **response})
+                    started = True
+                send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                send_sync({'type': 'http.response.start', **response})
+            send_sync({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    async def _busy(self, send):
+        body = json.dumps({'error': 'Server busy, please retry'}).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [(b'content-type', b'application/json'), (b'retry-after', b'1'),
+                        (b'content-length', str(len(body)).encode('ascii'))],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                for hook in self.on_startup:
+                    hook()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                for hook in self.on_shutdown:
+                    hook()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def get_stats(self):
+        """Get admission counters"""
+        return {
+            'max_threads': self.max_threads,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'rejected': self.rejected,
+        }
+
+
+def create_application():
+    """ASGI application wired to the app's background services"""
+    from app import app, db, offload, retention_job, warm_up
+
+    application = WsgiToAsgiAdapter(app)
+    application.on_startup.extend([warm_up, offload.start])
+    if Config.RETENTION_ENABLED:
+        application.on_startup.append(retention_job.start)
+    application.on_shutdown.extend([retention_job.stop, offload.shutdown, db.close])
+    return application
+
+
+application = create_application()
@@ -0,0 +1,5 @@
+"""
+Benchmarks
+Performance measurements for the chatbot backend.
+Run from the application directory, e.g. ``python -m benchmarks.bench_preprocess``
+"""
@@ -0,0 +1,86 @@
+"""
+Database concurrency benchmark
+N threads issue a mix of add_chat_message and get_chat_history against
+the legacy connection-per-call setup, the pooled WAL-tuned setup and
+the pooled setup with write-behind (writes not awaited on the caller)
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from database import Database
+
+# The pre-pooling behaviour: a fresh rollback-journal connection for every call
+LEGACY_SETTINGS = {
+    'pool_size': 0,
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'cache_size': -2000,
+    'mmap_size': 0,
+    'write_behind': False,
+}
+
+
+def worker(db, operations, write_ratio, sessions, latencies, seed, wait):
+    """Run a mixed read/write workload and record per-call latency"""
+    rng = random.Random(seed)
+    for i in range(operations):
+        session_id = f"session_{rng.randrange(sessions)}"
+        start = time.perf_counter()
+        if rng.random() < write_ratio:
+            db.add_chat_message(session_id, 'user', f"message {i}", wait=wait)
+        else:
+            db.get_chat_history(session_id, limit=20)
+        latencies.append(time.perf_counter() - start)
+
+
+def run_workload(settings, threads, operations, write_ratio, sessions):
+    """Run the workload on a fresh database and summarize throughput and latency"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), **settings)
+        latencies = []
+        pool = [
+            threading.Thread(target=worker, args=(db, operations, write_ratio, sessions, latencies, seed,
+                                                  not settings.get('write_behind')))
+            for seed in range(threads)
+        ]
+        
+        start = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        db.close()
+        elapsed = time.perf_counter() - start
+    
+    latencies.sort()
+    return {
+        'ops_per_s': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--operations', type=int, default=500, help='operations per thread')
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--sessions', type=int, default=50)
+    args = parser.parse_args()
+    
+    print(f"{'threads':>7} {'mode':>7} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for threads in args.threads:
+        modes = (('legacy', LEGACY_SETTINGS), ('pooled', {'write_behind': False}), ('wb', {'write_behind': True}))
+        for mode, settings in modes:
+            result = run_workload(settings, threads, args.operations, args.write_ratio, args.sessions)
+            print(f"{threads:>7} {mode:>7} {result['ops_per_s']:>9.0f} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Endpoint benchmarks
+Latency of /api/chat, /api/upload and /api/history through the Flask test
+client, so routing, validation, the database and inference are included
+but sockets are not (see load_test for that). Uploads are measured both
+with new content (store, decode, infer) and repeated content and query
+(deduplicated upload, cached result).
+"""
+
+import argparse
+import io
+import itertools
+import os
+import tempfile
+
+from benchmarks.report import Report, measure
+
+
+def make_png(seed, size=(640, 480)):
+    """A distinct photo-sized PNG per seed"""
+    import numpy as np
+    from PIL import Image
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize(size).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def expect_ok(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.path} returned {response.status_code}: {response.get_data(as_text=True)}")
+    return response
+
+
+def run(report, repeat=100):
+    """Time each endpoint; must run inside a scratch working directory"""
+    from app import app
+    app.config['TESTING'] = True
+    client = app.test_client()
+    counter = itertools.count()
+
+    def chat(session_id=None):
+        body = {'message': 'hello, what can you do?'}
+        if session_id:
+            body['session_id'] = session_id
+        return expect_ok(client.post('/api/chat', json=body)).get_json()
+
+    session_id = chat()['session_id']
+    for _ in range(50):
+        chat(session_id)
+
+    def upload(image, query):
+        return expect_ok(client.post('/api/upload', data={'image': (io.BytesIO(image), 'photo.png'), 'query': query}))
+
+    images = [make_png(seed) for seed in range(repeat + 3)]
+    fresh = iter(images)
+    repeated = images[0]
+    upload(repeated, 'what is in this picture')
+
+    report.add('POST /api/chat new session', measure(chat, repeat))
+    report.add('POST /api/chat existing session', measure(lambda: chat(session_id), repeat))
+    report.add('POST /api/upload new image', measure(lambda: upload(next(fresh), f"what is this {next(counter)}"),
+                                                     repeat))
+    report.add('POST /api/upload repeated image and query',
+               measure(lambda: upload(repeated, 'what is in this picture'), repeat))
+    report.add('GET /api/history 50 messages',
+               measure(lambda: expect_ok(client.get(f'/api/history?session_id={session_id}&limit=50')), repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    report = Report()
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        run(report, args.repeat)
+    report.print()
+    if output:
+        report.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Chat history benchmark
+Measures get_chat_history latency (first page and a keyset page deep in a
+session) as chat_history grows, with and without the history index
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import Database
+
+SIZES = (10_000, 100_000, 1_000_000)
+SESSIONS = 1000
+
+
+def fill(db, rows, start_row=0, chunk=100_000):
+    """Bulk insert synthetic messages spread over SESSIONS sessions, one second apart"""
+    base = datetime(2025, 1, 1)
+    conn = db.get_connection()
+    for offset in range(start_row, rows, chunk):
+        end = min(rows, offset + chunk)
+        conn.executemany(
+            'INSERT INTO chat_history (session_id, message_type, content, timestamp) VALUES (?, ?, ?, ?)',
+            (
+                (f"session_{i % SESSIONS}", 'user' if i % 2 else 'bot', f"message {i}",
+                 (base + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S'))
+                for i in range(offset, end)
+            )
+        )
+        conn.commit()
+    conn.close()
+
+
+def time_queries(db, repeat=200):
+    """Mean milliseconds for a first page and for a page starting mid-session"""
+    session_id = f"session_{SESSIONS // 2}"
+    first_page = db.get_chat_history(session_id, limit=1000)
+    middle_id = first_page[len(first_page) // 2]['id'] if first_page else None
+    
+    results = {}
+    for name, kwargs in (('first_page', {}), ('keyset_page', {'before_id': middle_id})):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            db.get_chat_history(session_id, limit=50, **kwargs)
+        results[name] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES),
+                        help='table sizes to measure, e.g. 10000 100000 1000000 10000000')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--skip-unindexed', action='store_true', help='only measure the indexed schema')
+    args = parser.parse_args()
+    
+    print(f"{'rows':>10} {'index':>6} {'first page ms':>14} {'keyset page ms':>15}")
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), write_behind=False)
+        filled = 0
+        for size in sorted(args.sizes):
+            fill(db, size, start_row=filled)
+            filled = size
+            
+            indexed = time_queries(db, args.repeat)
+            print(f"{size:>10} {'yes':>6} {indexed['first_page']:>14.3f} {indexed['keyset_page']:>15.3f}")
+            
+            if not args.skip_unindexed:
+                conn = db.get_connection()
+                conn.execute('DROP INDEX idx_chat_history_session_timestamp')
+                conn.close()
+                scan = time_queries(db, max(1, args.repeat // 20))
+                print(f"{size:>10} {'no':>6} {scan['first_page']:>14.3f} {scan['keyset_page']:>15.3f}")
+                conn = db.get_connection()
+                conn.execute('CREATE INDEX idx_chat_history_session_timestamp ON chat_history (session_id, timestamp, id)')
+                conn.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
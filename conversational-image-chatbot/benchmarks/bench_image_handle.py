@@ -0,0 +1,76 @@
+"""
+ImageHandle benchmark
+Compares the per-upload cost of the legacy open/decode sequence
+(validate, info, preprocess, thumbnail) with one shared ImageHandle
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils import ImageHandle
+
+
+def legacy_pipeline(path, thumbnail_path):
+    """The pre-ImageHandle sequence: four independent opens and three decodes"""
+    img = Image.open(path)
+    img.verify()
+    
+    img = Image.open(path)
+    info = (img.width, img.height, img.format, img.mode, os.path.getsize(path))
+    
+    pixels = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+    tensor = np.expand_dims(cv2.resize(pixels, (224, 224)).astype(np.float32) / 255.0, axis=0)
+    
+    img = Image.open(path)
+    img.thumbnail((150, 150), Image.Resampling.LANCZOS)
+    img.save(thumbnail_path)
+    return info, tensor
+
+
+def handle_pipeline(path, thumbnail_path):
+    """The same work served from one read and one decode"""
+    handle = ImageHandle(path)
+    handle.is_valid()
+    info = handle.info()
+    tensor = handle.to_tensor()
+    handle.save_thumbnail(thumbnail_path)
+    return info, tensor
+
+
+def run(size=(1920, 1080), repeat=20):
+    """Return mean milliseconds per upload for both pipelines"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'sample.jpg')
+        thumbnail_path = os.path.join(directory, 'thumb.jpg')
+        pixels = np.random.default_rng(0).integers(0, 256, size=(size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+        Image.fromarray(pixels).resize(size).save(path, quality=90)
+        
+        results = {}
+        for name, pipeline in (('legacy', legacy_pipeline), ('image_handle', handle_pipeline)):
+            pipeline(path, thumbnail_path)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                pipeline(path, thumbnail_path)
+            results[name] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    
+    results = run(repeat=args.repeat)
+    for name, ms in results.items():
+        print(f"{name:>13}: {ms:8.2f} ms/upload")
+    print(f"{'speedup':>13}: {results['legacy'] / results['image_handle']:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
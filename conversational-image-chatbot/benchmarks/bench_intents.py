@@ -0,0 +1,99 @@
+"""
+Intent routing benchmark
+Per-message cost of the compiled IntentRouter against the linear
+``keyword in message.lower()`` scan it replaced, as the number of
+registered intents grows
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from intent_router import IntentRouter
+
+INTENT_COUNTS = (4, 50, 200, 1000)
+
+# Filler vocabulary for messages; intent keywords are drawn from a disjoint set
+WORDS = ('the', 'image', 'show', 'me', 'this', 'picture', 'of', 'a', 'dog', 'on', 'beach',
+         'please', 'can', 'you', 'tell', 'colour', 'sky', 'there', 'in', 'it')
+
+
+def make_intents(count, keywords_per_intent=3):
+    """Synthetic intents with distinct keywords"""
+    return [{
+        'name': f"intent{i}",
+        'keywords': [f"kw{i}x{j}" for j in range(keywords_per_intent)],
+        'response': f"response {i} to '{{message}}'",
+    } for i in range(count)]
+
+
+def make_messages(intents, count, words=12, hit_rate=0.5, seed=0):
+    """Messages of filler words, half of them containing one random keyword"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        message = [rng.choice(WORDS) for _ in range(words)]
+        if rng.random() < hit_rate:
+            message[rng.randrange(words)] = rng.choice(rng.choice(intents)['keywords']).upper()
+        messages.append(' '.join(message))
+    return messages
+
+
+def linear_respond(intents, default, message):
+    """The replaced approach: lowercase and substring-scan every keyword of every intent"""
+    for intent in intents:
+        for keyword in intent['keywords']:
+            if keyword in message.lower():
+                return intent['response'].format(message=message)
+    return default.format(message=message)
+
+
+def per_message_us(fn, messages, repeat):
+    """Median over repeat runs of the mean microseconds per message"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            fn(message)
+        samples.append((time.perf_counter() - start) / len(messages) * 1e6)
+    return statistics.median(samples)
+
+
+def run(intent_counts=INTENT_COUNTS, messages=2000, repeat=5):
+    """Run the benchmark and return one result row per intent count"""
+    default = "no intent for '{message}'"
+    rows = []
+    for count in intent_counts:
+        intents = make_intents(count)
+        router = IntentRouter(default=default).load(intents)
+        sample = make_messages(intents, messages)
+        for message in sample:
+            expected = linear_respond(intents, default, message)
+            assert router.respond(message, message=message) == expected, message
+
+        linear = per_message_us(lambda m: linear_respond(intents, default, m), sample, repeat)
+        compiled = per_message_us(lambda m: router.respond(m, message=m), sample, repeat)
+        rows.append({
+            'intents': count,
+            'linear_us': linear,
+            'router_us': compiled,
+            'speedup': linear / compiled,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--intents', type=int, nargs='+', default=list(INTENT_COUNTS))
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'intents':>8} {'linear us/msg':>14} {'router us/msg':>14} {'speedup':>8}")
+    for row in run(args.intents, args.messages, args.repeat):
+        print(f"{row['intents']:>8} {row['linear_us']:>14.2f} {row['router_us']:>14.2f} {row['speedup']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
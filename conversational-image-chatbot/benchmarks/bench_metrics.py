@@ -0,0 +1,70 @@
+"""
+Instrumentation overhead benchmark
+Cost of one span and one timed call against the bare block, and of
+/api/chat and /api/history through the Flask test client with metrics
+enabled and disabled (every stage span, the request wrapper and the
+database decorators included)
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+
+from benchmarks.report import measure
+
+
+def per_call_ns(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=200_000, help='calls per span timing')
+    parser.add_argument('--repeat', type=int, default=300, help='requests per endpoint and setting')
+    args = parser.parse_args()
+
+    from metrics import registry, span, timed
+
+    def bare():
+        pass
+
+    def with_span():
+        with span('bench.span'):
+            pass
+
+    decorated = timed('bench.timed')(bare)
+    baseline = per_call_ns(bare, args.number)
+    print(f"{'call':>14} {'ns':>8} {'overhead ns':>12}")
+    for name, fn in (('bare', bare), ('span', with_span), ('timed', decorated)):
+        cost = per_call_ns(fn, args.number)
+        print(f"{name:>14} {cost:>8.0f} {cost - baseline:>12.0f}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        from app import app
+        client = app.test_client()
+        session_id = client.post('/api/chat', json={'message': 'hello'}).get_json()['session_id']
+
+        def chat():
+            client.post('/api/chat', json={'message': 'hello', 'session_id': session_id}).close()
+
+        def history():
+            client.get(f'/api/history?session_id={session_id}').close()
+
+        print(f"\n{'endpoint':>14} {'enabled ms':>11} {'disabled ms':>12} {'overhead':>9}")
+        for name, fn in (('/api/chat', chat), ('/api/history', history)):
+            # Alternate short rounds so drift on a shared machine hits both sides alike
+            results = {True: [], False: []}
+            for _ in range(5):
+                for enabled in (True, False):
+                    registry.enabled = enabled
+                    results[enabled].append(measure(fn, max(1, args.repeat // 5), warmup=10)['p50'])
+            results = {enabled: min(p50s) for enabled, p50s in results.items()}
+            overhead = results[True] / results[False] - 1
+            print(f"{name:>14} {results[True]:>11.3f} {results[False]:>12.3f} {overhead:>+9.1%}")
+        registry.enabled = True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Microbenchmarks
+Per-call latency of preprocess_image, sanitize_input, extract_keywords,
+generate_text_response and each Database method, the latter at several
+table sizes. The app is imported, and the databases are created, inside a
+temporary working directory.
+"""
+
+import argparse
+import itertools
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.report import Report, measure
+
+TABLE_SIZES = (1_000, 10_000, 100_000)
+SESSIONS = 100
+WORDS = ('cat', 'dog', 'beach', 'sunset', 'car', 'tree', 'people', 'colour', 'picture', 'mountain')
+
+
+def bench_functions(report, workdir, repeat):
+    """Text and image helpers, timed on representative inputs"""
+    import cv2
+    import numpy as np
+    from utils import extract_keywords, preprocess_image, sanitize_input
+    from app import generate_text_response
+
+    photo = os.path.join(workdir, 'photo.jpg')
+    rng = np.random.default_rng(0)
+    pixels = cv2.GaussianBlur(rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8), (15, 15), 0)
+    cv2.imwrite(photo, pixels)
+
+    message = 'Can you describe the <b>people</b> on the beach; how many dogs {are} there?' * 3
+    report.add('preprocess_image 1920x1080 jpeg', measure(lambda: preprocess_image(photo), max(5, repeat // 20)))
+    report.add('sanitize_input', measure(lambda: sanitize_input(message), repeat * 10))
+    report.add('extract_keywords', measure(lambda: extract_keywords(message), repeat * 10))
+    report.add('generate_text_response', measure(lambda: generate_text_response(message), repeat * 10))
+
+
+def fill(db, rows):
+    """Bulk insert rows messages, a tenth as many uploads, queries and cache entries, all recent"""
+    now = datetime.now(timezone.utc)
+    stamp = lambda i: (now - timedelta(seconds=rows - i)).strftime('%Y-%m-%d %H:%M:%S')
+    text = lambda i: ' '.join(WORDS[(i * 7 + k) % len(WORDS)] for k in range(1 + i % 8))
+    conn = db.get_connection()
+    conn.executemany(
+        'INSERT INTO chat_history (session_id, message_type, content, timestamp) VALUES (?, ?, ?, ?)',
+        ((f"session_{i % SESSIONS}", 'user' if i % 2 else 'bot', text(i), stamp(i)) for i in range(rows))
+    )
+    conn.executemany(
+        'INSERT INTO image_uploads (filename, original_filename, file_path, file_size, content_hash, upload_timestamp) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        ((f"{i}.jpg", 'photo.jpg', f"uploads/{i}.jpg", 1000, f"hash{i}", stamp(i * 10)) for i in range(rows // 10))
+    )
+    conn.executemany(
+        'INSERT INTO queries (image_id, query_text, response_text, query_timestamp) VALUES (?, ?, ?, ?)',
+        ((i + 1, text(i), text(i + 3), stamp(i * 10)) for i in range(rows // 10))
+    )
+    conn.executemany(
+        'INSERT INTO inference_cache (cache_key, model_version, value, expires_at) VALUES (?, ?, ?, ?)',
+        ((f"key{i}", 'v1', '{}', 2 ** 40) for i in range(rows // 10))
+    )
+    conn.commit()
+    conn.close()
+    db.backfill_statistics()
+
+
+def bench_database(report, workdir, sizes, repeat):
+    """Every public Database query and write at each table size"""
+    from database import Database
+
+    for size in sizes:
+        db = Database(os.path.join(workdir, f"micro_{size}.db"), write_behind=False)
+        fill(db, size)
+        counter = itertools.count()
+        session = f"session_{SESSIONS // 2}"
+        middle_id = db.get_chat_history(session, limit=1000)[-1]['id']
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        cases = (
+            ('add_chat_message', lambda: db.add_chat_message(session, 'user', 'what is on the beach')),
+            ('get_chat_history', lambda: db.get_chat_history(session, limit=50)),
+            ('get_chat_history keyset', lambda: db.get_chat_history(session, limit=50, before_id=middle_id)),
+            ('add_image_upload', lambda: db.add_image_upload('new.jpg', 'new.jpg', 'uploads/new.jpg', 1000,
+                                                             f"new{next(counter)}")),
+            ('get_image_upload', lambda: db.get_image_upload(size // 20 + 1)),
+            ('get_image_by_hash', lambda: db.get_image_by_hash(f"hash{size // 20}")),
+            ('add_query', lambda: db.add_query(1, 'what is this', 'a cat')),
+            ('get_recent_queries', lambda: db.get_recent_queries(10)),
+            ('put_cached_result', lambda: db.put_cached_result(f"new{next(counter)}", 'v1', '{}', 2 ** 40)),
+            ('get_cached_result', lambda: db.get_cached_result(f"key{size // 20}", 0)),
+            ('purge_cached_results', lambda: db.purge_cached_results('v1', 0)),
+            ('get_statistics', db.get_statistics),
+            ('get_activity', lambda: db.get_activity(today, today, granularity='hour')),
+            ('search', lambda: db.search('sunset beach')),
+            ('search recent', lambda: db.search('sunset', order='recent')),
+            ('clear_old_data', db.clear_old_data),
+        )
+        for name, fn in cases:
+            report.add(f"db.{name} rows={size}", measure(fn, repeat), rows=size)
+        report.add(f"db.backfill_statistics rows={size}", measure(db.backfill_statistics, max(3, repeat // 20),
+                                                                 warmup=1), rows=size)
+        db.close()
+
+
+def run(report, workdir, sizes=TABLE_SIZES, repeat=200):
+    bench_functions(report, workdir, repeat)
+    bench_database(report, workdir, sizes, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(TABLE_SIZES), help='chat_history rows')
+    parser.add_argument('--repeat', type=int, default=200, help='calls per database benchmark')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    report = Report()
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        run(report, workdir, args.sizes, args.repeat)
+    report.print()
+    if output:
+        report.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Model runtime benchmark
+Latency and throughput of the CNN and NLP models on CPU, fp32 against
+int8, by batch size. Needs torch and torchvision (and transformers for
+the NLP model).
+"""
+
+import argparse
+import importlib.util
+import statistics
+import sys
+import time
+
+from model_handler import ModelHandler, torch_available
+
+
+def time_calls(fn, repeat):
+    """Per-call wall times in seconds, after one untimed call"""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_cnn(handler, batch_size, repeat, image_size):
+    import numpy as np
+    batch = np.random.default_rng(0).random((batch_size, image_size, image_size, 3), dtype=np.float32)
+    return time_calls(lambda: handler.extract_features(batch), repeat)
+
+
+def bench_nlp(handler, batch_size, repeat, words):
+    texts = [' '.join(f"word{(i + j) % 50}" for j in range(words)) for i in range(batch_size)]
+    return time_calls(lambda: handler.encode_text(texts), repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models', nargs='+', choices=['cnn', 'nlp'], default=['cnn', 'nlp'])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--words', type=int, default=16, help='words per NLP query')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads, 0 = torch default')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='skip downloading the CNN checkpoint (timings do not depend on it)')
+    args = parser.parse_args()
+
+    if not torch_available():
+        print("Error: the model benchmark needs torch and torchvision")
+        sys.exit(1)
+    models = [m for m in args.models if m == 'cnn' or importlib.util.find_spec('transformers') is not None]
+    if models != args.models:
+        print("Skipping nlp: transformers is not installed")
+
+    handlers = {
+        precision: ModelHandler(quantize=precision == 'int8', intra_op_threads=args.threads,
+                                backend='torch', pretrained=not args.random_weights)
+        for precision in ('fp32', 'int8')
+    }
+
+    print(f"{'model':>5} {'precision':>9} {'batch':>5} {'p50 ms':>9} {'p99 ms':>9} {'items/s':>9} {'speedup':>8}")
+    for model in models:
+        for batch_size in args.batch_sizes:
+            baseline = None
+            for precision, handler in handlers.items():
+                if model == 'cnn':
+                    samples = bench_cnn(handler, batch_size, args.repeat, args.image_size)
+                else:
+                    samples = bench_nlp(handler, batch_size, args.repeat, args.words)
+                samples.sort()
+                p50 = statistics.median(samples)
+                p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+                baseline = baseline or p50
+                print(f"{model:>5} {precision:>9} {batch_size:>5} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f} "
+                      f"{batch_size / p50:>9.1f} {baseline / p50:>7.2f}x")
+
+    for precision, handler in handlers.items():
+        print(f"{precision} load times (ms): {handler.get_model_info()['load_ms']}")
+
+
+if __name__ == '__main__':
+    main()
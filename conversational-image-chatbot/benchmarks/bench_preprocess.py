@@ -0,0 +1,86 @@
+"""
+Preprocessing benchmark
+Compares per-image preprocess_image against batched preprocess_images
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from utils import preprocess_image, preprocess_images
+
+BATCH_SIZES = (1, 8, 32, 128)
+
+
+def make_sample_images(directory, count, size=(1920, 1080)):
+    """Write synthetic JPEG photos of the given size and return their paths"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)
+    paths = []
+    for i in range(count):
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        img[:, :, 0] = gradient
+        img[:, :, 1] = (gradient[::-1] + i * 7) % 256
+        img[:, :, 2] = rng.integers(0, 256, size=(height, 1), dtype=np.uint8)
+        path = os.path.join(directory, f"sample_{i}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+
+def time_call(func, repeat):
+    """Best wall time of func over repeat runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(batch_sizes=BATCH_SIZES, repeat=3, image_size=(1920, 1080)):
+    """Run the benchmark and return one result row per batch size"""
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_sample_images(directory, max(batch_sizes), image_size)
+        
+        # Warm up decoders and the thread pool
+        preprocess_image(paths[0])
+        preprocess_images(paths[:2])
+        
+        for n in batch_sizes:
+            subset = paths[:n]
+            per_image = time_call(lambda: np.concatenate([preprocess_image(p) for p in subset]), repeat)
+            batched = time_call(lambda: preprocess_images(subset), repeat)
+            rows.append({
+                'batch_size': n,
+                'per_image_ms': per_image * 1000,
+                'batched_ms': batched * 1000,
+                'per_image_img_per_s': n / per_image,
+                'batched_img_per_s': n / batched,
+                'speedup': per_image / batched,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    args = parser.parse_args()
+    
+    rows = run(repeat=args.repeat, image_size=(args.width, args.height))
+    print(f"{'images':>6} {'per-image ms':>13} {'batched ms':>11} {'img/s before':>13} {'img/s after':>12} {'speedup':>8}")
+    for row in rows:
+        print(f"{row['batch_size']:>6} {row['per_image_ms']:>13.1f} {row['batched_ms']:>11.1f} "
+              f"{row['per_image_img_per_s']:>13.1f} {row['batched_img_per_s']:>12.1f} {row['speedup']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Full-text search benchmark
+Latency of Database.search (FTS5) for rare and common words, prefixes,
+session and date filters and both orderings, against the LIKE '%word%'
+scan it replaces, on a synthetic chat_history/queries table
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import Database
+
+SESSIONS = 1000
+WORDS = ('cat', 'dog', 'beach', 'sunset', 'car', 'tree', 'people', 'colour', 'picture', 'mountain',
+         'river', 'street', 'building', 'sky', 'bird', 'flower', 'table', 'window', 'city', 'snow')
+
+
+def sentence(rng, rare_every, i):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(4, 16))]
+    if i % rare_every == 0:
+        words.append('zeppelin')
+    return ' '.join(words)
+
+
+def fill(db, rows, queries, rare_every, chunk=100_000):
+    """Bulk insert synthetic messages and queries, one second apart"""
+    rng = random.Random(0)
+    base = datetime(2025, 1, 1)
+    conn = db.get_connection()
+    for offset in range(0, rows, chunk):
+        conn.executemany(
+            'INSERT INTO chat_history (session_id, message_type, content, timestamp) VALUES (?, ?, ?, ?)',
+            ((f"session_{i % SESSIONS}", 'user' if i % 2 else 'bot', sentence(rng, rare_every, i),
+              (base + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S'))
+             for i in range(offset, min(rows, offset + chunk)))
+        )
+        conn.commit()
+    conn.executemany(
+        'INSERT INTO queries (query_text, response_text, query_timestamp) VALUES (?, ?, ?)',
+        ((sentence(rng, rare_every, i), sentence(rng, rare_every, i + 1),
+          (base + timedelta(seconds=i * rows // max(queries, 1))).strftime('%Y-%m-%d %H:%M:%S'))
+         for i in range(queries))
+    )
+    conn.commit()
+    conn.close()
+    return (base + timedelta(seconds=rows // 2)).strftime('%Y-%m-%d')
+
+
+def like_scan(db, word):
+    conn = db.get_connection()
+    rows = conn.execute('SELECT id FROM chat_history WHERE content LIKE ? ORDER BY id DESC LIMIT 20',
+                        (f'%{word}%',)).fetchall()
+    conn.close()
+    return rows
+
+
+def timed(fn, repeat):
+    """Median milliseconds over repeat calls"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='chat messages')
+    parser.add_argument('--queries', type=int, default=200_000, help='query/response rows')
+    parser.add_argument('--rare-every', type=int, default=50_000, help='one message in N has the rare word')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), write_behind=False)
+        start = time.perf_counter()
+        day = fill(db, args.rows, args.queries, args.rare_every)
+        print(f"indexed {args.rows} messages and {args.queries} queries in {time.perf_counter() - start:.1f}s")
+
+        cases = (
+            ('rare word', lambda: db.search('zeppelin')),
+            ('common word', lambda: db.search('sunset')),
+            ('common word, no window', lambda: db.search('sunset', rank_window=0)),
+            ('common word, recent', lambda: db.search('sunset', order='recent')),
+            ('common word, session', lambda: db.search('sunset', session_id=f"session_{SESSIONS // 2}")),
+            ('prefix', lambda: db.search('mou', prefix=True)),
+            ('common word, one day', lambda: db.search('sunset', start=day, end=day)),
+            ('LIKE scan', lambda: like_scan(db, 'sunset')),
+            ('LIKE scan, rare word', lambda: like_scan(db, 'zeppelin')),
+        )
+        print(f"{'search':>24} {'median ms':>10}")
+        for name, fn in cases:
+            print(f"{name:>24} {timed(fn, args.repeat):>10.1f}")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
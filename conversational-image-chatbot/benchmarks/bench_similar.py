@@ -0,0 +1,82 @@
+"""
+Similarity search benchmark
+Query latency of the feature store's exact memmap scan against the IVF
+coarse index, and the index's recall, on synthetic clustered vectors
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from feature_store import FeatureStore
+
+
+def make_vectors(rows, dim, clusters, seed=0):
+    """Non-negative clustered vectors, like pooled CNN activations"""
+    rng = np.random.default_rng(seed)
+    centers = rng.gamma(0.5, size=(clusters, dim)).astype(np.float32)
+    noise = rng.gamma(0.5, size=(rows, dim)).astype(np.float32)
+    return centers[rng.integers(clusters, size=rows)] + 0.5 * noise
+
+
+def fill(store, vectors, chunk=100000):
+    for start in range(0, len(vectors), chunk):
+        stop = min(start + chunk, len(vectors))
+        store.add_many(list(range(start, stop)), vectors[start:stop])
+
+
+def time_queries(store, queries, k):
+    """Per-query latencies (ms) and results"""
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([image_id for image_id, _ in store.search(query, k)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=1280, help='mobilenet_v2 features are 1280-dimensional')
+    parser.add_argument('--dtype', choices=['float16', 'float32'], default='float16')
+    parser.add_argument('--clusters', type=int, default=256, help='clusters in the synthetic data')
+    parser.add_argument('--lists', type=int, default=1024, help='IVF lists')
+    parser.add_argument('--probes', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.rows, args.dim, args.clusters)
+    queries = vectors[np.random.default_rng(1).choice(args.rows, args.queries, replace=False)]
+    queries = queries + np.random.default_rng(2).gamma(0.5, size=queries.shape).astype(np.float32) * 0.1
+
+    with tempfile.TemporaryDirectory() as directory:
+        exact = FeatureStore(directory=directory, model_version='bench', dtype=args.dtype, index_lists=0)
+        start = time.perf_counter()
+        fill(exact, vectors)
+        print(f"stored {args.rows} x {args.dim} {args.dtype} vectors "
+              f"({exact.get_stats()['bytes'] / 2 ** 20:.0f} MiB) in {time.perf_counter() - start:.1f}s")
+
+        exact_ms, exact_results = time_queries(exact, queries, args.k)
+
+        indexed = FeatureStore(directory=directory, model_version='bench', dtype=args.dtype,
+                               index_lists=args.lists, index_probes=args.probes, index_min_rows=0)
+        start = time.perf_counter()
+        indexed.build_index()
+        print(f"IVF training ({args.lists} lists): {time.perf_counter() - start:.1f}s")
+        indexed_ms, indexed_results = time_queries(indexed, queries, args.k)
+
+        recall = statistics.mean(len(set(a) & set(b)) / args.k for a, b in zip(exact_results, indexed_results))
+        scanned = indexed.get_stats()['rows_scanned'] / args.queries
+
+    print(f"{'search':>8} {'p50 ms':>9} {'max ms':>9} {'rows scored':>12} {'recall@k':>9}")
+    print(f"{'exact':>8} {statistics.median(exact_ms):>9.1f} {max(exact_ms):>9.1f} {args.rows:>12} {1.0:>9.2f}")
+    print(f"{'ivf':>8} {statistics.median(indexed_ms):>9.1f} {max(indexed_ms):>9.1f} {scanned:>12.0f} {recall:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Startup benchmark
+Breaks down ``import app`` with ``python -X importtime``, measures the wall
+time from launching the server to its first served request, and checks
+that heavy libraries stay unloaded until warm-up. Exits non-zero when a
+budget is exceeded, so it can gate CI.
+"""
+
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that must only be loaded by warm_up() or the first image request
+HEAVY_MODULES = ('cv2', 'numpy', 'PIL.Image', 'torch', 'transformers')
+
+
+def run_python(args, workdir):
+    env = dict(os.environ, PYTHONPATH=APP_DIR)
+    return subprocess.run([sys.executable, *args], cwd=workdir, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def import_breakdown(module, workdir):
+    """Cumulative import time per top-level dependency of ``module`` (ms), from -X importtime"""
+    stderr = run_python(['-X', 'importtime', '-c', f'import {module}'], workdir).stderr
+    total, packages = 0.0, {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if name.strip() == module and depth == 0:
+            total = int(cumulative) / 1000
+        elif depth == 1:
+            packages[name.strip()] = int(cumulative) / 1000
+    return total, packages
+
+
+def wall_import(module, workdir, repeat):
+    """Median wall time of a fresh interpreter running ``import module`` (ms)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_python(['-c', f'import {module}'], workdir)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def loaded_heavy_modules(module, workdir):
+    """Heavy libraries present in sys.modules right after importing ``module``"""
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    return run_python(['-c', code], workdir).stdout.split()
+
+
+def first_request(port, workdir, path='/healthz', timeout=60):
+    """Milliseconds from launching the development server to its first 200 response"""
+    env = dict(os.environ, PYTHONPATH=APP_DIR)
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.load_test', '--serve', 'dev', '--port', str(port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                conn.request('GET', path)
+                if conn.getresponse().status == 200:
+                    return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"server on port {port} did not answer within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--top', type=int, default=10, help='dependencies to list in the breakdown')
+    parser.add_argument('--max-import-ms', type=float, default=600.0,
+                        help='budget for the wall time of a fresh interpreter importing the app')
+    parser.add_argument('--max-first-request-ms', type=float, default=2000.0,
+                        help='budget from launching the server to its first served request')
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        total, packages = import_breakdown(args.module, workdir)
+        print(f"import {args.module}: {total:.1f}ms cumulative (-X importtime)")
+        for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {name:<30} {ms:>8.1f}ms")
+
+        wall = wall_import(args.module, workdir, args.repeat)
+        print(f"interpreter + import {args.module}: {wall:.1f}ms (median of {args.repeat})")
+        if wall > args.max_import_ms:
+            failures.append(f"import took {wall:.1f}ms, budget {args.max_import_ms:.0f}ms")
+
+        heavy = loaded_heavy_modules(args.module, workdir)
+        print(f"heavy modules loaded at import: {', '.join(heavy) or 'none'}")
+        if heavy:
+            failures.append(f"importing {args.module} loads {', '.join(heavy)}; defer them to warm_up()")
+
+        first = first_request(args.port, workdir)
+        print(f"launch to first served request: {first:.1f}ms")
+        if first > args.max_first_request_ms:
+            failures.append(f"first request after {first:.1f}ms, budget {args.max_first_request_ms:.0f}ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Text pipeline benchmark
+Throughput of the translate-based sanitize_input/extract_keywords against
+the per-character loops they replaced, and of TextPipeline (batched,
+dynamically padded, LRU-cached) against padding every query to the model
+maximum. The tokenizer and encoder sections need transformers (and torch).
+"""
+
+import argparse
+import importlib.util
+import random
+import time
+
+from text_pipeline import TextPipeline
+from utils import extract_keywords, sanitize_input
+
+WORDS = ('what', 'is', 'the', 'colour', 'of', 'this', 'dog', 'on', 'a', 'beach', 'how', 'many',
+         'people', 'are', 'in', 'picture', 'describe', 'scene', '<b>', 'sky;', '{x}', 'identify')
+
+
+def legacy_sanitize_input(text, max_length=500):
+    """sanitize_input before the translate table: one replace pass per character"""
+    if not text:
+        return ""
+    text = text.strip()
+    text = text[:max_length]
+    for char in ['<', '>', '{', '}', '\\', ';']:
+        text = text.replace(char, '')
+    return text
+
+
+def legacy_extract_keywords(text):
+    """extract_keywords before the module-level stopword set"""
+    stopwords = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'in', 'on', 'at', 'to', 'for', 'of', 'and', 'or'}
+    words = text.lower().split()
+    return [word for word in words if word not in stopwords and len(word) > 2]
+
+
+def make_queries(count, distinct, seed=0):
+    """Queries drawn from ``distinct`` phrasings with a Zipf-like popularity"""
+    rng = random.Random(seed)
+    phrasings = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 24))) for _ in range(distinct)]
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    return rng.choices(phrasings, weights=weights, k=count)
+
+
+def throughput(fn, items, repeat):
+    """Best items per second over repeat runs of fn(items)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(items)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best
+
+
+def batched(queries, batch_size):
+    return [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+
+def bench_normalize(queries, repeat):
+    rows = []
+    for name, old, new in (('sanitize_input', legacy_sanitize_input, sanitize_input),
+                           ('extract_keywords', legacy_extract_keywords, extract_keywords)):
+        before = throughput(lambda items: [old(q) for q in items], queries, repeat)
+        after = throughput(lambda items: [new(q) for q in items], queries, repeat)
+        rows.append((name, before, after))
+    return rows
+
+
+def bench_tokenize(tokenizer, queries, batch_size, max_length, repeat):
+    """(label, queries/s, mean padded width) for the old and new tokenization paths"""
+    batches = batched(queries, batch_size)
+
+    def padded_to_max(items):
+        return [tokenizer(batch, padding='max_length', truncation=True, max_length=max_length,
+                          return_tensors='np') for batch in batches]
+
+    def run_pipeline(pipeline):
+        return lambda items: [pipeline.encode(batch) for batch in batches]
+
+    uncached = TextPipeline(lambda: tokenizer, max_length=max_length, cache_size=0)
+    cached = TextPipeline(lambda: tokenizer, max_length=max_length)
+    rows = [('padded to max_length', throughput(padded_to_max, queries, repeat), float(max_length))]
+    for label, pipeline in (('pipeline, no cache', uncached), ('pipeline, LRU', cached)):
+        rate = throughput(run_pipeline(pipeline), queries, repeat)
+        stats = pipeline.get_stats()
+        rows.append((label, rate, stats['padded_positions'] / (stats['batches'] / len(batches) * len(queries))))
+    return rows, cached.get_stats()
+
+
+def bench_encoder(handler, queries, batch_size, max_length, repeat):
+    """Encoder queries/s with batches padded to max_length against dynamic padding"""
+    import torch
+    tokenizer, encoder = handler.nlp()
+    batches = batched(queries, batch_size)
+    pipeline = TextPipeline(lambda: tokenizer, max_length=max_length)
+    fixed = [tokenizer(batch, padding='max_length', truncation=True, max_length=max_length,
+                       return_tensors='pt') for batch in batches]
+    dynamic = [{name: torch.from_numpy(array) for name, array in pipeline.encode(batch).items()} for batch in batches]
+
+    def forward(inputs):
+        with torch.inference_mode():
+            return [encoder(**batch) for batch in inputs]
+
+    return [('padded to max_length', throughput(lambda _: forward(fixed), queries, repeat)),
+            ('dynamic padding', throughput(lambda _: forward(dynamic), queries, repeat))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, default=4096)
+    parser.add_argument('--distinct', type=int, default=512, help='distinct phrasings among the queries')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-length', type=int, default=128)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model-path', help='directory holding the NLP model (default Config.MODEL_PATH)')
+    parser.add_argument('--encoder', action='store_true', help='also time encoder forward passes')
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries, args.distinct)
+
+    print(f"{'function':>18} {'before q/s':>12} {'after q/s':>12} {'speedup':>8}")
+    for name, before, after in bench_normalize(queries, args.repeat):
+        print(f"{name:>18} {before:>12.0f} {after:>12.0f} {after / before:>7.2f}x")
+
+    if importlib.util.find_spec('transformers') is None:
+        print("Skipping tokenization: transformers is not installed")
+        return
+
+    from model_handler import ModelHandler
+    handler = ModelHandler(model_path=args.model_path, backend='torch')
+    tokenizer, _ = handler.nlp()
+
+    rows, stats = bench_tokenize(tokenizer, queries, args.batch_size, args.max_length, args.repeat)
+    print(f"\n{'tokenization':>22} {'q/s':>10} {'width':>7}")
+    for label, rate, width in rows:
+        print(f"{label:>22} {rate:>10.0f} {width:>7.1f}")
+    print(f"LRU hit rate {stats['hit_rate']:.0%}, padding efficiency {stats['padding_efficiency']:.0%}")
+
+    if args.encoder:
+        print(f"\n{'encoder':>22} {'q/s':>10}")
+        for label, rate in bench_encoder(handler, queries, args.batch_size, args.max_length, args.repeat):
+            print(f"{label:>22} {rate:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
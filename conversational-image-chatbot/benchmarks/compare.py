@@ -0,0 +1,45 @@
+"""
+Benchmark comparison
+Compares a result file against a stored baseline and exits non-zero when
+any benchmark regressed by more than the threshold, so it can gate CI:
+``python -m benchmarks.compare baseline.json results.json --threshold 0.15``
+"""
+
+import argparse
+import sys
+
+from benchmarks.report import Report, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('baseline', help='stored baseline report (JSON)')
+    parser.add_argument('current', help='new report (JSON)')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed relative slowdown, e.g. 0.1 for 10%%')
+    parser.add_argument('--metric', choices=['mean', 'min', 'p50', 'p95', 'p99'], default='p50',
+                        help='latency statistic to compare (rates always compare their value)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='ignore latency changes smaller than this many milliseconds')
+    parser.add_argument('--fail-on-missing', action='store_true', help='also fail when a baseline benchmark is missing')
+    args = parser.parse_args()
+
+    baseline, current = Report.load(args.baseline), Report.load(args.current)
+    rows = compare(baseline, current, args.threshold, args.metric, args.min_delta_ms)
+
+    print(f"baseline {baseline.meta.get('git')} ({baseline.meta.get('created')}) -> "
+          f"current {current.meta.get('git')} ({current.meta.get('created')}), {args.metric}, "
+          f"threshold {args.threshold:.0%}")
+    print(f"{'benchmark':<48} {'baseline':>10} {'current':>10} {'change':>8}  status")
+    for name, before, after, change, status in rows:
+        before_text = f"{before:>10.3f}" if before is not None else f"{'-':>10}"
+        after_text = f"{after:>10.3f}" if after is not None else f"{'-':>10}"
+        change_text = f"{change:>+8.1%}" if change is not None else f"{'':>8}"
+        print(f"{name:<48} {before_text} {after_text} {change_text}  {status}")
+
+    failed = [row for row in rows if row[4] == 'regression' or (args.fail_on_missing and row[4] == 'missing')]
+    print(f"{len(failed)} regression(s) beyond {args.threshold:.0%}" if failed else "no regressions")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
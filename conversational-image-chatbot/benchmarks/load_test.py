@@ -0,0 +1,182 @@
+"""
+Serving load test
+Starts the app under the threaded development server and under the ASGI
+server with process offload, drives both with concurrent clients sending
+a mix of image uploads (cache misses, so every one decodes a large JPEG)
+and text chats, and reports req/s and per-endpoint p50/p95/p99 latency
+(optionally as JSON for benchmarks.compare). Needs uvicorn for the asgi
+mode.
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.report import Report, summarize
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOUNDARY = 'loadtestboundary'
+
+
+def serve(mode, port):
+    """Server process entry point"""
+    if mode == 'asgi':
+        import uvicorn
+        from asgi import application
+        uvicorn.run(application, host='127.0.0.1', port=port, lifespan='on', log_level='warning')
+    else:
+        from werkzeug.serving import run_simple
+        from app import app
+        run_simple('127.0.0.1', port, app, threaded=True)
+
+
+def make_image(width, height):
+    """Noise JPEG, so decoding is as expensive as for a real photo"""
+    pixels = (np.random.default_rng(0).random((height, width, 3)) * 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def multipart(image, query):
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="query"\r\n\r\n{query}\r\n'.encode(),
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="load.jpg"\r\n'
+        'Content-Type: image/jpeg\r\n\r\n'.encode(),
+        image,
+        f'\r\n--{BOUNDARY}--\r\n'.encode(),
+    ]
+    return b''.join(parts)
+
+
+def client(port, image, upload_ratio, deadline, seed, results):
+    """Send requests on one keep-alive connection until the deadline"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    rng = np.random.default_rng(seed)
+    i = 0
+    while time.perf_counter() < deadline:
+        i += 1
+        if rng.random() < upload_ratio:
+            kind = 'upload'
+            # A fresh query per request misses the result cache
+            body = multipart(image, f"what is this {seed}-{i}")
+            headers = {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+            path = '/api/upload'
+        else:
+            kind = 'chat'
+            body = json.dumps({'message': 'hello'}).encode()
+            headers = {'Content-Type': 'application/json'}
+            path = '/api/chat'
+
+        start = time.perf_counter()
+        try:
+            conn.request('POST', path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            status = 0
+        results.append((kind, status, time.perf_counter() - start))
+    conn.close()
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/inference/stats')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def run_mode(mode, port, args, image):
+    """Start a server for one mode, load it and summarize"""
+    env = dict(os.environ, PYTHONPATH=APP_DIR, OFFLOAD_WORKERS=str(args.offload_workers if mode == 'asgi' else 0))
+    with tempfile.TemporaryDirectory() as workdir:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.load_test', '--serve', mode, '--port', str(port)],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_ready(port)
+            # Warm up offload workers and caches before measuring
+            warm = []
+            client(port, image, 1.0, time.perf_counter() + 2, args.clients, warm)
+
+            results = []
+            deadline = time.perf_counter() + args.duration
+            threads = [
+                threading.Thread(target=client, args=(port, image, args.upload_ratio, deadline, seed, results))
+                for seed in range(args.clients)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait(10)
+
+    summary = {'rps': sum(1 for _, status, _ in results if status == 200) / elapsed,
+               'errors': sum(1 for _, status, _ in results if status != 200)}
+    for kind in ('chat', 'upload'):
+        summary[kind] = summarize([latency for k, status, latency in results if k == kind and status == 200])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--serve', choices=['dev', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--modes', nargs='+', choices=['dev', 'asgi'], default=['dev', 'asgi'])
+    parser.add_argument('--clients', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per run')
+    parser.add_argument('--upload-ratio', type=float, default=0.3)
+    parser.add_argument('--image-size', type=int, nargs=2, default=[2048, 1536], metavar=('W', 'H'))
+    parser.add_argument('--offload-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    image = make_image(*args.image_size)
+    report = Report()
+    print(f"{'clients':>7} {'mode':>5} {'req/s':>8} {'chat p50':>9} {'chat p95':>9} {'chat p99':>9} "
+          f"{'upload p50':>11} {'upload p95':>11} {'upload p99':>11} {'errors':>7}")
+    for clients in args.clients:
+        for mode in args.modes:
+            run_args = argparse.Namespace(**{**vars(args), 'clients': clients})
+            result = run_mode(mode, args.port, run_args, image)
+            chat, upload = result['chat'], result['upload']
+            print(f"{clients:>7} {mode:>5} {result['rps']:>8.1f} "
+                  f"{chat['p50']:>9.1f} {chat['p95']:>9.1f} {chat['p99']:>9.1f} "
+                  f"{upload['p50']:>11.1f} {upload['p95']:>11.1f} {upload['p99']:>11.1f} {result['errors']:>7}")
+            report.add_rate(f"load {mode} clients={clients} throughput", result['rps'], unit='req/s')
+            report.add(f"load {mode} clients={clients} chat", chat)
+            report.add(f"load {mode} clients={clients} upload", upload)
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == '__main__':
+    main()
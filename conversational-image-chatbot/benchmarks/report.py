@@ -0,0 +1,143 @@
+"""
+Benchmark reports
+Timing helpers shared by the suite, a JSON result format, and comparison
+of two result files with a regression threshold.
+
+A report is ``{"meta": {...}, "results": {name: entry}}``. Latency entries
+hold ``unit: "ms"`` and mean/min/p50/p95/p99 over ``samples`` timings.
+Rate entries hold a unit ending in ``/s`` and a single ``value``. Lower
+is better for latencies, higher for rates.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of already sorted values"""
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def summarize(seconds):
+    """Latency entry (milliseconds) for a list of timings in seconds"""
+    values = sorted(s * 1000 for s in seconds)
+    return {
+        'unit': 'ms',
+        'samples': len(values),
+        'mean': sum(values) / len(values) if values else 0.0,
+        'min': values[0] if values else 0.0,
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+    }
+
+
+def measure(fn, repeat=100, warmup=3, min_time=0.0):
+    """Time ``repeat`` calls of fn() (more if min_time seconds have not passed) after warm-up calls"""
+    for _ in range(warmup):
+        fn()
+    seconds = []
+    started = time.perf_counter()
+    while len(seconds) < repeat or time.perf_counter() - started < min_time:
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Report:
+    """Named benchmark results plus the environment they were measured in"""
+
+    def __init__(self, results=None, meta=None):
+        self.results = dict(results or {})
+        self.meta = meta or {
+            'created': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'argv': sys.argv[1:],
+        }
+
+    def add(self, name, entry, **extra):
+        """Record an entry (from measure/summarize, or a rate) and return it"""
+        self.results[name] = {**entry, **extra}
+        return self.results[name]
+
+    def add_rate(self, name, value, unit='ops/s'):
+        return self.add(name, {'unit': unit, 'value': value})
+
+    def merge(self, other):
+        self.results.update(other.results)
+
+    def print(self, names=None):
+        """Print entries as a table, in insertion order"""
+        print(f"{'benchmark':<48} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rate':>12}")
+        for name in names or self.results:
+            entry = self.results[name]
+            if entry['unit'] == 'ms':
+                print(f"{name:<48} {entry['p50']:>9.3f} {entry['p95']:>9.3f} {entry['p99']:>9.3f}")
+            else:
+                print(f"{name:<48} {'':>9} {'':>9} {'':>9} {entry['value']:>8.1f} {entry['unit']}")
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'meta': self.meta, 'results': self.results}, f, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['results'], data.get('meta'))
+
+
+def headline(entry, metric):
+    """The compared number of an entry and whether higher is better"""
+    if entry['unit'].endswith('/s'):
+        return entry['value'], True
+    return entry[metric], False
+
+
+def compare(baseline, current, threshold=0.10, metric='p50', min_delta_ms=0.05):
+    """Per-benchmark change from baseline to current
+
+    Returns (name, baseline value, current value, relative change, status)
+    rows, where status is 'regression' when the result got worse by more
+    than threshold (and, for latencies, by more than min_delta_ms, so
+    sub-microsecond noise is not flagged), 'improvement' when it got
+    better by as much, 'ok', or 'new'/'missing' for unmatched names.
+    """
+    rows = []
+    for name in sorted(set(baseline.results) | set(current.results)):
+        if name not in current.results:
+            rows.append((name, headline(baseline.results[name], metric)[0], None, None, 'missing'))
+            continue
+        if name not in baseline.results:
+            rows.append((name, None, headline(current.results[name], metric)[0], None, 'new'))
+            continue
+        before, higher_is_better = headline(baseline.results[name], metric)
+        after, _ = headline(current.results[name], metric)
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        significant = higher_is_better or abs(after - before) >= min_delta_ms
+        if worse > threshold and significant:
+            status = 'regression'
+        elif worse < -threshold and significant:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, before, after, change, status))
+    return rows
@@ -0,0 +1,55 @@
+"""
+Benchmark suite
+Runs the microbenchmarks and endpoint benchmarks into one JSON report,
+for storing as a baseline and checking with benchmarks.compare:
+
+    python -m benchmarks.suite --output baseline.json
+    ... change code ...
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.compare baseline.json results.json
+
+The load test starts servers and runs for a fixed duration, so it is run
+separately (``python -m benchmarks.load_test --output load.json``).
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+from benchmarks import bench_endpoints, bench_micro
+from benchmarks.report import Report
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=['micro', 'endpoints'], default=['micro', 'endpoints'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(bench_micro.TABLE_SIZES),
+                        help='table sizes for the database microbenchmarks')
+    parser.add_argument('--repeat', type=int, default=200, help='calls per benchmark')
+    parser.add_argument('--quick', action='store_true', help='small tables and few calls, for a smoke run')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes, args.repeat = [1_000], 20
+
+    report = Report()
+    output = os.path.abspath(args.output) if args.output else None
+    # The app and databases are created relative to the working directory
+    sys.path.insert(0, APP_DIR)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        if 'micro' in args.only:
+            bench_micro.run(report, workdir, args.sizes, args.repeat)
+        if 'endpoints' in args.only:
+            bench_endpoints.run(report, max(10, args.repeat // 2))
+    report.print()
+    if output:
+        report.write(output)
+        print(f"wrote {len(report.results)} results to {output}")
+
+
+if __name__ == '__main__':
+    main()
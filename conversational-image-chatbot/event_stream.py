@@ -0,0 +1,60 @@
+"""
+Event Stream
+Server-sent events for endpoints that produce their answer incrementally.
+Handlers are written as generators of ``(event, data)`` pairs; the same
+generator is streamed to clients that accept ``text/event-stream`` and
+drained into a single JSON response for everyone else.
+"""
+
+import json
+
+from flask import Response, jsonify
+
+MIMETYPE = 'text/event-stream'
+
+
+def wants_event_stream(request):
+    """Whether the client asked for server-sent events (JSON stays the default for */*)"""
+    return request.accept_mimetypes.best_match(['application/json', MIMETYPE]) == MIMETYPE
+
+
+def format_event(event, data):
+    """One SSE frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_events(events, error_status=None):
+    """Stream ``(event, data)`` pairs as server-sent events
+
+    Each frame is flushed as soon as it is produced. Headers are already
+    sent by the time a step fails, so exceptions become a final ``error``
+    event; ``error_status(exc)`` maps them to the status the JSON path
+    would have returned.
+    """
+    def generate():
+        try:
+            for event, data in events:
+                yield format_event(event, data)
+        except Exception as e:
+            status = error_status(e) if error_status else 500
+            yield format_event('error', {'error': str(e), 'status': status})
+
+    return Response(generate(), mimetype=MIMETYPE, headers={
+        'Cache-Control': 'no-cache',
+        # Keep reverse proxies (nginx) from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+
+
+def drain_events(events):
+    """Run ``(event, data)`` pairs to completion and return the payload of the final ``done`` event"""
+    result = None
+    for event, data in events:
+        if event == 'done':
+            result = data
+    return result
+
+
+def collect_events(events):
+    """Drain ``(event, data)`` pairs and answer with the final ``done`` payload as JSON"""
+    return jsonify(drain_events(events))
@@ -0,0 +1,346 @@
+"""
+Feature Store
+Append-only, memory-mapped matrix of CNN feature vectors keyed by
+image_uploads.id, with cosine nearest-neighbour search and an optional
+IVF coarse index
+"""
+
+import json
+import os
+import threading
+
+from config import Config
+
+RECORDS_FILE = 'features.bin'
+META_FILE = 'features.json'
+
+
+class FeatureStore:
+    """Persist one feature vector per upload and search them by cosine similarity
+
+    Records are fixed-size ``(image id, vector)`` pairs appended to
+    ``directory/features.bin`` with a single write each, so several worker
+    processes can share the file; every process memory-maps it and picks
+    up rows appended by the others on its next call. Removing an image
+    overwrites its id with -1 in place. The store is tied to the model
+    version recorded in ``features.json`` and starts over when the model
+    changes, since older vectors are not comparable.
+
+    Searches scan the memmap in blocks of ``block_rows`` with vectorized
+    matrix products. With ``index_lists`` set, past ``index_min_rows``
+    vectors a background thread trains a spherical k-means coarse quantizer
+    (IVF) and later searches only score the rows of the ``index_probes``
+    nearest lists; it is retrained once the store has doubled. The index
+    lives in memory and is rebuilt after a restart.
+    """
+
+    def __init__(self, directory=None, model_version=None, dtype=None, block_rows=None,
+                 index_lists=None, index_probes=None, index_min_rows=None):
+        self.directory = directory or Config.FEATURE_STORE_PATH
+        self.model_version = model_version
+        self.dtype = dtype or Config.FEATURE_STORE_DTYPE
+        self.block_rows = block_rows or Config.FEATURE_SEARCH_BLOCK_ROWS
+        self.index_lists = Config.FEATURE_INDEX_LISTS if index_lists is None else index_lists
+        self.index_probes = index_probes or Config.FEATURE_INDEX_PROBES
+        self.index_min_rows = Config.FEATURE_INDEX_MIN_ROWS if index_min_rows is None else index_min_rows
+
+        self.records_path = os.path.join(self.directory, RECORDS_FILE)
+        self.meta_path = os.path.join(self.directory, META_FILE)
+
+        self.dim = None
+        self._record = None  # structured dtype of one row
+        self._map = None
+        self._rows = 0
+        self._row_of = {}  # image id -> row
+        self._norms = None  # float32 vector norms, grown by doubling
+        self._index = None
+        self._trainer = None
+        self._lock = threading.Lock()
+
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'added': 0,
+            'removed': 0,
+            'searches': 0,
+            'rows_scanned': 0,
+            'index_builds': 0,
+        }
+
+    def _open(self, dim=None):
+        """Load or create the metadata (caller holds the lock); False while nothing is stored"""
+        if self.dim is not None:
+            return True
+
+        import numpy as np
+        meta = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta.get('model_version') != self.model_version or meta.get('dtype') != self.dtype:
+                print(f"Feature store: model or dtype changed, discarding {self.records_path}")
+                for path in (self.records_path, self.meta_path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                meta = None
+
+        if meta is None:
+            if dim is None:
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            meta = {'dim': dim, 'dtype': self.dtype, 'model_version': self.model_version}
+            temp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(temp_path, self.meta_path)
+
+        self.dim = meta['dim']
+        self._record = np.dtype([('id', '<i8'), ('vector', self.dtype, (self.dim,))])
+        self._norms = np.empty(1024, dtype=np.float32)
+        return True
+
+    def _refresh(self):
+        """Map rows appended since the last call, by this or another process (caller holds the lock)"""
+        import numpy as np
+        try:
+            rows = os.path.getsize(self.records_path) // self._record.itemsize
+        except FileNotFoundError:
+            rows = 0
+        if rows <= self._rows:
+            return
+
+        # A torn trailing record (crash mid-append) stays unmapped
+        self._map = np.memmap(self.records_path, dtype=self._record, mode='r+', shape=(rows,))
+        new = self._map[self._rows:rows]
+        for offset, image_id in enumerate(new['id'].tolist()):
+            if image_id >= 0:
+                self._row_of[image_id] = self._rows + offset
+
+        if rows > len(self._norms):
+            norms = np.empty(max(rows, 2 * len(self._norms)), dtype=np.float32)
+            norms[:self._rows] = self._norms[:self._rows]
+            self._norms = norms
+        self._norms[self._rows:rows] = np.linalg.norm(new['vector'].astype(np.float32), axis=1)
+        self._rows = rows
+
+    def add(self, image_id, features):
+        """Store an image's feature vector (kept as is if the image already has one)"""
+        return self.add_many([image_id], [features]) == 1
+
+    def add_many(self, image_ids, features):
+        """Store vectors for many images in one append (a backfill); returns how many were new"""
+        import numpy as np
+        vectors = np.asarray(features, dtype=np.float32).reshape(len(image_ids), -1)
+        with self._lock:
+            self._open(dim=vectors.shape[1])
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Feature store holds {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+            self._refresh()
+            new = [i for i, image_id in enumerate(image_ids) if image_id not in self._row_of]
+            if not new:
+                return 0
+
+            records = np.zeros(len(new), dtype=self._record)
+            records['id'] = [image_ids[i] for i in new]
+            records['vector'] = vectors[new]
+            with open(self.records_path, 'ab') as f:
+                f.write(records.tobytes())
+            self._refresh()
+            self._counters['added'] += len(new)
+            return len(new)
+
+    def get(self, image_id):
+        """An image's stored float32 feature vector, or None"""
+        with self._lock:
+            row = None
+            if self._open():
+                self._refresh()
+                row = self._row_of.get(image_id)
+                # Another process may have removed it since
+                if row is not None and self._map[row]['id'] != image_id:
+                    del self._row_of[image_id]
+                    row = None
+            if row is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['hits'] += 1
+            return self._map[row]['vector'].astype('float32')
+
+    def remove(self, image_id):
+        """Drop an image's vector from search results and lookups"""
+        with self._lock:
+            if not self._open():
+                return False
+            self._refresh()
+            row = self._row_of.pop(image_id, None)
+            if row is None:
+                return False
+            self._map['id'][row] = -1
+            self._map.flush()
+            self._counters['removed'] += 1
+            return True
+
+    def search(self, features, k=10, exclude=None):
+        """The ``k`` most similar stored images as ``(image_id, cosine similarity)`` pairs, best first"""
+        import numpy as np
+        query = np.asarray(features, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        with self._lock:
+            if not self._open():
+                return []
+            if len(query) != self.dim:
+                raise ValueError(f"Feature store holds {self.dim}-dimensional vectors, got {len(query)}")
+            self._refresh()
+            records, norms, rows = self._map, self._norms[:self._rows], self._rows
+            candidates = self._candidates(query, rows) if self.index_lists else None
+            self._counters['searches'] += 1
+            self._counters['rows_scanned'] += rows if candidates is None else len(candidates)
+
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        total = rows if candidates is None else len(candidates)
+        # float16 rows are widened into one reused buffer; the cast, not the product, dominates the scan
+        buffer = np.empty((min(self.block_rows, total), self.dim), dtype=np.float32)
+        for start in range(0, total, self.block_rows):
+            if candidates is None:
+                block = records[start:start + self.block_rows]
+                block_norms = norms[start:start + self.block_rows]
+            else:
+                selected = candidates[start:start + self.block_rows]
+                block = records[selected]
+                block_norms = norms[selected]
+
+            vectors = buffer[:len(block)]
+            vectors[...] = block['vector']
+            ids = np.asarray(block['id'])
+            scores = vectors @ query / np.maximum(block_norms, 1e-12)
+            scores[ids < 0] = -np.inf
+            if exclude is not None:
+                scores[ids == exclude] = -np.inf
+
+            ids = np.concatenate([best_ids, ids])
+            scores = np.concatenate([best_scores, scores])
+            if len(scores) > k:
+                keep = np.argpartition(-scores, k)[:k]
+                ids, scores = ids[keep], scores[keep]
+            best_ids, best_scores = ids, scores
+
+        results, seen = [], set()
+        for i in np.argsort(-best_scores, kind='stable'):
+            image_id = int(best_ids[i])
+            if best_scores[i] == -np.inf or image_id in seen:
+                continue
+            seen.add(image_id)
+            results.append((image_id, float(best_scores[i])))
+        return results
+
+    def similar(self, image_id, k=10):
+        """Images most similar to a stored one (excluding itself), or None if it has no vector"""
+        features = self.get(image_id)
+        if features is None:
+            return None
+        return self.search(features, k, exclude=image_id)
+
+    def _candidates(self, query, rows):
+        """Sorted rows in the lists nearest to the query, or None for a full scan (caller holds the lock)"""
+        import numpy as np
+        if rows < max(self.index_min_rows, self.index_lists):
+            return None
+        index = self._index
+        if (index is None or rows >= 2 * index['trained_rows']) and self._trainer is None:
+            # Train off the request path; searches scan every row until the first index is ready
+            self._trainer = threading.Thread(target=self.build_index, name='feature-index', daemon=True)
+            self._trainer.start()
+        if index is None:
+            return None
+        if index['indexed_rows'] < rows:
+            self._assign(index, self._map, self._norms, index['indexed_rows'], rows)
+
+        probes = min(self.index_probes, len(index['centroids']))
+        nearest = np.argpartition(-(index['centroids'] @ query), probes - 1)[:probes]
+        return np.sort(np.concatenate([index['lists'][c] for c in nearest]))
+
+    def build_index(self, iterations=8, sample_per_list=40):
+        """Train the coarse quantizer on the vectors stored now and swap it in
+
+        Blocks only the caller; searches keep using the previous index (or
+        full scans) meanwhile.
+        """
+        import numpy as np
+        with self._lock:
+            if self._open():
+                self._refresh()
+            if not self._rows:
+                self._trainer = None
+                return
+            records, norms, rows = self._map, self._norms, self._rows
+
+        try:
+            rng = np.random.default_rng(0)
+            lists = min(self.index_lists or rows, rows)
+            sample = np.sort(rng.choice(rows, size=min(rows, lists * sample_per_list), replace=False))
+            data = self._normalized(records, norms, sample)
+
+            # Spherical k-means: centroids stay unit length, so assignment is a max inner product
+            centroids = data[rng.choice(len(data), size=lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(data @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, data)
+                # Empty lists keep their previous centroid
+                filled = np.bincount(assignment, minlength=lists) > 0
+                centroids[filled] = sums[filled] / np.linalg.norm(sums[filled], axis=1, keepdims=True).clip(1e-12)
+
+            index = {
+                'centroids': centroids,
+                'lists': [np.empty(0, dtype=np.int64) for _ in range(lists)],
+                'trained_rows': rows,
+                'indexed_rows': 0,
+            }
+            self._assign(index, records, norms, 0, rows)
+            with self._lock:
+                # Rows appended meanwhile are assigned by the next search
+                self._index = index
+                self._counters['index_builds'] += 1
+        finally:
+            with self._lock:
+                self._trainer = None
+
+    @staticmethod
+    def _normalized(records, norms, rows):
+        import numpy as np
+        vectors = records[rows]['vector'].astype(np.float32)
+        return vectors / np.maximum(norms[rows], 1e-12)[:, None]
+
+    def _assign(self, index, records, norms, start, stop):
+        """Add rows start..stop to their nearest lists"""
+        import numpy as np
+        lists = len(index['centroids'])
+        pieces = [[members] for members in index['lists']]
+        for block_start in range(start, stop, self.block_rows):
+            rows = np.arange(block_start, min(block_start + self.block_rows, stop))
+            assignment = np.argmax(self._normalized(records, norms, rows) @ index['centroids'].T, axis=1)
+            order = np.argsort(assignment, kind='stable')
+            bounds = np.searchsorted(assignment[order], np.arange(lists + 1))
+            for c in np.flatnonzero(bounds[1:] > bounds[:-1]):
+                pieces[c].append(rows[order[bounds[c]:bounds[c + 1]]])
+        index['lists'] = [members[0] if len(members) == 1 else np.concatenate(members) for members in pieces]
+        index['indexed_rows'] = stop
+
+    def get_stats(self):
+        """Row counts, storage size, index state and lookup counters"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'dim': self.dim,
+                'dtype': self.dtype,
+                'rows': self._rows,
+                'live_rows': len(self._row_of),
+                'bytes': self._rows * self._record.itemsize if self._record is not None else 0,
+                'index_lists': len(self._index['centroids']) if self._index else 0,
+                'index_trained_rows': self._index['trained_rows'] if self._index else 0,
+            })
+        return stats
@@ -0,0 +1,220 @@
+"""
+Inference Engine
+Dynamic micro-batching scheduler that groups concurrent requests
+into a single CNN forward pass
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+def concatenate_batch(samples):
+    """Join per-request tensors (each with a leading batch dimension) into one batch"""
+    import numpy as np
+    return np.concatenate(samples, axis=0)
+
+
+def run_cnn_batch(batch):
+    """Run one CNN forward pass over a preprocessed NHWC batch, returning one feature row per image"""
+    # Imported here so offload worker processes load the model registry (and torch) only when used
+    from model_handler import model_handler
+    return model_handler.extract_features(batch)
+
+
+def warm_up_worker():
+    """Offload pool initializer: load the image libraries and models in a new worker process
+
+    The counterpart of the app's warm_up for spawned workers, which start
+    from a fresh interpreter and share none of the serving process's state.
+    """
+    import cv2
+    import numpy as np
+    from model_handler import model_handler
+    from utils import image_to_tensor
+
+    _, encoded = cv2.imencode('.jpg', np.zeros((32, 32, 3), dtype=np.uint8))
+    image_to_tensor(encoded.tobytes())
+    model_handler.warm_up()
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class _PendingRequest:
+    """A single sample waiting in the scheduler queue"""
+
+    __slots__ = ('sample', 'future', 'enqueued_at')
+
+    def __init__(self, sample):
+        self.sample = sample
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """Collect concurrent inference requests into batches for one forward pass
+
+    ``predict_fn`` receives the collated batch and must return a sequence with
+    one result per sample, in order. A batch is dispatched as soon as it holds
+    ``max_batch_size`` samples or the oldest sample has waited ``max_wait_ms``.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10,
+                 collate_fn=concatenate_batch, stats_window=1024):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.predict_fn = predict_fn
+        self.collate_fn = collate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._worker = None
+        self._running = False
+
+        # Statistics
+        self._stats_lock = threading.Lock()
+        self._total_batches = 0
+        self._total_samples = 0
+        self._failed_batches = 0
+        self._batch_size_counts = {}
+        self._queue_waits = deque(maxlen=stats_window)
+        self._forward_times = deque(maxlen=stats_window)
+
+    def start(self):
+        """Start the background batching thread"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._worker = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout=None):
+        """Stop the batching thread after draining queued requests"""
+        with self._condition:
+            if not self._running:
+                return
+            self._running = False
+            self._condition.notify_all()
+        self._worker.join(timeout)
+        self._worker = None
+
+    def submit(self, sample):
+        """Queue a sample for inference and return a Future for its result"""
+        if not self._running:
+            self.start()
+
+        request = _PendingRequest(sample)
+        with self._condition:
+            self._queue.append(request)
+            self._condition.notify()
+        return request.future
+
+    def predict(self, sample, timeout=None):
+        """Submit a sample and block until its result is ready"""
+        return self.submit(sample).result(timeout)
+
+    def queue_depth(self):
+        """Number of samples waiting to be batched"""
+        with self._condition:
+            return len(self._queue)
+
+    def _next_batch(self):
+        """Wait for work and return the next batch of pending requests"""
+        with self._condition:
+            while not self._queue:
+                if not self._running:
+                    return []
+                self._condition.wait()
+
+            # Hold the batch open until it is full or the oldest request times out
+            deadline = self._queue[0].enqueued_at + self.max_wait
+            while len(self._queue) < self.max_batch_size and self._running:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch_size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(batch_size)]
+
+    def _run(self):
+        """Batching loop executed by the worker thread"""
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        """Run one forward pass and hand each caller its own result"""
+        started = time.perf_counter()
+        waits = [started - request.enqueued_at for request in batch]
+
+        try:
+            inputs = self.collate_fn([request.sample for request in batch])
+            results = self.predict_fn(inputs)
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"predict_fn returned {len(results)} results for a batch of {len(batch)}"
+                )
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            self._record(len(batch), waits, time.perf_counter() - started, failed=True)
+            return
+
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+        self._record(len(batch), waits, time.perf_counter() - started)
+
+    def _record(self, batch_size, waits, forward_time, failed=False):
+        """Update batch-size and queue-wait statistics"""
+        with self._stats_lock:
+            self._total_batches += 1
+            self._total_samples += batch_size
+            if failed:
+                self._failed_batches += 1
+            self._batch_size_counts[batch_size] = self._batch_size_counts.get(batch_size, 0) + 1
+            self._queue_waits.extend(waits)
+            self._forward_times.append(forward_time)
+
+    def get_stats(self):
+        """Get batch-size and queue-wait statistics"""
+        with self._stats_lock:
+            waits = sorted(self._queue_waits)
+            forward_times = sorted(self._forward_times)
+            total_batches = self._total_batches
+            stats = {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'total_batches': total_batches,
+                'total_samples': self._total_samples,
+                'failed_batches': self._failed_batches,
+                'mean_batch_size': self._total_samples / total_batches if total_batches else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_size_counts.items())),
+            }
+
+        stats['queue_depth'] = self.queue_depth()
+        stats['queue_wait_ms'] = {
+            'mean': (sum(waits) / len(waits) * 1000) if waits else 0.0,
+            'p50': _percentile(waits, 0.50) * 1000,
+            'p95': _percentile(waits, 0.95) * 1000,
+            'p99': _percentile(waits, 0.99) * 1000,
+            'max': (waits[-1] * 1000) if waits else 0.0,
+        }
+        stats['forward_ms'] = {
+            'p50': _percentile(forward_times, 0.50) * 1000,
+            'p99': _percentile(forward_times, 0.99) * 1000,
+        }
+        return stats
@@ -0,0 +1,115 @@
+"""
+Intent Router
+Maps messages to canned responses by keyword. All keywords live in one
+word-level trie, so a message is lowercased and tokenized once and
+matched in time proportional to its length, however many intents are
+registered.
+"""
+
+import re
+import threading
+
+# Words are runs of letters and digits; everything else separates them, so
+# contractions split ("what's" -> "what", "s") and still match their keyword
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Trie key marking the end of a keyword; maps to the intent it belongs to
+_END = None
+
+
+def tokenize(text):
+    """Lowercase text and split it into words, once"""
+    return _WORD.findall(text.lower())
+
+
+class Intent:
+    """A named response template triggered by any of its keywords
+
+    ``response`` is a ``str.format`` template filled from the context
+    passed to ``IntentRouter.respond`` (user text is only ever substituted
+    as a value), or a callable taking that context as keyword arguments.
+    """
+
+    __slots__ = ('name', 'keywords', 'response', 'priority')
+
+    def __init__(self, name, keywords, response, priority):
+        self.name = name
+        self.keywords = tuple(keywords)
+        self.response = response
+        self.priority = priority
+
+    def render(self, **context):
+        if callable(self.response):
+            return self.response(**context)
+        return self.response.format(**context)
+
+
+class IntentRouter:
+    """Route messages to the highest-priority intent with a keyword in them
+
+    Keywords are whole words or phrases matched on word boundaries, so
+    'hi' does not match "this". Intents added earlier win when several
+    match. Messages matching nothing get ``default``.
+    """
+
+    def __init__(self, default=None):
+        self.default = default
+        self.intents = []
+        self._trie = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, keywords, response):
+        """Register an intent; its keywords are compiled into the trie immediately"""
+        with self._lock:
+            intent = Intent(name, keywords, response, len(self.intents))
+            for keyword in intent.keywords:
+                words = tokenize(keyword)
+                if not words:
+                    raise ValueError(f"Intent '{name}' has a keyword without words: {keyword!r}")
+                node = self._trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                # An earlier intent keeps a keyword registered twice
+                node.setdefault(_END, intent)
+            self.intents.append(intent)
+        return intent
+
+    def load(self, entries):
+        """Register intents from dicts with ``name``, ``keywords`` and ``response`` (e.g. parsed JSON)"""
+        for entry in entries:
+            self.add(entry['name'], entry['keywords'], entry['response'])
+        return self
+
+    def match(self, words):
+        """Highest-priority intent for already tokenized words, or None"""
+        best = None
+        trie = self._trie
+        count = len(words)
+        for start, word in enumerate(words):
+            node = trie.get(word)
+            # Most words start no keyword; only walk on for the ones that do
+            position = start + 1
+            while node is not None:
+                intent = node.get(_END)
+                if intent is not None and (best is None or intent.priority < best.priority):
+                    best = intent
+                    if best.priority == 0:
+                        return best
+                if position == count:
+                    break
+                node = node.get(words[position])
+                position += 1
+        return best
+
+    def route(self, text):
+        """Intent for a message, or None"""
+        return self.match(tokenize(text))
+
+    def respond(self, text, **context):
+        """Rendered response of the message's intent, or the default"""
+        intent = self.route(text)
+        if intent is not None:
+            return intent.render(**context)
+        if callable(self.default):
+            return self.default(**context)
+        return self.default.format(**context)
@@ -0,0 +1,302 @@
+"""
+Metrics
+In-process latency histograms fed by spans (context managers or
+decorators around request stages) and by a WSGI wrapper timing whole
+requests, plus collectors exporting component statistics, rendered in the
+Prometheus text format for a /metrics endpoint
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+from config import Config
+
+# Seconds, from sub-millisecond database calls to multi-second uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Stage timings of the request on this thread, collected while a recorder has set a list
+_request = threading.local()
+
+
+def record_stages(stages):
+    """Append ``(stage, seconds)`` for every span finished on this thread to stages (None stops)"""
+    _request.stages = stages
+
+
+def _record_stage(stage, seconds):
+    stages = getattr(_request, 'stages', None)
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+def _escape(value):
+    """Label value escaped for the exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Series:
+    """Bucket counts, sum and count of one label combination"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Per-bucket (not cumulative) counts, the last one for +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """(cumulative bucket counts, sum, count)"""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        running, cumulative = 0, []
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with one series per label combination
+
+    Recording is a bisect and three additions under the series' own lock,
+    and callers with fixed labels (spans, timed functions) hold on to their
+    series, so it can sit on every request stage.
+    """
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def series(self, *label_values):
+        """The series for these label values, created on first use"""
+        series = self._series.get(label_values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(label_values, _Series(self.buckets))
+        return series
+
+    def observe(self, value, *label_values):
+        self.series(*label_values).observe(value)
+
+    def snapshot(self):
+        """{label values: (cumulative bucket counts, sum, count)}"""
+        with self._lock:
+            series = list(self._series.items())
+        return {labels: item.snapshot() for labels, item in series}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (cumulative, total, count) in sorted(self.snapshot().items()):
+            for bound, running in zip(self.buckets + (float('inf'),), cumulative):
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Span:
+    """Times a block into one histogram series (and the current request's stage timings)"""
+
+    __slots__ = ('stage', 'series', 'start')
+
+    def __init__(self, stage, series):
+        self.stage = stage
+        self.series = series
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.series.observe(seconds)
+        _record_stage(self.stage, seconds)
+        return False
+
+
+class _NullSpan:
+    """Stand-in span when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    """Stage and request histograms plus pull-time collectors for one process"""
+
+    def __init__(self, namespace='chatbot', enabled=True, buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.stages = Histogram(f'{namespace}_stage_duration_seconds',
+                                'Time spent in each request stage', ('stage',), buckets)
+        self.requests = Histogram(f'{namespace}_request_duration_seconds',
+                                  'HTTP request time until the response body is closed',
+                                  ('method', 'endpoint', 'status'), buckets)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def span(self, stage):
+        """Context manager timing a stage: ``with metrics.span('upload.store'): ...``"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(stage, self.stages.series(stage))
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as a stage"""
+        def decorator(func):
+            series = self.stages.series(stage)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    seconds = time.perf_counter() - start
+                    series.observe(seconds)
+                    _record_stage(stage, seconds)
+            return wrapper
+        return decorator
+
+    def timed_iter(self, stage, iterable):
+        """Yield from iterable, timing only the time spent producing items as one stage
+
+        Time the consumer spends between items (e.g. writing a streamed
+        token to the client) is excluded. The stage is recorded once the
+        iterable is exhausted or the consumer stops early.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        series = self.stages.series(stage)
+        iterator = iter(iterable)
+        seconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                yield item
+        finally:
+            series.observe(seconds)
+            _record_stage(stage, seconds)
+
+    def add_stats(self, prefix, get_stats, counters=(), gauges=()):
+        """Export keys of a component's get_stats() dict at render time
+
+        counters and gauges are stats keys, or dicts of stats key to metric
+        name. Counters become ``<namespace>_<prefix>_<name>_total`` and
+        gauges ``<namespace>_<prefix>_<name>``. Keys missing from the dict
+        (e.g. a component not started yet) are skipped.
+        """
+        as_names = lambda keys: dict(keys) if isinstance(keys, dict) else {key: key for key in keys}
+        self._collectors.append((f'{self.namespace}_{prefix}', get_stats, as_names(counters), as_names(gauges)))
+
+    def instrument_wsgi(self, wsgi_app):
+        """Wrap a WSGI app to time requests, including streamed bodies, into the request histogram
+
+        The endpoint label is read from ``environ['metrics.endpoint']``,
+        which the app sets once routing is done.
+        """
+        @functools.wraps(wsgi_app)
+        def instrumented(environ, start_response):
+            if not self.enabled:
+                return wsgi_app(environ, start_response)
+            start = time.perf_counter()
+            status = ['500']
+
+            def recording_start_response(status_line, headers, exc_info=None):
+                status[0] = status_line[:3]
+                return start_response(status_line, headers, exc_info)
+
+            def finish():
+                with self._lock:
+                    self._in_flight -= 1
+                self.requests.observe(time.perf_counter() - start, environ.get('REQUEST_METHOD', ''),
+                                      environ.get('metrics.endpoint', 'unmatched'), status[0])
+
+            with self._lock:
+                self._in_flight += 1
+            try:
+                body = wsgi_app(environ, recording_start_response)
+            except BaseException:
+                finish()
+                raise
+            return ClosingIterator(body, finish)
+        return instrumented
+
+    def in_flight(self):
+        with self._lock:
+            return self._in_flight
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = self.stages.render() + self.requests.render()
+        name = f'{self.namespace}_requests_in_flight'
+        lines += [f"# TYPE {name} gauge", f"{name} {self.in_flight()}"]
+        for prefix, get_stats, counters, gauges in self._collectors:
+            try:
+                stats = get_stats()
+            except Exception as e:
+                print(f"Metrics collector {prefix} failed: {e}")
+                continue
+            for names, kind, suffix in ((counters, 'counter', '_total'), (gauges, 'gauge', '')):
+                for key, metric in names.items():
+                    value = stats.get(key)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        name = f'{prefix}_{metric}{suffix}'
+                        lines += [f"# TYPE {name} {kind}", f"{name} {_number(value)}"]
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by the app, the utilities and the database layer
+registry = MetricsRegistry(enabled=Config.METRICS_ENABLED)
+span = registry.span
+timed = registry.timed
+timed_iter = registry.timed_iter
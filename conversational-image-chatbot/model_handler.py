@@ -0,0 +1,303 @@
+"""
+Model Handler
+Registry for Config.CNN_MODEL and Config.NLP_MODEL on CPU: each model is
+loaded once per process, optionally quantized to int8, and warmed up with
+synthetic batches before the first request
+"""
+
+import importlib.util
+import os
+import threading
+import time
+
+from config import Config
+from text_pipeline import TextPipeline
+from utils import IMAGENET_MEAN, IMAGENET_STD, split_tokens
+
+# Attribute holding the classification head in torchvision classifiers
+_HEAD_ATTRIBUTES = ('fc', 'classifier', 'head', 'heads')
+
+_threads_lock = threading.Lock()
+_threads_configured = False
+
+
+def torch_available():
+    """Whether torch and torchvision are installed, without importing them"""
+    return all(importlib.util.find_spec(name) is not None for name in ('torch', 'torchvision'))
+
+
+def quantized_engine():
+    """Fastest int8 kernel library available on this CPU"""
+    import torch
+    engines = torch.backends.quantized.supported_engines
+    engine = next((name for name in ('x86', 'fbgemm', 'qnnpack') if name in engines), None)
+    if engine is None:
+        raise RuntimeError("this torch build has no int8 kernels; disable MODEL_QUANTIZE")
+    return engine
+
+
+def configure_threads(intra_op_threads=0, inter_op_threads=0):
+    """Size torch's intra-op and inter-op thread pools, once per process (0 keeps torch's default)
+
+    torch only accepts the inter-op size before its first parallel
+    operation, so this runs before any model is loaded.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+
+        import torch
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            try:
+                torch.set_num_interop_threads(inter_op_threads)
+            except RuntimeError as e:
+                print(f"Could not set inter-op threads: {e}")
+
+
+class ModelHandler:
+    """Load and run the CNN and NLP models on CPU
+
+    Nothing is imported or loaded until a model is first needed (or
+    ``warm_up`` is called), so importing the app stays cheap. With
+    ``quantize`` the CNN uses torchvision's pre-quantized int8 variant when
+    one exists, and every remaining Linear layer (all of the NLP encoder's
+    projections) gets dynamic int8 quantization. When torch is not
+    installed the CNN stage falls back to global average pooling and
+    responses are template text, as in the prototype.
+    """
+
+    def __init__(self, cnn_model_name=None, nlp_model_name=None, model_path=None, quantize=None,
+                 intra_op_threads=None, inter_op_threads=None, backend=None, pretrained=True):
+        self.cnn_model_name = cnn_model_name or Config.CNN_MODEL
+        self.nlp_model_name = nlp_model_name or Config.NLP_MODEL
+        self.model_path = model_path or Config.MODEL_PATH
+        self.quantize = Config.MODEL_QUANTIZE if quantize is None else quantize
+        self.intra_op_threads = Config.MODEL_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+        self.inter_op_threads = Config.MODEL_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+        # Benchmarks may skip the CNN checkpoint; timings do not depend on the weight values
+        self.pretrained = pretrained
+
+        backend = backend or Config.MODEL_BACKEND
+        if backend == 'auto':
+            backend = 'torch' if torch_available() else 'prototype'
+        if backend not in ('torch', 'prototype'):
+            raise ValueError("backend must be 'auto', 'torch' or 'prototype'")
+        self.backend = backend
+
+        self._cnn = None  # (backbone, head, categories)
+        self._nlp = None  # (tokenizer, encoder)
+        self._lock = threading.Lock()
+        self._load_ms = {}
+        self._warmup_ms = {}
+        self.text_pipeline = TextPipeline(lambda: self.nlp()[0])
+
+    @property
+    def version(self):
+        """Identifies what produces responses, so result cache entries change with the runtime"""
+        version = f"{self.cnn_model_name}|{self.nlp_model_name}|{self.backend}"
+        return f"{version}|int8" if self.quantize else version
+
+    def _load_cnn(self):
+        """Backbone returning penultimate-layer features, plus the float classification head"""
+        configure_threads(self.intra_op_threads, self.inter_op_threads)
+        import torch
+        from torchvision import models
+
+        started = time.perf_counter()
+        name = self.cnn_model_name
+        quantized = self.quantize and f"quantized_{name}" in models.list_models()
+        if quantized:
+            name = f"quantized_{name}"
+        weights = models.get_model_weights(name).DEFAULT
+        model = models.get_model(name, weights=None, quantize=True) if quantized else models.get_model(name)
+        if self.quantize:
+            # The quantized builders select qnnpack (ARM kernels, several times slower on x86);
+            # weights are packed for the current engine when the state dict is loaded below
+            torch.backends.quantized.engine = quantized_engine()
+
+        local_path = os.path.join(self.model_path, f"{name}.pth")
+        if not self.pretrained:
+            state = model.state_dict()
+        elif os.path.exists(local_path):
+            state = torch.load(local_path, map_location='cpu')
+        else:
+            state = torch.hub.load_state_dict_from_url(
+                weights.url, model_dir=os.path.join(self.model_path, 'torchvision'), progress=False
+            )
+        model.load_state_dict(state)
+
+        # Split off the head so the backbone yields the features the rest of the app stores and compares
+        attribute = next(attr for attr in _HEAD_ATTRIBUTES if hasattr(model, attr))
+        head = getattr(model, attribute)
+        setattr(model, attribute, torch.nn.Identity())
+        head = self._float_head(head)
+        if self.quantize:
+            head = torch.ao.quantization.quantize_dynamic(head, {torch.nn.Linear}, dtype=torch.qint8)
+            if not quantized:
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        model.eval()
+        head.eval()
+        self._load_ms['cnn'] = (time.perf_counter() - started) * 1000
+        return model, head, weights.meta['categories']
+
+    @staticmethod
+    def _float_head(head):
+        """Float copy of a classification head (the pre-quantized models store it as int8)"""
+        import torch
+        layers = list(head) if isinstance(head, torch.nn.Sequential) else [head]
+        converted = []
+        for layer in layers:
+            if isinstance(layer, torch.nn.Linear) or not hasattr(layer, 'weight'):
+                converted.append(layer)
+                continue
+            weight, bias = layer.weight().dequantize(), layer.bias()
+            linear = torch.nn.Linear(weight.shape[1], weight.shape[0])
+            linear.weight.data.copy_(weight)
+            linear.bias.data.copy_(bias)
+            converted.append(linear)
+        return torch.nn.Sequential(*converted)
+
+    def _load_nlp(self):
+        """Tokenizer and encoder for Config.NLP_MODEL, from MODEL_PATH when present"""
+        configure_threads(self.intra_op_threads, self.inter_op_threads)
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        # Queries are short; tokenizer threads only add fork hazards under the prefork runner
+        os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+        started = time.perf_counter()
+        local_path = os.path.join(self.model_path, self.nlp_model_name)
+        source = local_path if os.path.isdir(local_path) else self.nlp_model_name
+        cache_dir = os.path.join(self.model_path, 'transformers')
+        tokenizer = AutoTokenizer.from_pretrained(source, cache_dir=cache_dir)
+        encoder = AutoModel.from_pretrained(source, cache_dir=cache_dir)
+        if self.quantize:
+            encoder = torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+
+        encoder.eval()
+        self._load_ms['nlp'] = (time.perf_counter() - started) * 1000
+        return tokenizer, encoder
+
+    def cnn(self):
+        """(backbone, head, categories), loaded on first use"""
+        if self._cnn is None:
+            with self._lock:
+                if self._cnn is None:
+                    self._cnn = self._load_cnn()
+        return self._cnn
+
+    def nlp(self):
+        """(tokenizer, encoder), loaded on first use"""
+        if self._nlp is None:
+            with self._lock:
+                if self._nlp is None:
+                    self._nlp = self._load_nlp()
+        return self._nlp
+
+    def extract_features(self, batch):
+        """Penultimate-layer features for a preprocessed NHWC batch in [0, 1], one row per image"""
+        if self.backend == 'prototype':
+            return batch.mean(axis=(1, 2))
+
+        import torch
+        backbone, _, _ = self.cnn()
+        with torch.inference_mode():
+            inputs = torch.from_numpy(batch).permute(0, 3, 1, 2)
+            mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+            std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+            return backbone((inputs - mean) / std).numpy()
+
+    def describe(self, features, top_k=3):
+        """Top-k (label, probability) pairs for one image's features, or [] when there is no classifier"""
+        if self.backend == 'prototype':
+            return []
+
+        import numpy as np
+        import torch
+        _, head, categories = self.cnn()
+        features = np.asarray(features, dtype=np.float32).reshape(1, -1)
+        in_features = next(layer.in_features for layer in head if hasattr(layer, 'in_features'))
+        if features.shape[1] != in_features:
+            return []
+        with torch.inference_mode():
+            probabilities = torch.softmax(head(torch.from_numpy(features)), dim=1)[0]
+        scores, indices = probabilities.topk(min(top_k, len(categories)))
+        return [(categories[i], float(score)) for score, i in zip(scores.tolist(), indices.tolist())]
+
+    def encode_text(self, texts):
+        """Mean-pooled NLP encoder embeddings, one row per text"""
+        import torch
+        _, encoder = self.nlp()
+        inputs = {name: torch.from_numpy(array) for name, array in self.text_pipeline.encode(texts).items()}
+        with torch.inference_mode():
+            hidden = encoder(**inputs).last_hidden_state
+        mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+        return ((hidden * mask).sum(dim=1) / mask.sum(dim=1)).numpy()
+
+    def stream_response(self, features, query):
+        """Yield the answer to a query about one image from its CNN features, token by token"""
+        labels = self.describe(features)
+        if labels:
+            text = f"I can see {', '.join(f'{label} ({score:.0%})' for label, score in labels)}."
+            if query:
+                text += f" Regarding '{query}', the most likely subject is {labels[0][0]}."
+        else:
+            text = (f"I've analyzed your image. Regarding '{query}', the visual content suggests "
+                    "relevant information that can help answer your question.")
+        yield from split_tokens(text)
+
+    def generate_response(self, features, query):
+        """Answer a query about one image from its CNN features"""
+        return ''.join(self.stream_response(features, query))
+
+    def warm_up(self, batch_sizes=None, iterations=None):
+        """Load the models and run synthetic batches so the first request skips allocator and kernel setup
+
+        Returns the time taken in milliseconds per stage.
+        """
+        if self.backend == 'prototype':
+            return {}
+
+        import numpy as np
+        batch_sizes = batch_sizes or Config.MODEL_WARMUP_BATCH_SIZES
+        iterations = iterations or Config.MODEL_WARMUP_ITERATIONS
+
+        started = time.perf_counter()
+        for batch_size in batch_sizes:
+            batch = np.zeros((batch_size, 224, 224, 3), dtype=np.float32)
+            for _ in range(iterations):
+                self.describe(self.extract_features(batch)[0])
+        self._warmup_ms['cnn'] = (time.perf_counter() - started) * 1000
+
+        if importlib.util.find_spec('transformers') is not None:
+            started = time.perf_counter()
+            for batch_size in batch_sizes:
+                for _ in range(iterations):
+                    self.encode_text(['warm up'] * batch_size)
+            self._warmup_ms['nlp'] = (time.perf_counter() - started) * 1000
+        return dict(self._warmup_ms)
+
+    def get_model_info(self):
+        """Get model names, runtime settings and load/warm-up timings"""
+        return {
+            'cnn_model': self.cnn_model_name,
+            'nlp_model': self.nlp_model_name,
+            'backend': self.backend,
+            'quantized': self.quantize,
+            'intra_op_threads': self.intra_op_threads,
+            'inter_op_threads': self.inter_op_threads,
+            'loaded': [name for name, model in (('cnn', self._cnn), ('nlp', self._nlp)) if model is not None],
+            'load_ms': dict(self._load_ms),
+            'warmup_ms': dict(self._warmup_ms),
+            'tokenizer': self.text_pipeline.get_stats(),
+        }
+
+
+# Shared per process; offload workers build their own on first use
+model_handler = ModelHandler()
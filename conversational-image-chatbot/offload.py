@@ -0,0 +1,120 @@
+"""
+Process Offload
+Bounded process pool for CPU-bound request stages (decode, preprocess, inference)
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from config import Config
+
+
+class OffloadBusy(Exception):
+    """Raised when the offload backlog is full; callers should answer 503"""
+
+
+class ProcessOffload:
+    """Run picklable callables in worker processes, off the GIL of the serving process
+
+    At most ``max_pending`` tasks are queued or running at once; further
+    submissions raise ``OffloadBusy`` immediately instead of piling up
+    behind slow work. With ``max_workers=0`` tasks run inline on the
+    calling thread, so the same code path serves development and tests.
+    Workers are started with ``start_method`` (spawn by default, since the
+    serving process already runs background threads) and run
+    ``initializer`` once each; servers call ``start`` at startup so that
+    happens before the first request, otherwise the pool starts on first use.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, start_method=None, initializer=None):
+        self.max_workers = Config.OFFLOAD_WORKERS if max_workers is None else max_workers
+        self.max_pending = max_pending or Config.OFFLOAD_MAX_PENDING
+        self.start_method = start_method or Config.OFFLOAD_START_METHOD
+        self.initializer = initializer
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+    @property
+    def enabled(self):
+        return self.max_workers > 0
+
+    def _pool(self):
+        """The process pool, created on first call (caller holds the lock)"""
+        if self._executor is None:
+            # multiprocessing is only needed once a pool is actually started
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=self.initializer
+            )
+        return self._executor
+
+    def start(self):
+        """Start every worker process and wait until each has run the initializer
+
+        Returns the time taken in seconds (0 when tasks run inline).
+        """
+        if not self.enabled:
+            return 0.0
+        started = time.perf_counter()
+        with self._lock:
+            executor = self._pool()
+        # A task arriving while no worker is idle starts another one, up to max_workers
+        futures = [executor.submit(os.getpid) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+        return time.perf_counter() - started
+
+    def submit(self, fn, *args):
+        """Schedule fn(*args) and return a Future, or raise OffloadBusy"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise OffloadBusy(f"{self.max_pending} tasks already pending")
+
+        with self._lock:
+            self._stats['submitted'] += 1
+            if not self.enabled:
+                future = Future()
+            else:
+                future = self._pool().submit(fn, *args)
+
+        future.add_done_callback(self._done)
+        if not self.enabled:
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def run(self, fn, *args, timeout=None):
+        """Run fn(*args) offloaded and return its result"""
+        return self.submit(fn, *args).result(timeout)
+
+    def _done(self, future):
+        self._slots.release()
+        with self._lock:
+            self._stats['failed' if future.cancelled() or future.exception() else 'completed'] += 1
+
+    def get_stats(self):
+        """Get pool configuration and task counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.max_workers
+        stats['max_pending'] = self.max_pending
+        stats['pending'] = stats['submitted'] - stats['completed'] - stats['failed']
+        return stats
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,252 @@
+"""
+Prefork Server
+Production runner: the master process loads the app and warms it up once,
+then forks workers that share those pages copy-on-write
+"""
+
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import make_server
+
+from config import Config
+
+
+def memory_usage(pid='self'):
+    """Resident, proportional and private memory of a process in KiB, from /proc (Linux only)"""
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty'):
+                    usage[name.lower()] = int(value.split()[0])
+    except OSError:
+        pass
+    return usage
+
+
+def format_memory(usage):
+    if not usage:
+        return 'memory n/a'
+    private = usage.get('private_clean', 0) + usage.get('private_dirty', 0)
+    return f"rss {usage['rss'] / 1024:.1f}MB, pss {usage['pss'] / 1024:.1f}MB, private {private / 1024:.1f}MB"
+
+
+class _RequestCounter:
+    """WSGI middleware counting requests, exposing worker info and triggering recycling"""
+
+    def __init__(self, app, info, max_requests, on_limit):
+        self.app = app
+        self.info = info
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.info['requests'] += 1
+            limit_reached = self.max_requests and self.info['requests'] == self.max_requests
+        environ['prefork.worker'] = self.info
+        try:
+            return self.app(environ, start_response)
+        finally:
+            if limit_reached:
+                self.on_limit(f"recycled after {self.max_requests} requests")
+
+
+class PreforkServer:
+    """Fork ``workers`` processes serving one shared listening socket
+
+    Load models and prime caches before ``run``: anything the master holds
+    when it forks is shared with every worker until written. Each worker runs a threaded WSGI server, exits gracefully
+    after about ``max_requests`` requests and is replaced by the master.
+
+    Signals to the master: SIGHUP re-runs ``reload`` and replaces every
+    worker without dropping connections; SIGTERM/SIGINT stop the workers
+    gracefully and exit.
+    """
+
+    def __init__(self, app, host='0.0.0.0', port=5000, workers=None, max_requests=None,
+                 max_requests_jitter=None, graceful_timeout=None, reload=None,
+                 on_worker_start=None, on_worker_exit=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or Config.PREFORK_WORKERS
+        self.max_requests = Config.PREFORK_MAX_REQUESTS if max_requests is None else max_requests
+        self.max_requests_jitter = (Config.PREFORK_MAX_REQUESTS_JITTER if max_requests_jitter is None
+                                    else max_requests_jitter)
+        self.graceful_timeout = graceful_timeout or Config.PREFORK_GRACEFUL_TIMEOUT
+        self.reload = reload
+        self.on_worker_start = on_worker_start
+        self.on_worker_exit = on_worker_exit
+
+        self.listener = None
+        self._children = {}  # pid -> (slot, forked_at)
+        self._retiring = set()
+        self._stopping = False
+        self._reloading = False
+
+    def run(self):
+        """Bind, fork the workers and supervise them until stopped"""
+        self.listener = socket.create_server((self.host, self.port), backlog=2048)
+        self.port = self.listener.getsockname()[1]
+
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_reload)
+
+        # Keep the collector from touching (and so un-sharing) objects created before the fork
+        gc.collect()
+        gc.freeze()
+
+        print(f"Master {os.getpid()} listening on {self.host}:{self.port} with {self.workers} workers "
+              f"({format_memory(memory_usage())})")
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        while True:
+            self._reap()
+            if self._stopping:
+                break
+            if self._reloading:
+                self._reloading = False
+                self._roll_workers()
+            time.sleep(0.2)
+
+        self._shutdown()
+        self.listener.close()
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_reload(self, signum, frame):
+        self._reloading = True
+
+    def _spawn(self, slot):
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._worker(slot, forked_at)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self._children[pid] = (slot, forked_at)
+
+    def _reap(self):
+        """Collect exited workers and replace the ones that were not retired on purpose"""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            slot, forked_at = self._children.pop(pid)
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                continue
+            if self._stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0:
+                print(f"Worker {pid} (slot {slot}) exited with {code}, restarting")
+                # Avoid a tight crash loop
+                if time.perf_counter() - forked_at < 1.0:
+                    time.sleep(1.0)
+            self._spawn(slot)
+
+    def _roll_workers(self):
+        """Re-run the reload hook, start a fresh set of workers, then retire the old ones"""
+        print(f"Master {os.getpid()} reloading")
+        if self.reload is not None:
+            self.reload()
+        old = list(self._children.items())
+        for slot in range(self.workers):
+            self._spawn(slot)
+        for pid, _ in old:
+            self._retiring.add(pid)
+            self._signal(pid, signal.SIGTERM)
+
+    def _shutdown(self):
+        """Stop all workers, killing the ones still busy after graceful_timeout"""
+        for pid in list(self._children):
+            self._signal(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self._children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in list(self._children):
+            self._signal(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._children.clear()
+
+    @staticmethod
+    def _signal(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _worker(self, slot, forked_at):
+        """Worker process: serve until recycled or told to stop"""
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        # Forked workers would otherwise share one random sequence
+        random.seed()
+
+        if self.on_worker_start is not None:
+            self.on_worker_start(slot)
+
+        info = {'slot': slot, 'pid': os.getpid(), 'started_at': time.time(), 'requests': 0}
+        stopping = threading.Event()
+        server = None
+
+        def stop(reason):
+            if not stopping.is_set():
+                stopping.set()
+                print(f"Worker {os.getpid()} (slot {slot}) {reason}")
+                # shutdown() blocks until serve_forever returns, so it cannot run on the serving thread
+                threading.Thread(target=server.shutdown, daemon=True).start()
+
+        jitter = random.randint(0, self.max_requests_jitter) if self.max_requests else 0
+        app = _RequestCounter(self.app, info, self.max_requests + jitter if self.max_requests else 0, stop)
+        server = make_server(self.host, self.port, app, threaded=True, fd=self.listener.fileno())
+        # Let in-flight requests finish when the server closes
+        server.daemon_threads = False
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop('stopping'))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        print(f"Worker {os.getpid()} (slot {slot}) ready in {(time.perf_counter() - forked_at) * 1000:.1f}ms, "
+              f"{format_memory(memory_usage())}")
+        sys.stdout.flush()
+
+        try:
+            server.serve_forever()
+        finally:
+            if self.on_worker_exit is not None:
+                self.on_worker_exit(slot)
+            sys.stdout.flush()
@@ -0,0 +1,291 @@
+"""
+Profiler
+On-demand sampling profiler producing flamegraph-compatible collapsed
+stacks, and a slow-request recorder keeping the stage timings and top
+stack samples of requests over a latency threshold in a ring buffer.
+Both sample with sys._current_frames() from a background thread, so
+request threads run uninstrumented code and pay nothing per call.
+"""
+
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from werkzeug.wsgi import ClosingIterator
+
+from config import Config
+from metrics import record_stages
+
+
+def collapse(frame, labels):
+    """Root-first ``function (file:line);...`` stack of a frame, labels cached per code object"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        label = labels.get(code)
+        if label is None:
+            label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        parts.append(label)
+        frame = frame.f_back
+    parts.reverse()
+    return ';'.join(parts)
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler started on demand for a fixed number of seconds
+
+    Samples every thread, or with ``request_fraction`` only the threads
+    serving a random fraction of requests (see SlowRequestLog, which picks
+    and attaches them). Results accumulate as collapsed stacks with counts,
+    the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval_ms=None, max_seconds=None):
+        self.interval = (interval_ms or Config.PROFILER_INTERVAL_MS) / 1000.0
+        self.max_seconds = max_seconds or Config.PROFILER_MAX_SECONDS
+
+        self._stacks = Counter()
+        self._labels = {}
+        self._targets = set()
+        self._session = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, seconds, request_fraction=None):
+        """Start sampling for ``seconds``; raises RuntimeError while a profile is running"""
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be between 0 and {self.max_seconds}")
+        if request_fraction is not None and not 0 < request_fraction <= 1:
+            raise ValueError("request_fraction must be between 0 and 1")
+
+        with self._lock:
+            if self.is_running():
+                raise RuntimeError("A profile is already running")
+            self._stacks = Counter()
+            self._targets = set()
+            self._stop.clear()
+            self._session = {
+                'started_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                'seconds': seconds,
+                'request_fraction': request_fraction,
+                'interval_ms': self.interval * 1000,
+                'samples': 0,
+                'requests_sampled': 0,
+            }
+            self._thread = threading.Thread(target=self._run, args=(time.monotonic() + seconds,),
+                                            name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return self.get_status()
+
+    def stop(self):
+        """Stop the running profile early (its samples are kept)"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def sample_request(self):
+        """Whether the request starting now should be sampled (request-fraction profiles only)"""
+        session = self._session
+        if session is None or session['request_fraction'] is None or self._stop.is_set():
+            return False
+        return random.random() < session['request_fraction']
+
+    def attach(self, thread_id):
+        """Sample this thread until detach (it is serving a sampled request)"""
+        with self._lock:
+            self._targets.add(thread_id)
+            self._session['requests_sampled'] += 1
+
+    def detach(self, thread_id):
+        with self._lock:
+            self._targets.discard(thread_id)
+
+    def _run(self, deadline):
+        own = threading.get_ident()
+        fraction_mode = self._session['request_fraction'] is not None
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            with self._lock:
+                targets = set(self._targets) if fraction_mode else None
+            stacks = [collapse(frame, self._labels) for thread_id, frame in frames.items()
+                      if thread_id != own and (targets is None or thread_id in targets)]
+            with self._lock:
+                self._stacks.update(stacks)
+                self._session['samples'] += 1
+        self._stop.set()
+
+    def collapsed(self):
+        """Collapsed stacks, one ``stack count`` line each, most frequent first"""
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def get_status(self):
+        """Current or last profile settings and sample counts"""
+        with self._lock:
+            status = dict(self._session or {})
+            status['distinct_stacks'] = len(self._stacks)
+        status['running'] = self.is_running()
+        return status
+
+
+class SlowRequestLog:
+    """Ring buffer of requests slower than a threshold, with stage timings and stack samples
+
+    Every request registers its thread and collects the metrics spans it
+    finishes. A watchdog thread samples the stacks of requests that have
+    been running for half the threshold, so the samples show where the
+    slow ones spend their time. Only requests ending over the threshold
+    are kept, the newest ``capacity`` of them.
+    """
+
+    def __init__(self, threshold_ms=None, capacity=None, interval_ms=None, top_stacks=None, profiler=None):
+        self.threshold = (Config.SLOW_REQUEST_THRESHOLD_MS if threshold_ms is None else threshold_ms) / 1000.0
+        self.interval = (interval_ms or Config.PROFILER_INTERVAL_MS) / 1000.0
+        self.top_stacks = top_stacks or Config.SLOW_REQUEST_TOP_STACKS
+        self.profiler = profiler
+
+        self._entries = deque(maxlen=capacity or Config.SLOW_REQUEST_BUFFER_SIZE)
+        self._active = {}
+        self._labels = {}
+        self._watchdog = None
+        # Set while requests are in flight; the watchdog sleeps on it otherwise
+        self._busy = threading.Event()
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'recorded': 0, 'stack_samples': 0}
+
+    def instrument_wsgi(self, wsgi_app):
+        """Wrap a WSGI app to track each request until its (possibly streamed) body is closed"""
+        @functools.wraps(wsgi_app)
+        def instrumented(environ, start_response):
+            if self.threshold <= 0 and self.profiler is None:
+                return wsgi_app(environ, start_response)
+            thread_id = threading.get_ident()
+            active = {
+                'start': time.perf_counter(),
+                'started_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                'stages': [],
+                'stacks': Counter(),
+                'status': None,
+                'sampled': self.profiler is not None and self.profiler.sample_request(),
+            }
+
+            def recording_start_response(status_line, headers, exc_info=None):
+                active['status'] = int(status_line[:3])
+                return start_response(status_line, headers, exc_info)
+
+            def finish():
+                record_stages(None)
+                if active['sampled']:
+                    self.profiler.detach(thread_id)
+                with self._lock:
+                    self._active.pop(thread_id, None)
+                    if not self._active:
+                        self._busy.clear()
+                # No longer in _active, so the watchdog leaves its stacks alone from here on
+                self._finish(environ, active)
+
+            self._begin(thread_id, active)
+            try:
+                body = wsgi_app(environ, recording_start_response)
+            except BaseException:
+                finish()
+                raise
+            return ClosingIterator(body, finish)
+        return instrumented
+
+    def _begin(self, thread_id, active):
+        if self.threshold > 0:
+            with self._lock:
+                self._active[thread_id] = active
+                self._busy.set()
+                self._counters['requests'] += 1
+                if self._watchdog is None:
+                    self._watchdog = threading.Thread(target=self._watch, name='slow-request-watchdog', daemon=True)
+                    self._watchdog.start()
+            record_stages(active['stages'])
+        if active['sampled']:
+            self.profiler.attach(thread_id)
+
+    def _watch(self):
+        """Sample the stacks of requests running for at least half the threshold
+
+        Idles on ``_busy`` while no request is in flight. Stacks are
+        collapsed outside the lock and counted under it, only for requests
+        still in flight, so a finished request's samples no longer change.
+        """
+        sample_after = self.threshold / 2
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                overdue = [(thread_id, active) for thread_id, active in self._active.items()
+                           if now - active['start'] >= sample_after]
+            if not overdue:
+                continue
+            frames = sys._current_frames()
+            samples = [(thread_id, active, collapse(frames[thread_id], self._labels))
+                       for thread_id, active in overdue if thread_id in frames]
+            del frames
+            with self._lock:
+                for thread_id, active, stack in samples:
+                    if self._active.get(thread_id) is active:
+                        active['stacks'][stack] += 1
+                        self._counters['stack_samples'] += 1
+
+    def _finish(self, environ, active):
+        duration = time.perf_counter() - active['start']
+        if self.threshold <= 0 or duration < self.threshold:
+            return
+
+        # Per-stage totals in first-seen order
+        stages = {}
+        for stage, seconds in active['stages']:
+            totals = stages.setdefault(stage, {'stage': stage, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            totals['count'] += 1
+            totals['total_ms'] += seconds * 1000
+            totals['max_ms'] = max(totals['max_ms'], seconds * 1000)
+        query = environ.get('QUERY_STRING')
+        entry = {
+            'method': environ.get('REQUEST_METHOD'),
+            'path': environ.get('PATH_INFO', '') + (f"?{query}" if query else ''),
+            'endpoint': environ.get('metrics.endpoint'),
+            'status': active['status'],
+            'duration_ms': duration * 1000,
+            'started_at': active['started_at'],
+            'stages': list(stages.values()),
+            'stack_samples': sum(active['stacks'].values()),
+            'top_stacks': [{'stack': stack, 'count': count}
+                           for stack, count in active['stacks'].most_common(self.top_stacks)],
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self._counters['recorded'] += 1
+
+    def recent(self, limit=None):
+        """Recorded slow requests, newest first"""
+        with self._lock:
+            entries = list(self._entries)
+        entries.reverse()
+        return entries[:limit] if limit else entries
+
+    def get_stats(self):
+        """Get threshold, buffer and sampling counters"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['buffered'] = len(self._entries)
+            stats['in_flight'] = len(self._active)
+        stats['threshold_ms'] = self.threshold * 1000
+        stats['capacity'] = self._entries.maxlen
+        return stats
@@ -0,0 +1,156 @@
+"""
+Result Cache
+Two-tier cache for inference results keyed by image content hash,
+normalized query text and model version
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+
+def default_model_version():
+    """Model version string derived from the configured models"""
+    return f"{Config.CNN_MODEL}|{Config.NLP_MODEL}"
+
+
+def normalize_query(query):
+    """Normalize query text so trivially different phrasings share a cache entry"""
+    return ' '.join((query or '').lower().split())
+
+
+class ResultCache:
+    """In-process LRU (tier 1) backed by the SQLite inference_cache table (tier 2)
+
+    Keys include the model version, so changing Config.CNN_MODEL or
+    Config.NLP_MODEL makes every older entry unreachable; stale rows are
+    purged from SQLite on first use (or by an explicit ``purge_stale``).
+    """
+
+    def __init__(self, database, max_entries=1024, max_bytes=16 * 1024 * 1024,
+                 ttl_seconds=3600, persistent_ttl_seconds=7 * 24 * 3600, model_version=None):
+        self.database = database
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.persistent_ttl = persistent_ttl_seconds
+        self.model_version = model_version or default_model_version()
+
+        # key -> (serialized value, expires_at)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._counters = {
+            'memory_hits': 0,
+            'persistent_hits': 0,
+            'misses': 0,
+            'size_evictions': 0,
+            'ttl_evictions': 0,
+            'persistent_purged': 0,
+        }
+
+        # Deferred so constructing the cache does not open the database
+        self._purged = self.database is None
+
+    def purge_stale(self):
+        """Delete persistent entries from other model versions or past their expiry"""
+        self._purged = True
+        purged = self.database.purge_cached_results(self.model_version, time.time())
+        with self._lock:
+            self._counters['persistent_purged'] += purged
+        return purged
+
+    def make_key(self, content_hash, query):
+        """Cache key for an image/query pair under the current model version"""
+        raw = f"{self.model_version}\0{content_hash}\0{normalize_query(query)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, content_hash, query):
+        """Get a cached result, or None on a miss"""
+        key = self.make_key(content_hash, query)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                serialized, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return json.loads(serialized)
+                self._remove(key)
+                self._counters['ttl_evictions'] += 1
+
+        if not self._purged:
+            self.purge_stale()
+        row = self.database.get_cached_result(key, now) if self.database is not None else None
+        if row is None:
+            with self._lock:
+                self._counters['misses'] += 1
+            return None
+
+        # Promote to the in-process tier
+        with self._lock:
+            self._counters['persistent_hits'] += 1
+            self._insert(key, row['value'], min(row['expires_at'], now + self.ttl))
+        return json.loads(row['value'])
+
+    def set(self, content_hash, query, value):
+        """Store a JSON-serializable result in both tiers"""
+        key = self.make_key(content_hash, query)
+        serialized = json.dumps(value)
+        now = time.time()
+
+        with self._lock:
+            self._insert(key, serialized, now + self.ttl)
+
+        if self.database is not None:
+            if not self._purged:
+                self.purge_stale()
+            self.database.put_cached_result(key, self.model_version, serialized, now + self.persistent_ttl)
+
+    def get_or_compute(self, content_hash, query, compute):
+        """Return the cached result, computing and storing it on a miss"""
+        value = self.get(content_hash, query)
+        if value is None:
+            value = compute()
+            self.set(content_hash, query, value)
+        return value
+
+    def clear(self):
+        """Drop every in-process entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _insert(self, key, serialized, expires_at):
+        """Insert into the LRU and evict least recently used entries over the limits"""
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (serialized, expires_at)
+        self._bytes += len(serialized)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counters['size_evictions'] += 1
+
+    def _remove(self, key):
+        serialized, _ = self._entries.pop(key)
+        self._bytes -= len(serialized)
+
+    def get_stats(self):
+        """Get hit/miss/eviction counters"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['memory_hits'] + stats['persistent_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['persistent_hits']) / lookups if lookups else 0.0
+        stats['model_version'] = self.model_version
+        return stats
@@ -0,0 +1,219 @@
+"""
+Retention Job
+Chunked, resumable deletion of expired uploads, queries and chat history
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """Delete rows and upload files older than ``days`` in bounded batches
+
+    Each batch is its own short transaction, with a pause between batches so
+    request writers are never locked out for long. Expired uploads are moved
+    to ``retention_journal`` in the same transaction that deletes their rows,
+    then their files are removed and the journal entries cleared; a crashed
+    run finishes the journal on the next run, so neither rows nor files are
+    left orphaned. When a ThumbnailPipeline is given, an upload's
+    thumbnails are removed with its file, and likewise its feature vector
+    when a FeatureStore is given.
+    """
+
+    def __init__(self, database, days=None, batch_size=None, pause_ms=None, thumbnails=None, features=None):
+        self.database = database
+        self.thumbnails = thumbnails
+        self.features = features
+        self.days = Config.RETENTION_DAYS if days is None else days
+        self.batch_size = batch_size or Config.RETENTION_BATCH_SIZE
+        self.pause = (Config.RETENTION_PAUSE_MS if pause_ms is None else pause_ms) / 1000.0
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        self.last_result = None
+
+    def cutoff(self, days=None):
+        """Timestamp string before which data is expired (UTC, matches CURRENT_TIMESTAMP)"""
+        expiry = datetime.now(timezone.utc) - timedelta(days=self.days if days is None else days)
+        return expiry.strftime('%Y-%m-%d %H:%M:%S')
+
+    def run(self, days=None, uploads_only=False, folder=None):
+        """Run one retention pass and return per-table deletion counts
+
+        ``days`` overrides the job's retention period for this pass. With
+        ``uploads_only`` only expired uploads are deleted (with their
+        queries, files, thumbnails and feature vectors), and with
+        ``folder`` only uploads stored under that folder. Passes never
+        overlap, so a manual pass waits for a scheduled one to finish.
+        """
+        with self._run_lock:
+            counts = {'image_uploads': 0, 'queries': 0, 'chat_history': 0, 'inference_cache': 0, 'files': 0}
+            cutoff = self.cutoff(days)
+            prefix = None
+            if folder is not None:
+                # LIKE pattern for paths inside folder, with wildcards in the folder name escaped
+                prefix = os.path.join(folder, '')
+                for char in ('\\', '%', '_'):
+                    prefix = prefix.replace(char, '\\' + char)
+                prefix += '%'
+
+            # Finish files journaled by an interrupted run
+            counts['files'] += self._finish_journal()
+
+            last_key = ('', 0)
+            while not self._stop.is_set():
+                images, queries, files, last_key = self._expire_uploads(cutoff, last_key, prefix)
+                counts['image_uploads'] += images
+                counts['queries'] += queries
+                counts['files'] += files
+                if images < self.batch_size or not self._pause():
+                    break
+            if uploads_only:
+                return counts
+
+            for table, statement in (
+                ('queries', '''
+                    DELETE FROM queries WHERE id IN (
+                        SELECT id FROM queries WHERE query_timestamp < ? ORDER BY query_timestamp LIMIT ?
+                    )
+                '''),
+                ('chat_history', '''
+                    DELETE FROM chat_history WHERE id IN (
+                        SELECT id FROM chat_history WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+                    )
+                '''),
+            ):
+                while not self._stop.is_set():
+                    deleted = self._delete_batch(statement, (cutoff, self.batch_size))
+                    counts[table] += deleted
+                    if deleted < self.batch_size or not self._pause():
+                        break
+
+            counts['inference_cache'] = self.database.purge_cached_results(None, time.time())
+
+            self.last_result = counts
+            return counts
+
+    def _pause(self):
+        """Sleep between batches; False if the job was stopped meanwhile"""
+        return not self._stop.wait(self.pause)
+
+    def _delete_batch(self, statement, params):
+        """Run one bounded DELETE in its own transaction"""
+        conn = self.database.get_connection()
+        try:
+            cursor = conn.execute(statement, params)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def _expire_uploads(self, cutoff, last_key, prefix=None):
+        """Delete one batch of expired uploads (and their queries), journaling their files
+
+        Uploads still referenced by a query newer than the cutoff are kept,
+        since deduplicated content may have been re-uploaded recently.
+        """
+        conn = self.database.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                SELECT id, file_path, upload_timestamp FROM image_uploads i
+                WHERE upload_timestamp < ?
+                  AND (upload_timestamp, id) > (?, ?)
+                  AND (? IS NULL OR file_path LIKE ? ESCAPE '\\')
+                  AND NOT EXISTS (
+                      SELECT 1 FROM queries q WHERE q.image_id = i.id AND q.query_timestamp >= ?
+                  )
+                ORDER BY upload_timestamp, id
+                LIMIT ?
+            ''', (cutoff, last_key[0], last_key[1], prefix, prefix, cutoff, self.batch_size)).fetchall()
+
+            if not rows:
+                conn.rollback()
+                return 0, 0, 0, last_key
+
+            ids = [(row['id'],) for row in rows]
+            conn.executemany(
+                'INSERT OR REPLACE INTO retention_journal (image_id, file_path) VALUES (?, ?)',
+                [(row['id'], row['file_path']) for row in rows]
+            )
+            queries = conn.executemany('DELETE FROM queries WHERE image_id = ?', ids).rowcount
+            conn.executemany('DELETE FROM image_uploads WHERE id = ?', ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        files = self._finish_journal([image_id for (image_id,) in ids])
+        last_row = rows[-1]
+        return len(rows), queries, files, (last_row['upload_timestamp'], last_row['id'])
+
+    def _finish_journal(self, image_ids=None):
+        """Remove journaled files, then clear their journal entries"""
+        conn = self.database.get_connection()
+        try:
+            if image_ids is None:
+                entries = conn.execute('SELECT image_id, file_path FROM retention_journal').fetchall()
+            else:
+                placeholders = ', '.join('?' * len(image_ids))
+                entries = conn.execute(
+                    f'SELECT image_id, file_path FROM retention_journal WHERE image_id IN ({placeholders})',
+                    image_ids
+                ).fetchall()
+
+            removed = 0
+            for entry in entries:
+                try:
+                    os.remove(entry['file_path'])
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                if self.thumbnails is not None:
+                    self.thumbnails.remove_for_source(entry['file_path'])
+                if self.features is not None:
+                    self.features.remove(entry['image_id'])
+
+            conn.executemany('DELETE FROM retention_journal WHERE image_id = ?',
+                             [(entry['image_id'],) for entry in entries])
+            conn.commit()
+            return removed
+        finally:
+            conn.close()
+
+    def start(self, interval_seconds=None):
+        """Run the job in a background thread every interval_seconds"""
+        if self._thread is not None:
+            return
+        interval = interval_seconds or Config.RETENTION_INTERVAL_SECONDS
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    counts = self.run()
+                    if any(counts.values()):
+                        logger.info("Retention: deleted %s", counts)
+                except Exception:
+                    logger.exception("Retention job error")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name='retention-job', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background thread, interrupting a run between batches"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -4,9 +4,14 @@ Application Runner
 Starts the Flask application with proper configuration
 """
 
+import time
+BOOT_STARTED = time.perf_counter()
+
+import argparse
 import os
 import sys
-from app import app
+from app import app, retention_job, thumbnail_pipeline, offload, warm_up
+from config import Config
 from utils import create_required_directories
 from database import db
 
@@ -45,10 +50,23 @@ def print_banner():
     """
     print(banner)
 
-def print_info():
+SERVER_NAMES = {
+    'dev': 'Flask development server',
+    'asgi': 'ASGI (uvicorn)',
+    'prefork': 'Preforking production server',
+}
+
+def print_info(server):
     """Print application information"""
     print("Server Information:")
     print(f"  • Environment: {'Development' if app.config['DEBUG'] else 'Production'}")
+    print(f"  • Server: {SERVER_NAMES[server]}")
+    if server == 'asgi':
+        print(f"  • Handler threads: {Config.ASGI_MAX_THREADS}, max in flight: {Config.ASGI_MAX_PENDING}")
+        print(f"  • Offload processes: {Config.OFFLOAD_WORKERS or 'inline'}, max pending: {Config.OFFLOAD_MAX_PENDING}")
+    elif server == 'prefork':
+        print(f"  • Workers: {Config.PREFORK_WORKERS}, recycled after {Config.PREFORK_MAX_REQUESTS or 'unlimited'} requests")
+        print("  • Health check: GET /healthz, graceful reload: kill -HUP <master pid>")
     print(f"  • Host: 0.0.0.0")
     print(f"  • Port: 5000")
     print(f"  • URL: http://localhost:5000")
@@ -62,8 +80,69 @@ def print_info():
     print("="*60)
     print("")
 
+def backfill_statistics():
+    """Rebuild statistics counters for a database created before they existed"""
+    print("Backfilling statistics...")
+    stats = db.backfill_statistics()
+    print(f"✓ Statistics backfilled (Messages: {stats['total_messages']}, "
+          f"Images: {stats['total_images']}, Queries: {stats['total_queries']})")
+
+def run_asgi():
+    """Serve through the ASGI adapter; CPU-heavy stages go to the offload pool"""
+    try:
+        import uvicorn
+    except ImportError:
+        print("Error: the ASGI server needs uvicorn (pip install uvicorn)")
+        sys.exit(1)
+    
+    from asgi import application
+    uvicorn.run(application, host='0.0.0.0', port=5000, lifespan='on', log_level='warning')
+
+def run_prefork():
+    """Load and warm up once in this process, then serve from forked workers"""
+    from prefork import PreforkServer
+    
+    elapsed = warm_up()
+    print(f"✓ Models warmed up in {elapsed * 1000:.1f}ms")
+    print(f"✓ Master cold start {(time.perf_counter() - BOOT_STARTED) * 1000:.0f}ms")
+    
+    # SQLite connections must not cross a fork; workers open their own
+    db.close()
+    
+    def start_worker(slot):
+        # Each worker has its own offload pool; it cannot be created before the fork
+        offload.start()
+        if Config.RETENTION_ENABLED and slot == 0:
+            retention_job.start()
+    
+    def stop_worker(slot):
+        retention_job.stop()
+        thumbnail_pipeline.shutdown()
+        offload.shutdown()
+        db.close()
+    
+    PreforkServer(app, host='0.0.0.0', port=5000, reload=warm_up,
+                  on_worker_start=start_worker, on_worker_exit=stop_worker).run()
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Conversational Image Recognition Chatbot")
+    parser.add_argument('--backfill-stats', action='store_true',
+                        help='one-time rebuild of statistics counters for an existing database, then exit')
+    parser.add_argument('--server', choices=['dev', 'asgi', 'prefork'], default='dev',
+                        help="'dev' runs the Flask debug server, 'asgi' runs uvicorn with process offload "
+                             "(tune with ASGI_MAX_THREADS, ASGI_MAX_PENDING, OFFLOAD_WORKERS, OFFLOAD_MAX_PENDING), "
+                             "'prefork' preloads once and forks PREFORK_WORKERS workers")
+    return parser.parse_args()
+
 def main():
     """Main function to run the application"""
+    args = parse_args()
+    
+    if args.backfill_stats:
+        backfill_statistics()
+        return
+    
     try:
         # Print banner
         print_banner()
@@ -71,8 +150,26 @@ def main():
         # Check environment
         check_environment()
         
+        # Background services start in the process that serves: the ASGI server on startup,
+        # the prefork runner in its workers, the dev server in its reloader child
+        if args.server == 'dev' and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            offload.start()
+            if Config.RETENTION_ENABLED:
+                retention_job.start()
+        if Config.RETENTION_ENABLED:
+            print(f"✓ Retention job scheduled (every {Config.RETENTION_INTERVAL_SECONDS}s, keeping {Config.RETENTION_DAYS} days)")
+        
         # Print info
-        print_info()
+        print_info(args.server)
+        
+        if args.server == 'asgi':
+            run_asgi()
+            return
+        if args.server == 'prefork':
+            run_prefork()
+            return
+        
+        print(f"✓ Models warmed up in {warm_up() * 1000:.1f}ms")
         
         # Run application
         app.run(
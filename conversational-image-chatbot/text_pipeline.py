@@ -0,0 +1,137 @@
+"""
+Text Pipeline
+Tokenization front end for Config.NLP_MODEL: single-pass normalization,
+batched tokenization padded to the longest query in the batch, and an
+LRU of token IDs for frequent queries
+"""
+
+import threading
+from collections import OrderedDict
+
+from config import Config
+
+# Zero-width marks, dropped from non-ASCII text
+_ZERO_WIDTH_TABLE = str.maketrans('', '', '\u200b\u200c\u200d\u2060\ufeff')
+
+
+def normalize_text(text, lowercase=False):
+    """Normalize a query for the tokenizer and as its cache key
+
+    Only whitespace runs are folded and zero-width marks dropped. Markup and
+    punctuation are ordinary text to the model (output is escaped where it
+    is rendered), so unlike sanitize_input they reach the tokenizer.
+    """
+    if not text:
+        return ''
+    if not text.isascii():
+        text = text.translate(_ZERO_WIDTH_TABLE)
+    # split() also folds tabs, newlines and non-breaking spaces
+    text = ' '.join(text.split())
+    return text.lower() if lowercase else text
+
+
+class TextPipeline:
+    """Turn batches of queries into padded ``input_ids``/``attention_mask`` arrays
+
+    Queries missing from the LRU are tokenized together in one tokenizer
+    call and truncated to ``max_length``; the batch is then padded to its
+    longest row (rounded up to ``pad_to_multiple_of``) instead of the model
+    maximum, so short queries do not pay for 512 positions. The tokenizer
+    comes from ``load_tokenizer`` on first use.
+
+    ModelHandler.encode_text runs its batches through the encoder; warm-up
+    and the benchmarks call it, while the chat and upload responses do not
+    use query embeddings yet.
+    """
+
+    def __init__(self, load_tokenizer, max_length=None, cache_size=None, pad_to_multiple_of=None):
+        self.load_tokenizer = load_tokenizer
+        self.max_length = max_length or Config.NLP_MAX_TOKENS
+        self.cache_size = Config.NLP_TOKEN_CACHE_SIZE if cache_size is None else cache_size
+        self.pad_to_multiple_of = pad_to_multiple_of or Config.NLP_PAD_TO_MULTIPLE_OF
+
+        # normalized text -> tuple of token IDs
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._tokenizer = None
+
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'batches': 0,
+            'tokens': 0,
+            'padded_positions': 0,
+        }
+
+    def tokenizer(self):
+        """The tokenizer, loaded on first use"""
+        if self._tokenizer is None:
+            self._tokenizer = self.load_tokenizer()
+        return self._tokenizer
+
+    def normalize(self, text):
+        """Cache key and tokenizer input for one query"""
+        return normalize_text(text, lowercase=getattr(self.tokenizer(), 'do_lower_case', False))
+
+    def token_ids(self, texts):
+        """Token IDs per text (with special tokens, truncated), from the LRU where possible"""
+        keys = [self.normalize(text) for text in texts]
+        ids = [None] * len(keys)
+        missing = {}
+
+        with self._lock:
+            for index, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is None:
+                    missing.setdefault(key, []).append(index)
+                else:
+                    self._cache.move_to_end(key)
+                    ids[index] = cached
+            # Repeats within the batch count as hits: only distinct texts reach the tokenizer
+            self._counters['hits'] += len(keys) - len(missing)
+            self._counters['misses'] += len(missing)
+
+        if missing:
+            encoded = self.tokenizer()(list(missing), truncation=True, max_length=self.max_length)['input_ids']
+            with self._lock:
+                for (key, indexes), row in zip(missing.items(), encoded):
+                    row = tuple(row)
+                    for index in indexes:
+                        ids[index] = row
+                    if self.cache_size:
+                        self._cache[key] = row
+                        self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return ids
+
+    def encode(self, texts):
+        """``{'input_ids', 'attention_mask'}`` int64 arrays of shape (len(texts), longest row)"""
+        import numpy as np
+        ids = self.token_ids(texts)
+
+        longest = max((len(row) for row in ids), default=0)
+        # Rows are already truncated to max_length, so rounding up never exceeds it
+        width = min(-(-longest // self.pad_to_multiple_of) * self.pad_to_multiple_of, self.max_length)
+
+        input_ids = np.full((len(ids), width), getattr(self.tokenizer(), 'pad_token_id', None) or 0, dtype=np.int64)
+        attention_mask = np.zeros((len(ids), width), dtype=np.int64)
+        for index, row in enumerate(ids):
+            input_ids[index, :len(row)] = row
+            attention_mask[index, :len(row)] = 1
+
+        with self._lock:
+            self._counters['batches'] += 1
+            self._counters['tokens'] += sum(len(row) for row in ids)
+            self._counters['padded_positions'] += input_ids.size
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+    def get_stats(self):
+        """Cache hit rate and the share of padded positions holding real tokens"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._cache)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['padding_efficiency'] = stats['tokens'] / stats['padded_positions'] if stats['padded_positions'] else 0.0
+        return stats
@@ -0,0 +1,116 @@
+"""
+Thumbnail Pipeline
+Background generation of multi-size, content-addressed JPEG thumbnails
+"""
+
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import Config
+from utils import render_thumbnails
+
+
+class ThumbnailPipeline:
+    """Generate every configured thumbnail size for an upload on a worker pool
+
+    Thumbnails are named ``<content_hash>_<size>.jpg``, so they never change
+    once written and identical uploads share them. All sizes for one upload
+    come from a single draft-mode decode. Concurrent requests for the same
+    content share one in-flight job.
+    """
+
+    def __init__(self, thumbnail_folder=None, sizes=None, max_workers=None, quality=None):
+        self.thumbnail_folder = thumbnail_folder or Config.THUMBNAIL_FOLDER
+        self.sizes = dict(sizes or Config.THUMBNAIL_SIZES)
+        self.max_workers = max_workers or Config.THUMBNAIL_WORKERS
+        self.quality = quality or Config.THUMBNAIL_QUALITY
+
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, content_hash, size_name):
+        """Path of one thumbnail (whether or not it exists yet)"""
+        return os.path.join(self.thumbnail_folder, f"{content_hash}_{size_name}.jpg")
+
+    def is_complete(self, content_hash):
+        """True when every size has been written"""
+        return all(os.path.exists(self.path_for(content_hash, name)) for name in self.sizes)
+
+    def submit(self, content_hash, source_path):
+        """Schedule generation off the request path and return a Future for the paths"""
+        with self._lock:
+            future = self._pending.get(content_hash)
+            if future is not None:
+                return future
+
+            if self.is_complete(content_hash):
+                future = Future()
+                future.set_result({name: self.path_for(content_hash, name) for name in self.sizes})
+                return future
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='thumbnail'
+                )
+            future = self._executor.submit(self._generate, content_hash, source_path)
+            self._pending[content_hash] = future
+
+        future.add_done_callback(lambda _: self._done(content_hash))
+        return future
+
+    def get(self, content_hash, source_path, size_name, timeout=None):
+        """Path of a thumbnail, waiting for generation if it is missing"""
+        path = self.path_for(content_hash, size_name)
+        if not os.path.exists(path):
+            self.submit(content_hash, source_path).result(timeout)
+        return path
+
+    def _done(self, content_hash):
+        with self._lock:
+            self._pending.pop(content_hash, None)
+
+    def _generate(self, content_hash, source_path):
+        """Render all sizes from one decode and write them atomically"""
+        os.makedirs(self.thumbnail_folder, exist_ok=True)
+        thumbs = render_thumbnails(source_path, list(self.sizes.values()))
+
+        paths = {}
+        for name, size in self.sizes.items():
+            path = self.path_for(content_hash, name)
+            temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            thumbs[size].save(temp_path, 'JPEG', quality=self.quality, optimize=True)
+            os.replace(temp_path, path)
+            paths[name] = path
+        return paths
+
+    def remove(self, content_hash):
+        """Delete every thumbnail of an upload and return how many were removed"""
+        removed = 0
+        for name in self.sizes:
+            try:
+                os.remove(self.path_for(content_hash, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def remove_for_source(self, source_path):
+        """Delete the thumbnails of a content-addressed upload file"""
+        content_hash = os.path.splitext(os.path.basename(source_path))[0]
+        return self.remove(content_hash)
+
+    def shutdown(self, wait=True):
+        """Stop the worker pool"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def get_stats(self):
+        """Get the number of uploads with thumbnails still being rendered"""
+        with self._lock:
+            return {'pending': len(self._pending), 'workers': self.max_workers}
@@ -0,0 +1,206 @@
+"""
+Upload Streaming
+Single-pass ingestion of multipart uploads: hash, sniff, enforce budgets and
+spool to disk while the request body is being parsed
+"""
+
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app, request
+
+from utils import sniff_image_header
+
+
+# Leading bytes of every supported format
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'\xff\xd8')
+
+# Bytes kept in memory while looking for the dimensions (JPEG metadata can precede them)
+HEADER_SCAN_LIMIT = 256 * 1024
+
+# Spool directory inside the upload folder, so the final rename stays on one filesystem
+INCOMING_DIR = '.incoming'
+
+
+class UploadRejected(Exception):
+    """Raised while streaming an upload that fails validation"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StreamingUpload:
+    """Writable sink the multipart parser streams one file part into
+
+    Every chunk is hashed and written to a temp file under
+    ``upload_folder/.incoming`` as it arrives, and the leading bytes are
+    sniffed for the image format and dimensions. Bad magic bytes, a body
+    over ``max_bytes`` or dimensions over ``max_pixels`` raise
+    ``UploadRejected`` mid-stream and delete the temp file, so nothing is
+    ever written to the upload folder itself. Only the header scan buffer
+    (at most HEADER_SCAN_LIMIT bytes) is held in memory.
+
+    With ``defer_errors`` a rejected part is drained without being stored
+    and the error is raised by ``finish`` instead, so the rest of a
+    multi-file request still parses.
+    """
+
+    def __init__(self, upload_folder, max_bytes=None, max_pixels=None, defer_errors=False):
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.defer_errors = defer_errors
+
+        self.error = None
+        self.size = 0
+        self.header = None
+        self.content_hash = None
+        self._head = bytearray()
+        self._hasher = hashlib.sha256()
+
+        incoming = os.path.join(upload_folder, INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=incoming, suffix='.tmp', delete=False)
+        self.temp_path = self._file.name
+
+    def write(self, chunk):
+        """Consume one chunk of the file part"""
+        if self.error is not None:
+            return len(chunk)
+        try:
+            self._consume(chunk)
+        except UploadRejected as e:
+            if not self.defer_errors:
+                raise
+            self.error = e
+        return len(chunk)
+
+    def _consume(self, chunk):
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self._reject(f"File exceeds the {self.max_bytes} byte limit", 413)
+
+        if self.header is None:
+            self._sniff(chunk)
+
+        self._hasher.update(chunk)
+        self._file.write(chunk)
+
+    def _sniff(self, chunk):
+        """Check magic bytes as soon as they arrive, then the dimensions once complete"""
+        self._head += chunk[:HEADER_SCAN_LIMIT - len(self._head)]
+        head = bytes(self._head[:8])
+        if not any(signature[:len(head)] == head[:len(signature)] for signature in IMAGE_SIGNATURES):
+            self._reject('Invalid image file')
+
+        header = sniff_image_header(self._head)
+        if header is None:
+            if len(self._head) >= HEADER_SCAN_LIMIT:
+                self._reject('Invalid image file')
+            return
+
+        if self.max_pixels is not None and header['width'] * header['height'] > self.max_pixels:
+            self._reject(f"Image exceeds the {self.max_pixels} pixel limit", 413)
+        self.header = header
+        self._head = None
+
+    def _reject(self, message, status_code=400):
+        self.discard()
+        raise UploadRejected(message, status_code)
+
+    # The parser rewinds the container once the part is complete (a rejected part has no file left)
+    def seek(self, offset, whence=os.SEEK_SET):
+        return 0 if self.error is not None else self._file.seek(offset, whence)
+
+    def tell(self):
+        return 0 if self.error is not None else self._file.tell()
+
+    def read(self, size=-1):
+        return b'' if self.error is not None else self._file.read(size)
+
+    def finish(self):
+        """Close the temp file and return the content hash, rejecting truncated images"""
+        if self.error is not None:
+            raise self.error
+        if self.content_hash is None:
+            if self.header is None:
+                self._reject('Invalid image file')
+            self._file.close()
+            self.content_hash = self._hasher.hexdigest()
+        return self.content_hash
+
+    def commit(self, extension):
+        """Move the upload to its content-addressed name in the upload folder
+
+        Returns ``(filename, file_path, created)``; when the blob already
+        exists the temp file is dropped instead.
+        """
+        content_hash = self.finish()
+        filename = f"{content_hash}.{extension}"
+        file_path = os.path.join(self.upload_folder, filename)
+
+        if os.path.exists(file_path):
+            self.discard()
+            return filename, file_path, False
+
+        os.replace(self.temp_path, file_path)
+        self.temp_path = None
+        return filename, file_path, True
+
+    def discard(self):
+        """Delete the temp file (no-op once committed or discarded)"""
+        self._file.close()
+        if self.temp_path is not None:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+            self.temp_path = None
+
+
+class StreamingRequest(Request):
+    """Request that streams file parts of STREAMING_UPLOAD_ENDPOINTS into StreamingUpload sinks
+
+    Other endpoints keep Werkzeug's default spooled temporary files.
+    Endpoints in STREAMING_UPLOAD_PER_FILE_ERRORS defer each file's
+    rejection to the view, STREAMING_UPLOAD_MAX_FILES caps the file parts
+    per request, and MAX_CONTENT_LENGTH_BY_ENDPOINT raises the body limit
+    for multi-file endpoints (each file stays under MAX_CONTENT_LENGTH).
+    Uncommitted sinks are discarded by ``discard_streaming_uploads`` when
+    the request is torn down.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streaming_uploads = []
+
+    @property
+    def max_content_length(self):
+        limits = current_app.config.get('MAX_CONTENT_LENGTH_BY_ENDPOINT', {})
+        return limits.get(self.endpoint) or super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        if self.endpoint not in config.get('STREAMING_UPLOAD_ENDPOINTS', ()):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        max_files = config.get('STREAMING_UPLOAD_MAX_FILES')
+        if max_files is not None and len(self.streaming_uploads) >= max_files:
+            raise UploadRejected(f"At most {max_files} files per request", 413)
+
+        upload = StreamingUpload(
+            config['UPLOAD_FOLDER'],
+            max_bytes=config.get('MAX_CONTENT_LENGTH'),
+            max_pixels=config.get('MAX_IMAGE_PIXELS'),
+            defer_errors=self.endpoint in config.get('STREAMING_UPLOAD_PER_FILE_ERRORS', ())
+        )
+        self.streaming_uploads.append(upload)
+        return upload
+
+
+def discard_streaming_uploads(exc=None):
+    """Teardown handler removing temp files of uploads the view did not commit"""
+    for upload in getattr(request, 'streaming_uploads', ()):
+        upload.discard()
@@ -0,0 +1,245 @@
+"""
+Write-Behind Queue
+Group-commit writer that takes SQLite inserts off the request thread
+"""
+
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+_EMPTY = object()
+
+
+class _Insert:
+    """One queued row"""
+
+    __slots__ = ('table', 'columns', 'values', 'unique_column', 'update_columns', 'future')
+
+    def __init__(self, table, columns, values, unique_column, update_columns=()):
+        self.table = table
+        self.columns = columns
+        self.values = values
+        self.unique_column = unique_column
+        self.update_columns = update_columns
+        self.future = Future()
+
+
+class _FlushMarker:
+    """Queue marker resolved once every row queued before it is committed"""
+
+    __slots__ = ('future',)
+
+    def __init__(self):
+        self.future = Future()
+
+
+class WriteBehindQueue:
+    """Bounded insert queue flushed by a background writer in one transaction per batch
+
+    A batch is committed when ``batch_rows`` rows are waiting or the oldest
+    row has waited ``interval_ms``. Each submitted row gets a Future that
+    resolves to its row id, or to the insert's exception; a failed batch is
+    retried one row at a time so a bad row fails alone. Ids are
+    preassigned from ``sqlite_sequence`` inside the write transaction so
+    plain inserts can use ``executemany``. When the queue is full,
+    ``submit`` blocks for up to ``put_timeout`` seconds and then raises
+    ``queue.Full``.
+    """
+
+    def __init__(self, database, batch_rows=200, interval_ms=20, max_queue=10000, put_timeout=5.0):
+        self.database = database
+        self.batch_rows = batch_rows
+        self.interval = interval_ms / 1000.0
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'rows_written': 0, 'batches': 0, 'failed_batches': 0, 'failed_rows': 0, 'largest_batch': 0}
+
+    def start(self):
+        """Start the background writer (flushes on interpreter shutdown)"""
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._closed = False
+            self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._worker.start()
+            atexit.register(self.close)
+
+    def submit(self, table, columns, values, unique_column=None, update_columns=()):
+        """Queue one insert and return a Future for its row id
+
+        With ``unique_column`` set a conflicting insert resolves to the id of
+        the existing row, after copying ``update_columns`` (if any) onto it.
+        """
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        if self._worker is None:
+            self.start()
+
+        item = _Insert(table, tuple(columns), tuple(values), unique_column, tuple(update_columns))
+        self._queue.put(item, timeout=self.put_timeout)
+        return item.future
+
+    def flush(self, timeout=None):
+        """Block until every row queued so far has been committed"""
+        if self._worker is None:
+            return
+        marker = _FlushMarker()
+        self._queue.put(marker, timeout=timeout)
+        marker.future.result(timeout)
+
+    def close(self, timeout=None):
+        """Flush outstanding rows and stop the writer"""
+        with self._lock:
+            if self._worker is None or self._closed:
+                return
+            self._closed = True
+            worker = self._worker
+
+        self._queue.put(None)
+        worker.join(timeout)
+        with self._lock:
+            self._worker = None
+        atexit.unregister(self.close)
+
+    def queue_depth(self):
+        """Number of rows waiting to be written"""
+        return self._queue.qsize()
+
+    def get_stats(self):
+        """Get writer statistics"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self.queue_depth()
+        return stats
+
+    def _next_item(self, deadline=None):
+        """Next queued item, or _EMPTY once the deadline passes (immediately if None)"""
+        try:
+            if deadline is None:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            return _EMPTY
+
+    def _run(self):
+        """Writer loop: collect a batch, commit it, repeat until closed"""
+        while True:
+            item = self._queue.get()
+            batch, markers, stopping = [], [], False
+            deadline = time.monotonic() + self.interval
+
+            while item is not _EMPTY:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, _FlushMarker):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+
+                if len(batch) >= self.batch_rows and not stopping:
+                    break
+                # Flush requests and shutdown commit whatever is queued without waiting
+                item = self._next_item(None if (stopping or markers) else deadline)
+
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.future.set_result(None)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        """Insert a batch in a single transaction, retrying row by row if it fails
+
+        A failing row (e.g. a constraint violation) rolls back the whole
+        transaction, so the rows are then written one transaction each and
+        only the futures of the rows that fail again get the exception.
+        """
+        try:
+            row_ids = self._commit(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].future.set_exception(e)
+                with self._stats_lock:
+                    self._stats['failed_rows'] += 1
+                return
+            with self._stats_lock:
+                self._stats['failed_batches'] += 1
+            for item in batch:
+                self._write([item])
+            return
+
+        for item in batch:
+            item.future.set_result(row_ids[id(item)])
+        with self._stats_lock:
+            self._stats['rows_written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+
+    def _commit(self, batch):
+        """Insert rows in one transaction and return their ids by id() of the queued item"""
+        conn = self.database.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row_ids = {}
+
+            # Group plain inserts by target so each group is one executemany
+            groups = {}
+            for item in batch:
+                if item.unique_column:
+                    row_ids[id(item)] = self._insert_unique(conn, item)
+                else:
+                    groups.setdefault((item.table, item.columns), []).append(item)
+
+            for (table, columns), items in groups.items():
+                # Holding the write lock makes the preassigned ids safe across processes
+                cursor = conn.execute(
+                    'SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0)', (table,)
+                )
+                next_id = cursor.fetchone()[0] + 1
+                placeholders = ', '.join('?' * (len(columns) + 1))
+                conn.executemany(
+                    f"INSERT INTO {table} (id, {', '.join(columns)}) VALUES ({placeholders})",
+                    [(next_id + i,) + item.values for i, item in enumerate(items)]
+                )
+                for i, item in enumerate(items):
+                    row_ids[id(item)] = next_id + i
+
+            conn.commit()
+            return row_ids
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _insert_unique(self, conn, item):
+        """Insert a row deduplicated on its unique column and return its id"""
+        placeholders = ', '.join('?' * len(item.columns))
+        if item.update_columns:
+            conflict = 'DO UPDATE SET ' + ', '.join(f"{column} = excluded.{column}" for column in item.update_columns)
+        else:
+            conflict = 'DO NOTHING'
+        cursor = conn.execute(
+            f"INSERT INTO {item.table} ({', '.join(item.columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT({item.unique_column}) {conflict}",
+            item.values
+        )
+        value = item.values[item.columns.index(item.unique_column)]
+        # An update leaves lastrowid alone; NULL values never conflict, so they were inserted
+        if value is None or (cursor.rowcount and not item.update_columns):
+            return cursor.lastrowid
+
+        cursor = conn.execute(
+            f"SELECT id FROM {item.table} WHERE {item.unique_column} = ?", (value,)
+        )
+        return cursor.fetchone()[0]
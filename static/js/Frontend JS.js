@@ -1,5 +1,7 @@
 let uploadedImage = null;
 let uploadedFileName = null;
+let sessionId = null;
+let previewImage = null;
 
 // Initialize
 document.addEventListener('DOMContentLoaded', function() {
@@ -39,15 +41,11 @@ function handleImageUpload(event) {
     // Display filename
     document.getElementById('fileName').textContent = `Selected: ${file.name}`;
     
-    // Show preview in chat
-    const reader = new FileReader();
-    reader.onload = function(e) {
-        displayImagePreview(e.target.result);
-    };
-    reader.readAsDataURL(file);
+    // Show preview in chat straight from the file, without base64-encoding it
+    displayImagePreview(URL.createObjectURL(file));
 }
 
-function displayImagePreview(imageData) {
+function displayImagePreview(imageUrl) {
     clearWelcomeMessage();
     
     const chatContainer = document.getElementById('chatContainer');
@@ -58,9 +56,10 @@ function displayImagePreview(imageData) {
     contentDiv.className = 'message-content';
     
     const img = document.createElement('img');
-    img.src = imageData;
+    img.src = imageUrl;
     img.className = 'image-preview';
     img.alt = 'Uploaded image';
+    previewImage = img;
     
     const text = document.createElement('p');
     text.textContent = '📸 Image uploaded';
@@ -125,6 +124,7 @@ function displayBotMessage(message) {
     chatContainer.appendChild(messageDiv);
     
     scrollToBottom();
+    return contentDiv;
 }
 
 function displayLoadingMessage() {
@@ -150,6 +150,62 @@ function removeLoadingMessage() {
     }
 }
 
+async function readEventStream(response, onEvent) {
+    // Parse server-sent events from a fetch response as chunks arrive (EventSource cannot POST)
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            onEvent(event, data ? JSON.parse(data) : null);
+        }
+    }
+}
+
+async function streamResponse(response, onInfo) {
+    // Render response tokens into one bot message as they arrive; resolves to the final payload
+    if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+        // Validation errors are still answered with plain JSON
+        return response.json();
+    }
+    
+    let bubble = null;
+    let result = null;
+    await readEventStream(response, function(event, data) {
+        if (event === 'token') {
+            if (!bubble) {
+                removeLoadingMessage();
+                bubble = displayBotMessage('');
+            }
+            bubble.textContent += data.text;
+            scrollToBottom();
+        } else if (event === 'done' || event === 'error') {
+            result = data;
+        } else {
+            onInfo(event, data);
+        }
+    });
+    if (!bubble && result && result.success) {
+        displayBotMessage(result.response);
+    }
+    return result ? { ...result, streamed: true } : { error: 'Connection closed' };
+}
+
 async function sendTextMessage(message) {
     displayLoadingMessage();
     
@@ -158,16 +214,20 @@ async function sendTextMessage(message) {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
             },
-            body: JSON.stringify({ message: message })
+            body: JSON.stringify({ message: message, session_id: sessionId })
         });
         
-        const data = await response.json();
+        const data = await streamResponse(response, function(event, info) {
+            if (event === 'session') sessionId = info.session_id;
+        });
         
         removeLoadingMessage();
         
         if (data.success) {
-            displayBotMessage(data.response);
+            sessionId = data.session_id;
+            if (!data.streamed) displayBotMessage(data.response);
         } else {
             showError(data.error || 'Failed to get response');
         }
@@ -184,19 +244,31 @@ async function sendImageWithQuery(query) {
     const formData = new FormData();
     formData.append('image', uploadedImage);
     formData.append('query', query);
+    if (sessionId) {
+        formData.append('session_id', sessionId);
+    }
     
     try {
         const response = await fetch('/api/upload', {
             method: 'POST',
+            headers: { 'Accept': 'text/event-stream' },
             body: formData
         });
         
-        const data = await response.json();
+        // The upload details arrive before the analysis, so the thumbnail shows while it runs
+        const data = await streamResponse(response, function(event, info) {
+            if (event === 'upload') {
+                sessionId = info.session_id;
+                showThumbnail(info.thumbnail_url);
+            }
+        });
         
         removeLoadingMessage();
         
         if (data.success) {
-            displayBotMessage(data.response);
+            sessionId = data.session_id;
+            showThumbnail(data.thumbnail_url);
+            if (!data.streamed) displayBotMessage(data.response);
             // Reset image after successful query
             resetImageUpload();
         } else {
@@ -209,6 +281,17 @@ async function sendImageWithQuery(query) {
     }
 }
 
+function showThumbnail(thumbnailUrl) {
+    // Swap the local preview for the cacheable server thumbnail and free the file blob
+    if (!previewImage || !thumbnailUrl) return;
+    const localUrl = previewImage.src;
+    previewImage.onload = function() {
+        URL.revokeObjectURL(localUrl);
+    };
+    previewImage.src = thumbnailUrl;
+    previewImage = null;
+}
+
 function resetImageUpload() {
     uploadedImage = null;
     uploadedFileName = null;
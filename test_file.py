@@ -6,10 +6,18 @@ Run with: python -m pytest test_app.py
 import unittest
 import os
 import json
-from app import app
+from app import app, thumbnail_pipeline
 from database import Database
 from utils import allowed_file, generate_unique_filename, sanitize_input
 
+def parse_events(body):
+    """Split a server-sent event stream into (event, data) pairs"""
+    events = []
+    for frame in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
 class TestFlaskApp(unittest.TestCase):
     """Test Flask application endpoints"""
     
@@ -35,6 +43,19 @@ class TestFlaskApp(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertIn('response', data)
     
+    def test_chat_endpoint_streams_events(self):
+        """Test chat answers with server-sent events when the client accepts them"""
+        response = self.client.post('/api/chat', json={'message': 'Hello'},
+                                    headers={'Accept': 'text/event-stream'})
+        events = parse_events(response.get_data(as_text=True))
+        
+        self.assertTrue(response.content_type.startswith('text/event-stream'))
+        self.assertEqual(events[0][0], 'session')
+        self.assertEqual(events[-1][0], 'done')
+        tokens = [data['text'] for event, data in events if event == 'token']
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(''.join(tokens), events[-1][1]['response'])
+    
     def test_chat_endpoint_empty_message(self):
         """Test chat endpoint with empty message"""
         response = self.client.post('/api/chat',
@@ -45,6 +66,91 @@ class TestFlaskApp(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('error', data)
     
+    def test_history_endpoint_pagination(self):
+        """Test history endpoint pages through a session with a cursor"""
+        first = self.client.post('/api/chat', json={'message': 'Hello'}).get_json()
+        session_id = first['session_id']
+        self.client.post('/api/chat', json={'message': 'help', 'session_id': session_id})
+
+        page = self.client.get(f'/api/history?session_id={session_id}&limit=3').get_json()
+        self.assertEqual(len(page['history']), 3)
+        self.assertIsNotNone(page['next_before_id'])
+
+        rest = self.client.get(
+            f"/api/history?session_id={session_id}&limit=3&before_id={page['next_before_id']}"
+        ).get_json()
+        self.assertEqual(len(rest['history']), 1)
+        self.assertIsNone(rest['next_before_id'])
+
+    def test_search_endpoint(self):
+        """Test search returns escaped snippets with highlighted matches and pages with an offset"""
+        session_id = self.client.post('/api/chat', json={'message': 'find the <b>zebra</b> crossing'}).get_json()['session_id']
+        self.client.post('/api/chat', json={'message': 'zebra again', 'session_id': session_id})
+        
+        data = self.client.get(f'/api/search?q=zebra&session_id={session_id}&limit=1').get_json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['next_offset'], 1)
+        later = self.client.get(f'/api/search?q=zebra&session_id={session_id}&offset=1&limit=10').get_json()
+        snippets = [result['snippet'] for result in data['results'] + later['results']]
+        self.assertIn('find the &lt;b&gt;<mark>zebra</mark>&lt;/b&gt; crossing', snippets)
+        self.assertIsNone(later['next_offset'])
+        self.assertEqual(self.client.get(f'/api/search?q=&session_id={session_id}').status_code, 400)
+    
+    def test_search_across_sessions_needs_admin(self):
+        """Test search without a session_id is refused, and the admin search covers every session"""
+        from unittest import mock
+        from config import Config
+        for message in ('walrus on ice', 'walrus in water'):
+            self.client.post('/api/chat', json={'message': message})
+        
+        self.assertEqual(self.client.get('/api/search?q=walrus').status_code, 400)
+        self.assertEqual(self.client.get('/api/admin/search?q=walrus').status_code, 404)
+        with mock.patch.object(Config, 'ADMIN_TOKEN', 'secret'):
+            self.assertEqual(self.client.get('/api/admin/search?q=walrus').status_code, 403)
+            data = self.client.get('/api/admin/search?q=walrus&source=chat',
+                                   headers={'X-Admin-Token': 'secret'}).get_json()
+        self.assertGreaterEqual(len({result['session_id'] for result in data['results']}), 2)
+    
+    def test_history_endpoint_requires_session(self):
+        """Test history endpoint without session_id"""
+        response = self.client.get('/api/history')
+        self.assertEqual(response.status_code, 400)
+
+    def test_health_check(self):
+        """Test health check reports the database reachable"""
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'ok')
+
+    def test_prefork_worker_recycling(self):
+        """Test the prefork request counter asks to recycle at the request limit"""
+        from prefork import _RequestCounter
+        reasons = []
+        info = {'slot': 0, 'pid': os.getpid(), 'started_at': 0, 'requests': 0}
+        counter = _RequestCounter(self.app.wsgi_app, info, 2, reasons.append)
+        self.app.wsgi_app = counter
+        try:
+            for _ in range(3):
+                worker = self.client.get('/healthz').get_json()['worker']
+        finally:
+            self.app.wsgi_app = counter.app
+        self.assertEqual(worker['requests'], 3)
+        self.assertEqual(len(reasons), 1)
+
+    def test_import_defers_heavy_modules(self):
+        """Test importing the app loads neither image libraries nor the database"""
+        import subprocess
+        import sys
+        import tempfile
+        app_dir = os.path.dirname(os.path.abspath(sys.modules['app'].__file__))
+        code = ("import os, sys, app; "
+                "print(sorted(m for m in ('cv2', 'numpy', 'PIL.Image') if m in sys.modules), "
+                "os.path.exists('chatbot.db'))")
+        with tempfile.TemporaryDirectory() as workdir:
+            result = subprocess.run([sys.executable, '-c', code], cwd=workdir, capture_output=True, text=True,
+                                    env=dict(os.environ, PYTHONPATH=app_dir), check=True)
+        self.assertEqual(result.stdout.split('\n')[-2], '[] False')
+
     def test_upload_endpoint_no_file(self):
         """Test upload endpoint without file"""
         response = self.client.post('/api/upload')
@@ -63,6 +169,7 @@ class TestDatabase(unittest.TestCase):
     
     def tearDown(self):
         """Clean up test database"""
+        self.db.close()
         if os.path.exists('test_chatbot.db'):
             os.remove('test_chatbot.db')
     
@@ -85,6 +192,102 @@ class TestDatabase(unittest.TestCase):
         history = self.db.get_chat_history(session_id)
         self.assertEqual(len(history), 2)
     
+    def test_get_chat_history_keyset_pagination(self):
+        """Test before_id pages are disjoint and ordered newest first"""
+        ids = [self.db.add_chat_message('paged', 'user', f'Message {i}') for i in range(7)]
+
+        first = self.db.get_chat_history('paged', limit=3)
+        second = self.db.get_chat_history('paged', limit=3, before_id=first[-1]['id'])
+        third = self.db.get_chat_history('paged', limit=3, before_id=second[-1]['id'])
+
+        paged_ids = [row['id'] for row in first + second + third]
+        self.assertEqual(paged_ids, list(reversed(ids)))
+
+        # A cursor whose message was deleted meanwhile still pages on to older messages
+        conn = self.db.get_connection()
+        conn.execute('DELETE FROM chat_history WHERE id = ?', (first[-1]['id'],))
+        conn.commit()
+        conn.close()
+        stale = self.db.get_chat_history('paged', limit=3, before_id=first[-1]['id'])
+        self.assertEqual([row['id'] for row in stale], [row['id'] for row in second])
+
+    def test_schema_migrations_applied(self):
+        """Test schema is migrated to the latest version"""
+        from database import MIGRATIONS
+        self.assertEqual(self.db.get_schema_version(), MIGRATIONS[-1][0])
+
+    def test_search_ranks_and_filters(self):
+        """Test full-text search across messages and queries, with filters and trigger-maintained index"""
+        first = self.db.add_chat_message('s1', 'user', 'What colour is the cat on the sofa?')
+        self.db.add_chat_message('s1', 'bot', 'I can see two cats sleeping.')
+        self.db.add_chat_message('s2', 'user', 'Is there a café near the beach?')
+        self.db.add_query(None, 'identify the cats', 'Two cats and a dog')
+        
+        results = self.db.search('cats')
+        self.assertEqual(len(results), 3)
+        self.assertEqual({result['source'] for result in results}, {'chat', 'queries'})
+        self.assertIn('[cat]', next(r['snippet'] for r in results if r['id'] == first and r['source'] == 'chat'))
+        self.assertEqual([r['id'] for r in self.db.search('cat', session_id='s1', order='recent')], [first + 1, first])
+        self.assertEqual(self.db.search('cafe')[0]['session_id'], 's2')
+        self.assertEqual(len(self.db.search('do', prefix=True)), 1)
+        self.assertEqual(len(self.db.search('cat" (sofa*')), 1)
+        self.assertEqual(self.db.search('cat', start='2999-01-01'), [])
+        self.assertEqual(len(self.db.search('cat', end='2999-01-01', sources=('chat',))), 2)
+        
+        conn = self.db.get_connection()
+        conn.execute("DELETE FROM chat_history WHERE session_id = 's1'")
+        conn.commit()
+        conn.close()
+        self.assertEqual([r['source'] for r in self.db.search('cat')], ['queries'])
+    
+    def test_search_rank_window(self):
+        """Test ranking only considers the newest matches when the window is set"""
+        ids = [self.db.add_chat_message('w', 'user', f'sunset photo number {i}') for i in range(5)]
+        results = self.db.search('sunset', rank_window=2)
+        self.assertEqual(sorted(r['id'] for r in results), ids[-2:])
+        self.assertEqual(len(self.db.search('sunset', rank_window=0)), 5)
+    
+    def test_statistics_counters_follow_writes(self):
+        """Test counters and today's activity are maintained on insert"""
+        self.db.add_chat_message('s1', 'user', 'Message 1')
+        self.db.add_chat_message('s1', 'bot', 'Response 1')
+        self.db.add_query(None, 'what', 'answer')
+
+        stats = self.db.get_statistics()
+        self.assertEqual(stats['total_messages'], 2)
+        self.assertEqual(stats['total_queries'], 1)
+        self.assertEqual(stats['today_messages'], 2)
+
+        hourly = self.db.get_activity(granularity='hour', table_name='chat_history')
+        self.assertEqual(sum(row['count'] for row in hourly), 2)
+
+    def test_backfill_statistics_for_existing_database(self):
+        """Test backfill counts rows written before the counters existed"""
+        import sqlite3
+        self.db.close()
+        os.remove('test_chatbot.db')
+
+        conn = sqlite3.connect('test_chatbot.db')
+        conn.execute('''CREATE TABLE chat_history (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        session_id TEXT NOT NULL, message_type TEXT NOT NULL, content TEXT NOT NULL,
+                        image_path TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        conn.executemany('INSERT INTO chat_history (session_id, message_type, content, timestamp) VALUES (?, ?, ?, ?)',
+                         [('s1', 'user', 'old', '2024-01-01 10:00:00'), ('s1', 'bot', 'old', '2024-01-02 11:30:00')])
+        conn.commit()
+        conn.close()
+
+        with self.assertLogs('database', 'WARNING') as logs:
+            self.db = Database('test_chatbot.db')
+            self.assertEqual(self.db.get_statistics()['total_messages'], 2)
+            self.assertEqual(self.db.get_statistics()['total_messages'], 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('not backfilled', logs.output[0])
+
+        stats = self.db.backfill_statistics()
+        self.assertEqual(stats['total_messages'], 2)
+        activity = self.db.get_activity('2024-01-01', '2024-01-01', table_name='chat_history')
+        self.assertEqual(activity, [{'bucket': '2024-01-01', 'table_name': 'chat_history', 'count': 1}])
+
     def test_add_image_upload(self):
         """Test recording image upload"""
         image_id = self.db.add_image_upload(
@@ -96,6 +299,36 @@ class TestDatabase(unittest.TestCase):
         self.assertIsNotNone(image_id)
         self.assertGreater(image_id, 0)
     
+    def test_add_image_upload_deduplicates_by_hash(self):
+        """Test uploads with the same content hash share one row"""
+        first_id = self.db.add_image_upload('abc.jpg', 'a.jpg', '/uploads/abc.jpg', 1024, content_hash='abc')
+        second_id = self.db.add_image_upload('abc.jpg', 'b.jpg', '/uploads/abc.jpg', 1024, content_hash='abc')
+
+        self.assertEqual(first_id, second_id)
+        self.assertEqual(self.db.get_image_by_hash('abc')['original_filename'], 'a.jpg')
+        self.assertIsNone(self.db.get_image_by_hash('missing'))
+
+        # Content stored again (its file had gone missing) repoints the existing row
+        third_id = self.db.add_image_upload('abc.png', 'c.png', '/uploads/abc.png', 1024, content_hash='abc')
+        stored = self.db.get_image_by_hash('abc')
+        self.assertEqual(third_id, first_id)
+        self.assertEqual((stored['filename'], stored['file_path']), ('abc.png', '/uploads/abc.png'))
+
+    def test_connections_are_reused(self):
+        """Test pooled connections are reused across calls with WAL enabled"""
+        for i in range(5):
+            self.db.add_chat_message('test_session', 'user', f'Message {i}')
+            self.db.get_chat_history('test_session')
+
+        stats = self.db.get_connection_stats()
+        self.assertEqual(stats['opened'], 1)
+        self.assertGreater(stats['reused'], 0)
+
+        conn = self.db.get_connection()
+        journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+        conn.close()
+        self.assertEqual(journal_mode, 'wal')
+
     def test_get_statistics(self):
         """Test getting database statistics"""
         stats = self.db.get_statistics()
@@ -103,6 +336,520 @@ class TestDatabase(unittest.TestCase):
         self.assertIn('total_images', stats)
 
 
+class TestWriteBehind(unittest.TestCase):
+    """Test group-commit write-behind mode"""
+
+    def setUp(self):
+        """Set up test database with write-behind enabled"""
+        self.db = Database('test_chatbot.db', write_behind=True)
+
+    def tearDown(self):
+        """Clean up test database"""
+        self.db.close()
+        if os.path.exists('test_chatbot.db'):
+            os.remove('test_chatbot.db')
+
+    def test_queued_inserts_resolve_to_row_ids(self):
+        """Test futures resolve to distinct ids and rows are visible after flush"""
+        futures = [self.db.add_chat_message('s1', 'user', f'Message {i}', wait=False) for i in range(50)]
+        self.db.write_behind.flush()
+
+        ids = [future.result(timeout=5) for future in futures]
+        self.assertEqual(ids, list(range(ids[0], ids[0] + 50)))
+        self.assertEqual(len(self.db.get_chat_history('s1', limit=100)), 50)
+        self.assertLess(self.db.write_behind.get_stats()['batches'], 50)
+
+    def test_blocking_calls_and_dedup(self):
+        """Test wait=True returns ids and image uploads stay deduplicated"""
+        message_id = self.db.add_chat_message('s1', 'user', 'Hello')
+        first = self.db.add_image_upload('a.jpg', 'a.jpg', '/uploads/a.jpg', 10, content_hash='h')
+        second = self.db.add_image_upload('a.jpg', 'b.jpg', '/uploads/a.jpg', 10, content_hash='h')
+
+        self.assertGreater(message_id, 0)
+        self.assertEqual(first, second)
+        third = self.db.add_image_upload('a.png', 'c.png', '/uploads/a.png', 10, content_hash='h')
+        self.assertEqual(third, first)
+        self.assertEqual(self.db.get_image_by_hash('h')['file_path'], '/uploads/a.png')
+        self.assertGreater(self.db.add_image_upload('n.jpg', 'n.jpg', '/uploads/n.jpg', 10), first)
+
+    def test_failing_row_fails_alone(self):
+        """Test a row violating a constraint fails its own future, not the rest of its batch"""
+        import sqlite3
+        futures = [self.db.add_chat_message('s1', 'user', content, wait=False)
+                   for content in ('first', None, 'third')]
+        self.db.write_behind.flush()
+
+        self.assertGreater(futures[0].result(timeout=5), 0)
+        self.assertGreater(futures[2].result(timeout=5), futures[0].result())
+        with self.assertRaises(sqlite3.IntegrityError):
+            futures[1].result(timeout=5)
+        self.assertEqual([row['content'] for row in self.db.get_chat_history('s1')], ['third', 'first'])
+        self.assertEqual(self.db.write_behind.get_stats()['failed_rows'], 1)
+
+    def test_close_flushes_pending_rows(self):
+        """Test rows queued before shutdown are written"""
+        self.db.add_query(None, 'what is this', 'a cat', wait=False)
+        self.db.close()
+
+        reopened = Database('test_chatbot.db')
+        self.assertEqual(len(reopened.get_recent_queries()), 1)
+        reopened.close()
+
+
+class TestRetentionJob(unittest.TestCase):
+    """Test batched, resumable retention job"""
+
+    def setUp(self):
+        """Set up test database with old and recent data"""
+        from retention import RetentionJob
+        self.db = Database('test_chatbot.db')
+        self.job = RetentionJob(self.db, days=30, batch_size=2, pause_ms=0)
+        self.files = []
+
+        conn = self.db.get_connection()
+        for i in range(5):
+            path = f'test_retention_{i}.jpg'
+            with open(path, 'wb') as f:
+                f.write(b'x')
+            self.files.append(path)
+            conn.execute('''INSERT INTO image_uploads (filename, original_filename, file_path, file_size,
+                            content_hash, upload_timestamp) VALUES (?, ?, ?, 1, ?, '2020-01-01 00:00:00')''',
+                         (path, path, path, f'hash{i}'))
+            conn.execute("INSERT INTO queries (image_id, query_text, query_timestamp) VALUES (?, 'q', '2020-01-01 00:00:00')",
+                         (i + 1,))
+        # The last upload was asked about again recently, so it must be kept
+        conn.execute("INSERT INTO queries (image_id, query_text) VALUES (5, 'recent')")
+        conn.executemany("INSERT INTO chat_history (session_id, message_type, content, timestamp) VALUES ('s', 'user', 'old', ?)",
+                         [('2020-01-01 00:00:00',)] * 3)
+        conn.commit()
+        conn.close()
+        self.db.add_chat_message('s', 'user', 'recent')
+
+    def tearDown(self):
+        """Clean up test database and files"""
+        self.db.close()
+        for path in self.files + ['test_chatbot.db']:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_run_deletes_expired_rows_and_files(self):
+        """Test per-table counts and that rows and files are removed together"""
+        counts = self.job.run()
+
+        self.assertEqual(counts['image_uploads'], 4)
+        self.assertEqual(counts['files'], 4)
+        self.assertEqual(counts['queries'], 5)
+        self.assertEqual(counts['chat_history'], 3)
+        self.assertEqual([os.path.exists(path) for path in self.files], [False] * 4 + [True])
+        self.assertEqual(self.db.get_statistics()['total_messages'], 1)
+
+    def test_uploads_only_pass(self):
+        """Test an uploads-only pass keeps chat history and skips uploads outside the folder"""
+        counts = self.job.run(uploads_only=True, folder='elsewhere')
+        self.assertEqual((counts['image_uploads'], counts['files']), (0, 0))
+
+        counts = self.job.run(days=10, uploads_only=True)
+        self.assertEqual((counts['image_uploads'], counts['files'], counts['chat_history']), (4, 4, 0))
+        self.assertEqual([os.path.exists(path) for path in self.files], [False] * 4 + [True])
+        self.assertEqual(self.db.get_statistics()['total_messages'], 4)
+
+    def test_clean_old_uploads(self):
+        """Test the cleanup helper runs an uploads-only pass limited to its folder"""
+        from utils import clean_old_uploads
+        self.assertEqual(clean_old_uploads('elsewhere', days=30, retention_job=self.job), 0)
+        self.assertEqual(clean_old_uploads('', days=30, retention_job=self.job), 4)
+        self.assertEqual(self.db.get_statistics()['total_messages'], 4)
+        # Without a job it builds one over the shared database
+        self.assertEqual(clean_old_uploads('elsewhere'), 0)
+
+    def test_resumes_interrupted_file_deletion(self):
+        """Test files journaled by a crashed run are removed on the next run"""
+        conn = self.db.get_connection()
+        conn.execute('INSERT INTO retention_journal (image_id, file_path) VALUES (99, ?)', (self.files[4],))
+        conn.commit()
+        conn.close()
+
+        self.job.run()
+        self.assertFalse(os.path.exists(self.files[4]))
+
+
+class TestStreamingUpload(unittest.TestCase):
+    """Test single-pass upload ingestion"""
+
+    def setUp(self):
+        """Create a PNG in memory and a scratch upload folder"""
+        import io
+        import tempfile
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), color='green').save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+        self.folder = tempfile.mkdtemp()
+        self.previous_folder = app.config['UPLOAD_FOLDER']
+        app.config['UPLOAD_FOLDER'] = self.folder
+        self.previous_thumbnail_folder = thumbnail_pipeline.thumbnail_folder
+        thumbnail_pipeline.thumbnail_folder = os.path.join(self.folder, '.thumbnails')
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Remove the scratch upload folder"""
+        import shutil
+        app.config['UPLOAD_FOLDER'] = self.previous_folder
+        thumbnail_pipeline.thumbnail_folder = self.previous_thumbnail_folder
+        shutil.rmtree(self.folder)
+
+    def stored_files(self):
+        return sorted(name for name in os.listdir(self.folder) if not name.startswith('.'))
+
+    def test_sink_hashes_and_commits(self):
+        """Test chunked writes produce the content hash and a content-addressed file"""
+        import hashlib
+        from upload_stream import StreamingUpload
+        upload = StreamingUpload(self.folder)
+        for i in range(0, len(self.png), 7):
+            upload.write(self.png[i:i + 7])
+
+        self.assertEqual(upload.finish(), hashlib.sha256(self.png).hexdigest())
+        self.assertEqual(upload.header, {'format': 'PNG', 'width': 40, 'height': 30})
+        filename, file_path, created = upload.commit('png')
+        self.assertTrue(created)
+        self.assertEqual(self.stored_files(), [filename])
+        self.assertEqual(os.listdir(os.path.join(self.folder, '.incoming')), [])
+
+    def test_sink_rejects_early(self):
+        """Test bad magic bytes and pixel budgets abort on the first chunk"""
+        from upload_stream import StreamingUpload, UploadRejected
+        upload = StreamingUpload(self.folder)
+        with self.assertRaises(UploadRejected):
+            upload.write(b'not an image at all')
+        self.assertIsNone(upload.temp_path)
+
+        upload = StreamingUpload(self.folder, max_pixels=100)
+        with self.assertRaises(UploadRejected) as ctx:
+            upload.write(self.png[:64])
+        self.assertEqual(ctx.exception.status_code, 413)
+        self.assertEqual(os.listdir(os.path.join(self.folder, '.incoming')), [])
+
+    def test_upload_restores_missing_blob(self):
+        """Test re-uploading content whose file is gone stores it again and repoints the row"""
+        import io
+        from app import db
+        first = self.client.post('/api/upload', data={'image': (io.BytesIO(self.png), 'photo.png')}).get_json()
+        again = self.client.post('/api/upload', data={'image': (io.BytesIO(self.png), 'photo.png')}).get_json()
+        self.assertTrue(again['duplicate'])
+
+        # The row still names a file that no longer exists (e.g. deleted by hand)
+        stored = db.get_image_by_hash(first['content_hash'])
+        os.remove(stored['file_path'])
+        conn = db.get_connection()
+        conn.execute('UPDATE image_uploads SET file_path = ? WHERE id = ?', ('gone/old.png', stored['id']))
+        conn.commit()
+        conn.close()
+
+        restored = self.client.post('/api/upload', data={'image': (io.BytesIO(self.png), 'photo.png')}).get_json()
+        row = db.get_image_by_hash(first['content_hash'])
+        self.assertFalse(restored['duplicate'])
+        self.assertEqual(restored['image_id'], first['image_id'])
+        self.assertEqual(row['file_path'], stored['file_path'])
+        self.assertTrue(os.path.exists(row['file_path']))
+
+    def test_upload_endpoint_streams_to_folder(self):
+        """Test valid uploads are stored once and rejected ones leave no files"""
+        import io
+        response = self.client.post('/api/upload', data={
+            'image': (io.BytesIO(self.png), 'photo.png'), 'query': 'what is this'
+        })
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_files(), [f"{data['content_hash']}.png"])
+
+        thumbnail = self.client.get(data['thumbnail_url'])
+        self.assertEqual(thumbnail.status_code, 200)
+        self.assertIn('immutable', thumbnail.headers['Cache-Control'])
+        self.assertIsNotNone(thumbnail.headers.get('Last-Modified'))
+        revalidated = self.client.get(data['thumbnail_url'], headers={'If-None-Match': thumbnail.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+        response = self.client.post('/api/upload', data={
+            'image': (io.BytesIO(b'plain text'), 'fake.png'), 'query': 'what is this'
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(os.listdir(os.path.join(self.folder, '.incoming')), [])
+
+    def test_batch_upload_reports_per_item(self):
+        """Test batch items succeed or fail independently and over-limit batches are refused"""
+        import io
+        from PIL import Image
+        images = []
+        for color in ('red', 'yellow'):
+            buffer = io.BytesIO()
+            Image.new('RGB', (40, 30), color=color).save(buffer, 'PNG')
+            images.append(buffer.getvalue())
+        files = [(io.BytesIO(images[0]), 'red.png'), (io.BytesIO(b'plain text'), 'fake.png'),
+                 (io.BytesIO(images[1]), 'yellow.png'), (io.BytesIO(images[1]), 'notes.txt')]
+        response = self.client.post('/api/upload/batch', data={
+            'images': files, 'queries': json.dumps([['what is this', 'explain it']]), 'query': 'identify'
+        })
+        data = response.get_json()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['succeeded'], data['failed']), (2, 2))
+        red, fake, yellow, notes = data['items']
+        self.assertEqual([result['query'] for result in red['results']], ['what is this', 'explain it'])
+        self.assertTrue(all(result['response'] for result in red['results']))
+        self.assertEqual(yellow['results'][0]['query'], 'identify')
+        self.assertEqual((fake['success'], fake['status']), (False, 400))
+        self.assertEqual(notes['error'], 'Invalid file type')
+        self.assertEqual(self.stored_files(), sorted([red['filename'], yellow['filename']]))
+        self.assertEqual(os.listdir(os.path.join(self.folder, '.incoming')), [])
+        
+        previous = app.config['STREAMING_UPLOAD_MAX_FILES']
+        app.config['STREAMING_UPLOAD_MAX_FILES'] = 1
+        try:
+            response = self.client.post('/api/upload/batch', data={
+                'images': [(io.BytesIO(images[0]), 'a.png'), (io.BytesIO(images[1]), 'b.png')]
+            })
+        finally:
+            app.config['STREAMING_UPLOAD_MAX_FILES'] = previous
+        self.assertEqual(response.status_code, 413)
+
+        for queries in ([5], [{'a': 1}], [[]], [['ok', 3]]):
+            response = self.client.post('/api/upload/batch', data={
+                'images': [(io.BytesIO(images[0]), 'a.png')], 'queries': json.dumps(queries)
+            })
+            self.assertEqual(response.status_code, 400, queries)
+
+    def test_similar_endpoint(self):
+        """Test uploads are searchable by feature similarity and their vectors are reused"""
+        import io
+        from unittest import mock
+        from PIL import Image
+        from feature_store import FeatureStore
+        store = FeatureStore(directory=os.path.join(self.folder, '.features'), model_version='test')
+        images = []
+        for color in ((200, 10, 10), (190, 20, 10), (10, 10, 200)):
+            buffer = io.BytesIO()
+            Image.new('RGB', (40, 30), color=color).save(buffer, 'PNG')
+            images.append((io.BytesIO(buffer.getvalue()), 'image.png'))
+        
+        with mock.patch('app.feature_store', store):
+            data = self.client.post('/api/upload/batch', data={'images': images, 'query': 'what'}).get_json()
+            red, dark_red, blue = (item['image_id'] for item in data['items'])
+            response = self.client.get(f'/api/similar/{red}?k=5')
+            missing = self.client.get('/api/similar/999999')
+        
+        results = response.get_json()['results']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['image_id'] for result in results], [dark_red, blue])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual((store.get_stats()['added'], store.get_stats()['live_rows']), (3, 3))
+    
+    def test_upload_endpoint_streams_events(self):
+        """Test streamed uploads send the upload details before the response tokens"""
+        import io
+        from PIL import Image
+        # Distinct content, so the upload is not deduplicated against another test's (deleted) blob
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), color='blue').save(buffer, 'PNG')
+        response = self.client.post('/api/upload', data={
+            'image': (io.BytesIO(buffer.getvalue()), 'photo.png'), 'query': 'explain the colours'
+        }, headers={'Accept': 'text/event-stream'})
+        events = parse_events(response.get_data(as_text=True))
+        
+        self.assertEqual(events[0][0], 'upload')
+        self.assertIn('thumbnail_url', events[0][1])
+        self.assertNotIn('response', events[0][1])
+        done = events[-1][1]
+        self.assertEqual(''.join(data['text'] for event, data in events if event == 'token'), done['response'])
+        self.assertEqual(done['image_id'], events[0][1]['image_id'])
+
+
+class TestThumbnailPipeline(unittest.TestCase):
+    """Test background multi-size thumbnails"""
+
+    def setUp(self):
+        """Write a large JPEG into a scratch folder"""
+        import tempfile
+        from PIL import Image
+        from thumbnails import ThumbnailPipeline
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, 'abc123.jpg')
+        Image.new('RGB', (2000, 1500), color='red').save(self.source, 'JPEG')
+        self.pipeline = ThumbnailPipeline(self.folder, sizes={'small': (150, 150), 'large': (640, 640)})
+
+    def tearDown(self):
+        """Remove the scratch folder"""
+        import shutil
+        self.pipeline.shutdown()
+        shutil.rmtree(self.folder)
+
+    def test_generates_every_size(self):
+        """Test all sizes are written from one job and keep the aspect ratio"""
+        from PIL import Image
+        paths = self.pipeline.submit('abc123', self.source).result(10)
+
+        with Image.open(paths['small']) as small, Image.open(paths['large']) as large:
+            self.assertEqual(small.size, (150, 113))
+            self.assertEqual(large.size, (640, 480))
+        self.assertTrue(self.pipeline.is_complete('abc123'))
+
+    def test_remove_for_source(self):
+        """Test thumbnails are removed by their upload's content-addressed path"""
+        self.pipeline.submit('abc123', self.source).result(10)
+        self.assertEqual(self.pipeline.remove_for_source(self.source), 2)
+        self.assertFalse(self.pipeline.is_complete('abc123'))
+
+
+class TestAsgiServing(unittest.TestCase):
+    """Test the ASGI adapter and process offload"""
+
+    def call(self, adapter, method, path, body=b'', headers=(), chunk=None):
+        """Drive one request through the adapter and collect the response"""
+        import asyncio
+        chunks = [body[i:i + chunk] for i in range(0, len(body), chunk)] if chunk and body else [body]
+        messages = [{'type': 'http.request', 'body': part, 'more_body': i < len(chunks) - 1}
+                    for i, part in enumerate(chunks)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+                 'headers': [(k.encode(), v.encode()) for k, v in headers]}
+        asyncio.run(adapter(scope, receive, send))
+        status = sent[0]['status']
+        return status, b''.join(message.get('body', b'') for message in sent[1:])
+
+    def test_same_json_api(self):
+        """Test requests, including chunked bodies, reach the Flask views unchanged"""
+        from asgi import WsgiToAsgiAdapter
+        adapter = WsgiToAsgiAdapter(app, max_threads=2, max_pending=4)
+        body = json.dumps({'message': 'hello there'}).encode()
+        status, payload = self.call(adapter, 'POST', '/api/chat', body,
+                                    [('content-type', 'application/json'), ('content-length', str(len(body)))],
+                                    chunk=5)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(payload)['message'], 'hello there')
+
+        status, payload = self.call(adapter, 'GET', '/api/inference/stats')
+        self.assertIn('offload', json.loads(payload))
+
+    def test_request_body_readline(self):
+        """Test readline across chunks with a size limit, and size=None reading a whole line"""
+        import asyncio
+        import threading
+        from asgi import _RequestBody
+        messages = iter([{'type': 'http.request', 'body': b'first ', 'more_body': True},
+                         {'type': 'http.request', 'body': b'line\nsecond line\n', 'more_body': False}])
+
+        async def receive():
+            return next(messages)
+
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            body = _RequestBody(receive, loop)
+            self.assertEqual(body.readline(3), b'fir')
+            self.assertEqual(body.readline(None), b'st line\n')
+            self.assertEqual(body.readline(), b'second line\n')
+            self.assertEqual(body.readline(None), b'')
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def test_rejects_when_saturated(self):
+        """Test requests beyond max_pending get 503 without running the app"""
+        from asgi import WsgiToAsgiAdapter
+        adapter = WsgiToAsgiAdapter(app, max_threads=1, max_pending=1)
+        adapter.pending = 1
+        status, _ = self.call(adapter, 'GET', '/api/inference/stats')
+        self.assertEqual(status, 503)
+        self.assertEqual(adapter.rejected, 1)
+
+    def test_offload_start_primes_workers(self):
+        """Test start spawns the workers and runs the initializer before any task"""
+        import multiprocessing
+        from offload import ProcessOffload
+        from inference_engine import warm_up_worker
+        self.assertEqual(ProcessOffload(max_workers=0).start(), 0.0)
+
+        offload = ProcessOffload(max_workers=1, initializer=warm_up_worker)
+        try:
+            self.assertGreater(offload.start(), 0)
+            self.assertEqual(len(multiprocessing.active_children()), 1)
+            self.assertEqual(offload.run(pow, 2, 10, timeout=30), 1024)
+        finally:
+            offload.shutdown()
+
+    def test_offload_backlog_limit(self):
+        """Test inline offload runs tasks and rejects beyond max_pending"""
+        from offload import ProcessOffload, OffloadBusy
+        offload = ProcessOffload(max_workers=0, max_pending=1)
+        self.assertEqual(offload.run(pow, 2, 10), 1024)
+
+        # Hold the only slot with a task that has not finished
+        offload._slots.acquire()
+        with self.assertRaises(OffloadBusy):
+            offload.submit(pow, 2, 10)
+        self.assertEqual(offload.get_stats()['rejected'], 1)
+
+
+class TestResultCache(unittest.TestCase):
+    """Test two-tier inference result cache"""
+
+    def setUp(self):
+        """Set up cache backed by a test database"""
+        from result_cache import ResultCache
+        self.db = Database('test_chatbot.db')
+        self.cache = ResultCache(self.db, max_entries=2, model_version='cnn|nlp')
+
+    def tearDown(self):
+        """Clean up test database"""
+        self.db.close()
+        if os.path.exists('test_chatbot.db'):
+            os.remove('test_chatbot.db')
+
+    def test_hit_after_set_with_normalized_query(self):
+        """Test queries differing only in case and spacing share an entry"""
+        self.cache.set('hash1', 'What is  this?', 'a cat')
+
+        self.assertEqual(self.cache.get('hash1', 'what is this?'), 'a cat')
+        self.assertIsNone(self.cache.get('hash2', 'what is this?'))
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['memory_hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_persistent_tier_and_model_invalidation(self):
+        """Test entries survive a restart but not a model change"""
+        from result_cache import ResultCache
+        self.cache.set('hash1', 'query', 'answer')
+
+        restarted = ResultCache(self.db, model_version='cnn|nlp')
+        self.assertEqual(restarted.get('hash1', 'query'), 'answer')
+        self.assertEqual(restarted.get_stats()['persistent_hits'], 1)
+
+        upgraded = ResultCache(self.db, model_version='cnn|nlp-v2')
+        self.assertIsNone(upgraded.get('hash1', 'query'))
+        self.assertEqual(upgraded.get_stats()['persistent_purged'], 1)
+
+    def test_lru_eviction(self):
+        """Test least recently used entries are evicted past max_entries"""
+        self.cache.set('h1', 'q', 1)
+        self.cache.set('h2', 'q', 2)
+        self.cache.get('h1', 'q')
+        self.cache.set('h3', 'q', 3)
+
+        self.assertEqual(self.cache.get_stats()['size_evictions'], 1)
+        self.assertEqual(self.cache.get_stats()['entries'], 2)
+
+
 class TestUtils(unittest.TestCase):
     """Test utility functions"""
     
@@ -140,6 +887,144 @@ class TestUtils(unittest.TestCase):
         sanitized = sanitize_input(long_input, max_length=100)
         
         self.assertEqual(len(sanitized), 100)
+    
+    def test_sanitize_input_non_ascii(self):
+        """Test sanitization of non-ASCII text and keyword extraction"""
+        from utils import extract_keywords
+        self.assertEqual(sanitize_input("  café {x}; <b>  "), "café x b")
+        self.assertEqual(extract_keywords("What is the colour of the sky"), ['what', 'colour', 'sky'])
+
+
+class TestPreprocessImages(unittest.TestCase):
+    """Test batched image preprocessing"""
+
+    def setUp(self):
+        """Create a small test image"""
+        import numpy as np
+        from PIL import Image
+        self.image_path = 'test_preprocess.png'
+        pixels = np.random.randint(0, 256, size=(120, 160, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(self.image_path)
+
+    def tearDown(self):
+        """Remove test image"""
+        if os.path.exists(self.image_path):
+            os.remove(self.image_path)
+
+    def test_matches_single_image_preprocessing(self):
+        """Test batch output matches preprocess_image for paths and buffers"""
+        import numpy as np
+        from utils import preprocess_image, preprocess_images
+        with open(self.image_path, 'rb') as f:
+            buffer = f.read()
+
+        batch, failed = preprocess_images([self.image_path, buffer])
+        expected = preprocess_image(self.image_path)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(batch.shape, (2, 224, 224, 3))
+        self.assertEqual(batch.dtype, np.float32)
+        np.testing.assert_allclose(batch[0], expected[0], atol=1e-6)
+        np.testing.assert_allclose(batch[1], expected[0], atol=1e-6)
+
+    def test_nchw_layout_and_failures(self):
+        """Test channels-first layout, mean/std normalization and undecodable items"""
+        from utils import preprocess_images, IMAGENET_MEAN, IMAGENET_STD
+        batch, failed = preprocess_images([self.image_path, b'not an image'], layout='NCHW',
+                                          mean=IMAGENET_MEAN, std=IMAGENET_STD)
+
+        self.assertEqual(batch.shape, (2, 3, 224, 224))
+        self.assertEqual(failed, [1])
+        self.assertFalse(batch[1].any())
+
+
+class TestImageHandle(unittest.TestCase):
+    """Test single-decode image handle"""
+
+    def setUp(self):
+        """Create a JPEG test image"""
+        import io
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (200, 30, 30)).save(buffer, 'JPEG')
+        self.image_bytes = buffer.getvalue()
+
+    def test_header_only_operations_do_not_decode(self):
+        """Test validation and metadata come from the header"""
+        from utils import ImageHandle
+        handle = ImageHandle(self.image_bytes)
+
+        self.assertTrue(handle.is_valid())
+        info = handle.info()
+        self.assertEqual((info['width'], info['height'], info['format']), (640, 480, 'JPEG'))
+        self.assertEqual(handle.decode_count, 0)
+
+    def test_single_decode_per_upload(self):
+        """Test tensor and thumbnail share one decode"""
+        from utils import ImageHandle
+        handle = ImageHandle(self.image_bytes)
+        handle.is_valid()
+        handle.info()
+        tensor = handle.to_tensor()
+        thumbnail = handle.thumbnail((150, 150))
+
+        self.assertEqual(tensor.shape, (1, 224, 224, 3))
+        self.assertEqual(thumbnail.size, (150, 113))
+        self.assertEqual(handle.decode_count, 1)
+
+    def test_invalid_bytes(self):
+        """Test non-image data is rejected from the header"""
+        from utils import ImageHandle, sniff_image_header
+        self.assertFalse(ImageHandle(b'GIF8 not really an image').is_valid())
+        self.assertIsNone(sniff_image_header(self.image_bytes[:4]))
+
+
+class TestInferenceScheduler(unittest.TestCase):
+    """Test micro-batching inference scheduler"""
+
+    def setUp(self):
+        """Set up scheduler with a recording predict function"""
+        from inference_engine import InferenceScheduler
+        self.batch_sizes = []
+
+        def predict(batch):
+            self.batch_sizes.append(len(batch))
+            return batch.sum(axis=1)
+
+        self.scheduler = InferenceScheduler(predict, max_batch_size=4, max_wait_ms=50)
+
+    def tearDown(self):
+        """Stop scheduler thread"""
+        self.scheduler.stop()
+
+    def test_concurrent_requests_are_batched(self):
+        """Test concurrent submissions share a forward pass and get their own result"""
+        import numpy as np
+        futures = [self.scheduler.submit(np.full((1, 3), i, dtype=np.float32)) for i in range(8)]
+        results = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(results, [3.0 * i for i in range(8)])
+        self.assertTrue(all(size <= 4 for size in self.batch_sizes))
+        self.assertLess(len(self.batch_sizes), 8)
+
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['total_samples'], 8)
+        self.assertIn('p99', stats['queue_wait_ms'])
+
+    def test_predict_error_propagates(self):
+        """Test forward pass errors are raised to every caller"""
+        import numpy as np
+        from inference_engine import InferenceScheduler
+
+        def failing_predict(batch):
+            raise ValueError('model failure')
+
+        scheduler = InferenceScheduler(failing_predict, max_batch_size=2, max_wait_ms=1)
+        try:
+            with self.assertRaises(ValueError):
+                scheduler.predict(np.zeros((1, 3)), timeout=5)
+        finally:
+            scheduler.stop()
 
 
 class TestModelHandler(unittest.TestCase):
@@ -169,8 +1054,344 @@ class TestModelHandler(unittest.TestCase):
         
         self.assertIsInstance(response, str)
         self.assertGreater(len(response), 0)
+    
+    def test_prototype_backend(self):
+        """Test the prototype backend pools features and is keyed separately in the result cache"""
+        import numpy as np
+        from model_handler import ModelHandler
+        handler = ModelHandler(backend='prototype', quantize=True)
+        features = handler.extract_features(np.ones((2, 8, 8, 3), dtype=np.float32))
+        
+        self.assertEqual(features.shape, (2, 3))
+        self.assertEqual(handler.describe(features[0]), [])
+        self.assertEqual(handler.warm_up(), {})
+        self.assertEqual(handler.version, 'mobilenet_v2|distilbert-base-uncased|prototype|int8')
+
+
+class FakeTokenizer:
+    """Word-level stand-in for a Hugging Face tokenizer, recording each batch it is called with"""
+    
+    pad_token_id = 0
+    do_lower_case = True
+    
+    def __init__(self):
+        self.calls = []
+    
+    def __call__(self, texts, truncation=False, max_length=None):
+        self.calls.append(list(texts))
+        rows = [[101] + [len(word) + 1000 for word in text.split()] + [102] for text in texts]
+        return {'input_ids': [row[:max_length - 1] + [102] if truncation and len(row) > max_length else row
+                              for row in rows]}
 
 
+class TestTextPipeline(unittest.TestCase):
+    """Test batched, cached tokenization"""
+    
+    def setUp(self):
+        """Set up a pipeline over the fake tokenizer"""
+        from text_pipeline import TextPipeline
+        self.tokenizer = FakeTokenizer()
+        self.pipeline = TextPipeline(lambda: self.tokenizer, max_length=16, cache_size=2, pad_to_multiple_of=4)
+    
+    def test_normalize_text(self):
+        """Test normalization folds whitespace and drops zero-width characters but keeps markup"""
+        from text_pipeline import normalize_text
+        self.assertEqual(normalize_text("  What\tis <b>this</b>?\n"), "What is <b>this</b>?")
+        self.assertEqual(normalize_text("zero\u200bwidth\xa0café", lowercase=True), "zerowidth café")
+    
+    def test_dynamic_padding(self):
+        """Test a batch is padded to its longest row rounded up, and truncated to max_length"""
+        batch = self.pipeline.encode(["one two", "one two three four five"])
+        self.assertEqual(batch['input_ids'].shape, (2, 8))
+        self.assertEqual(batch['attention_mask'].sum(axis=1).tolist(), [4, 7])
+        self.assertEqual(batch['input_ids'][0, 4:].tolist(), [0, 0, 0, 0])
+        
+        batch = self.pipeline.encode([' '.join(['word'] * 40)])
+        self.assertEqual(batch['input_ids'].shape, (1, 16))
+    
+    def test_token_cache(self):
+        """Test repeated queries skip the tokenizer and the LRU stays bounded"""
+        self.pipeline.encode(["What is this", "what  is THIS", "a dog"])
+        self.pipeline.encode(["What is this", "a cat"])
+        
+        self.assertEqual(self.tokenizer.calls, [['what is this', 'a dog'], ['a cat']])
+        stats = self.pipeline.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 3, 2))
+
+
+class TestFeatureStore(unittest.TestCase):
+    """Test the memory-mapped feature vector store"""
+    
+    def setUp(self):
+        """Create a scratch store directory"""
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """Remove the scratch store directory"""
+        import shutil
+        shutil.rmtree(self.directory)
+    
+    def open_store(self, **kwargs):
+        from feature_store import FeatureStore
+        return FeatureStore(directory=self.directory, model_version='v1', **kwargs)
+    
+    def test_add_search_remove(self):
+        """Test nearest neighbours, removal and persistence across reopening"""
+        import numpy as np
+        store = self.open_store(block_rows=2)
+        self.assertIsNone(store.get(1))
+        for image_id, vector in ((1, [1, 0, 0]), (2, [0.9, 0.1, 0]), (3, [0, 1, 0]), (4, [-1, 0, 0])):
+            store.add(image_id, np.array(vector, dtype=np.float32))
+        
+        self.assertEqual([image_id for image_id, _ in store.similar(1, k=2)], [2, 3])
+        self.assertAlmostEqual(store.search([0, 2, 0], k=1)[0][1], 1.0, places=3)
+        self.assertTrue(store.remove(2))
+        self.assertIsNone(store.get(2))
+        
+        reopened = self.open_store()
+        np.testing.assert_allclose(reopened.get(3), [0, 1, 0])
+        self.assertEqual([image_id for image_id, _ in reopened.similar(1, k=3)], [3, 4])
+        self.assertEqual(reopened.get_stats()['bytes'], 4 * (8 + 3 * 2))
+    
+    def test_model_change_starts_over(self):
+        """Test vectors from another model version are discarded"""
+        from feature_store import FeatureStore
+        self.open_store().add(1, [1.0, 2.0])
+        store = FeatureStore(directory=self.directory, model_version='v2')
+        self.assertIsNone(store.get(1))
+        store.add(1, [1.0, 2.0, 3.0])
+        self.assertEqual(store.dim, 3)
+    
+    def test_ivf_index(self):
+        """Test the coarse index scores a fraction of the rows and finds the same neighbour"""
+        import numpy as np
+        rng = np.random.default_rng(1)
+        centers = rng.normal(size=(16, 32))
+        vectors = centers[np.arange(2000) % 16] + rng.normal(scale=0.05, size=(2000, 32))
+        exact = self.open_store(index_lists=0)
+        for image_id, vector in enumerate(vectors):
+            exact.add(image_id, vector)
+        indexed = self.open_store(index_lists=16, index_probes=2, index_min_rows=100)
+        indexed.build_index()
+        
+        for query in centers[:4] + rng.normal(scale=0.05, size=(4, 32)):
+            self.assertEqual(indexed.search(query, k=1)[0][0], exact.search(query, k=1)[0][0])
+        stats = indexed.get_stats()
+        self.assertEqual(stats['index_builds'], 1)
+        self.assertLess(stats['rows_scanned'], 4 * 2000 / 2)
+
+
+class TestIntentRouter(unittest.TestCase):
+    """Test compiled keyword routing of the canned responses"""
+    
+    def setUp(self):
+        """Set up a router with a phrase and overlapping keywords"""
+        from intent_router import IntentRouter
+        self.router = IntentRouter(default="default: {message}")
+        self.router.add('greeting', ['hello', 'hi'], "greeting")
+        self.router.add('usage', ['how', 'how do i'], "usage")
+        self.router.add('thanks', ['thank you'], "thanks {message}")
+    
+    def test_matches_whole_words_only(self):
+        """Test 'hi' does not match inside "this" and keywords ignore case and punctuation"""
+        self.assertIsNone(self.router.route("What is this?"))
+        self.assertEqual(self.router.route("Oh, HI there!").name, 'greeting')
+        self.assertEqual(self.router.respond("this", message="this"), "default: this")
+    
+    def test_phrases_and_priority(self):
+        """Test multi-word keywords and that earlier intents win"""
+        self.assertEqual(self.router.route("thank you so much").name, 'thanks')
+        self.assertIsNone(self.router.route("thank goodness"))
+        self.assertEqual(self.router.route("how do I say hello").name, 'greeting')
+        self.assertEqual(self.router.respond("Thank you {x}", message="Thank you {x}"), "thanks Thank you {x}")
+    
+    def test_app_responses(self):
+        """Test the app's canned responses route on words, not substrings"""
+        from app import generate_mock_response, generate_text_response
+        self.assertTrue(generate_text_response("Hi!").startswith("Hello!"))
+        self.assertTrue(generate_text_response("Is this working?").startswith("I received your message"))
+        self.assertTrue(generate_mock_response('a.png', "Explain how").startswith("The image shows"))
+        self.assertIn("'a.png'", generate_mock_response('a.png', "What is it?"))
+        self.assertIn("'a.png'", generate_mock_response('a.png', "What's in this picture?"))
+        self.assertTrue(generate_mock_response('a.png', "How's it look?").startswith("The image shows"))
+        self.assertTrue(generate_text_response("how's this work").startswith("To use this chatbot"))
+
+
+class TestBenchmarkReport(unittest.TestCase):
+    """Test benchmark summaries and regression comparison"""
+    
+    def test_summarize_percentiles(self):
+        """Test latency entries are in milliseconds with nearest-rank percentiles"""
+        from benchmarks.report import summarize
+        entry = summarize([i / 1000 for i in range(1, 101)])
+        self.assertEqual((entry['samples'], entry['min'], entry['p50'], entry['p95'], entry['p99']), (100, 1, 51, 96, 100))
+        self.assertAlmostEqual(entry['mean'], 50.5)
+    
+    def test_compare_flags_regressions(self):
+        """Test slower latencies and lower rates beyond the threshold fail, and tiny deltas do not"""
+        from benchmarks.report import Report, compare
+        latency = lambda p50: {'unit': 'ms', 'p50': p50}
+        baseline = Report({'slow': latency(10.0), 'fast': latency(10.0), 'tiny': latency(0.001),
+                           'rps': {'unit': 'req/s', 'value': 100.0}, 'gone': latency(1.0)}, meta={})
+        current = Report({'slow': latency(12.0), 'fast': latency(5.0), 'tiny': latency(0.002),
+                          'rps': {'unit': 'req/s', 'value': 80.0}, 'added': latency(1.0)}, meta={})
+        statuses = {row[0]: row[4] for row in compare(baseline, current, threshold=0.1)}
+        self.assertEqual(statuses, {'slow': 'regression', 'fast': 'improvement', 'tiny': 'ok',
+                                    'rps': 'regression', 'gone': 'missing', 'added': 'new'})
+        statuses = {row[0]: row[4] for row in compare(baseline, current, threshold=0.25)}
+        self.assertEqual((statuses['slow'], statuses['rps']), ('ok', 'ok'))
+
+class TestMetrics(unittest.TestCase):
+    """Test latency histograms, spans and the /metrics endpoint"""
+    
+    def test_histogram_and_spans(self):
+        """Test buckets render cumulatively and disabled registries record nothing"""
+        from metrics import MetricsRegistry
+        registry = MetricsRegistry(namespace='test', buckets=(0.1, 1.0))
+        registry.stages.observe(0.05, 'a"b')
+        registry.stages.observe(0.5, 'a"b')
+        with registry.span('block'):
+            pass
+        registry.timed('call')(lambda: None)()
+        text = registry.render()
+        self.assertIn('test_stage_duration_seconds_bucket{stage="a\\"b",le="0.1"} 1', text)
+        self.assertIn('test_stage_duration_seconds_bucket{stage="a\\"b",le="+Inf"} 2', text)
+        self.assertIn('test_stage_duration_seconds_count{stage="block"} 1', text)
+        self.assertIn('test_stage_duration_seconds_count{stage="call"} 1', text)
+        
+        registry.enabled = False
+        with registry.span('block'):
+            pass
+        self.assertIn('test_stage_duration_seconds_count{stage="block"} 1', registry.render())
+
+    def test_timed_iter_streams_items(self):
+        """Test timed iteration hands items on as produced and records one stage at the end"""
+        from metrics import MetricsRegistry
+        registry = MetricsRegistry(namespace='test')
+        produced = []
+
+        def tokens():
+            for token in ('a', 'b', 'c'):
+                produced.append(token)
+                yield token
+
+        stream = registry.timed_iter('respond', tokens())
+        self.assertEqual(next(stream), 'a')
+        self.assertEqual(produced, ['a'])
+        self.assertIn('test_stage_duration_seconds_count{stage="respond"} 0', registry.render())
+        self.assertEqual(list(stream), ['b', 'c'])
+        self.assertIn('test_stage_duration_seconds_count{stage="respond"} 1', registry.render())
+
+    def test_metrics_endpoint(self):
+        """Test requests, their stages and component statistics are exported"""
+        client = app.test_client()
+        client.post('/api/chat', json={'message': 'hello'}).close()
+        client.get('/no/such/page').close()
+        response = client.get('/metrics')
+        text = response.get_data(as_text=True)
+        
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('chatbot_request_duration_seconds_count{method="POST",endpoint="chat",status="200"}', text)
+        self.assertIn('endpoint="unmatched",status="404"', text)
+        for stage in ('chat.respond', 'db.add_chat_message'):
+            self.assertIn(f'chatbot_stage_duration_seconds_count{{stage="{stage}"}}', text)
+        for name in ('chatbot_requests_in_flight', 'chatbot_inference_queue_depth',
+                     'chatbot_result_cache_hit_rate', 'chatbot_db_connections_opened_total'):
+            self.assertIn(f'\n{name} ', text)
+
+class TestProfiler(unittest.TestCase):
+    """Test the sampling profiler, slow-request capture and the admin endpoints"""
+    
+    def test_profiler_collapsed_stacks(self):
+        """Test every thread is sampled for the requested time and one profile runs at a time"""
+        import threading
+        import time
+        from profiler import SamplingProfiler
+        profiler = SamplingProfiler(interval_ms=2)
+        done = threading.Event()
+        
+        def busy_loop():
+            while not done.is_set():
+                sum(range(1000))
+        
+        worker = threading.Thread(target=busy_loop)
+        worker.start()
+        try:
+            profiler.start(0.2)
+            with self.assertRaises(RuntimeError):
+                profiler.start(1)
+            time.sleep(0.3)
+        finally:
+            done.set()
+            worker.join()
+        
+        self.assertFalse(profiler.get_status()['running'])
+        lines = profiler.collapsed().splitlines()
+        self.assertTrue(any('busy_loop (test_file.py:' in line for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        with self.assertRaises(ValueError):
+            profiler.start(0)
+    
+    def test_slow_requests_keep_stages_and_stacks(self):
+        """Test only requests over the threshold are kept, newest first, within the capacity"""
+        import time
+        from metrics import span
+        from profiler import SlowRequestLog
+        
+        def wsgi_app(environ, start_response):
+            with span('test.work'):
+                time.sleep(float(environ['QUERY_STRING']))
+            start_response('200 OK', [])
+            return [b'ok']
+        
+        log = SlowRequestLog(threshold_ms=50, capacity=2, interval_ms=5)
+        app_under_test = log.instrument_wsgi(wsgi_app)
+        for delay in ('0.15', '0', '0.06', '0.07'):
+            body = app_under_test({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/work', 'QUERY_STRING': delay},
+                                  lambda status, headers, exc_info=None: None)
+            body.close()
+        
+        recent = log.recent()
+        self.assertEqual([entry['path'] for entry in recent], ['/work?0.07', '/work?0.06'])
+        self.assertEqual(recent[0]['status'], 200)
+        self.assertEqual(recent[0]['stages'][0]['stage'], 'test.work')
+        self.assertGreater(recent[0]['stages'][0]['total_ms'], 60)
+        self.assertIn('wsgi_app (test_file.py:', recent[0]['top_stacks'][0]['stack'])
+        self.assertEqual(log.get_stats()['recorded'], 3)
+        # The watchdog idles once nothing is in flight
+        self.assertFalse(log._busy.is_set())
+
+    def test_admin_endpoints(self):
+        """Test admin endpoints need the token, and serve profiles and slow requests"""
+        from unittest import mock
+        from app import profiler, slow_requests
+        from config import Config
+        client = app.test_client()
+        self.assertEqual(client.get('/api/admin/slow-requests').status_code, 404)
+        
+        headers = {'X-Admin-Token': 'secret'}
+        with mock.patch.object(Config, 'ADMIN_TOKEN', 'secret'), mock.patch.object(slow_requests, 'threshold', 1e-6):
+            self.assertEqual(client.get('/api/admin/slow-requests', headers={'X-Admin-Token': 'wrong'}).status_code, 403)
+            client.post('/api/chat', json={'message': 'hello'}).close()
+            data = client.get('/api/admin/slow-requests?limit=5', headers=headers).get_json()
+            chat = next(entry for entry in data['requests'] if entry['path'] == '/api/chat')
+            self.assertEqual(chat['endpoint'], 'chat')
+            self.assertIn('chat.respond', [stage['stage'] for stage in chat['stages']])
+            
+            self.assertEqual(client.post('/api/admin/profiler', json={'seconds': -1}, headers=headers).status_code, 400)
+            started = client.post('/api/admin/profiler', json={'seconds': 5, 'fraction': 1}, headers=headers).get_json()
+            self.assertTrue(started['profile']['running'])
+            client.post('/api/chat', json={'message': 'hello'}).close()
+            stopped = client.delete('/api/admin/profiler', headers=headers).get_json()
+            self.assertFalse(stopped['profile']['running'])
+            self.assertGreaterEqual(stopped['profile']['requests_sampled'], 1)
+            
+            download = client.get('/api/admin/profiler/collapsed', headers=headers)
+            self.assertIn('attachment', download.headers['Content-Disposition'])
+            self.assertEqual(download.get_data(as_text=True), profiler.collapsed())
+
 def run_tests():
     """Run all tests"""
     unittest.main()